@@ -30,4 +30,11 @@ class PARAM_VALIDATION(str, Enum):
     ADDRESS = "address"
 
 
+class OUTBOX_STATUS(str, Enum):
+    PENDING = "pending"
+    SENDING = "sending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+
+
 DEFAULT_SETTING_ID = "fe25ab8b-59ea-4e5b-b9b8-6f3a4dfea98a"
@@ -1,9 +1,11 @@
 import re
-from typing import AsyncGenerator, Awaitable, Callable, TypeVar
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, TypeVar
 
 import asyncpg
 from app.configs import env_config
 from app.scripts.init_sql import create_custom_functions_and_triggers
+from app.utils.db_lease import LeaseTracker
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 
@@ -67,6 +69,34 @@ engine = create_async_engine(
     pool_recycle=300,  # Recycle connections after 5 minutes
     pool_pre_ping=True,  # Verify connections before using them
 )
+# Đo thời gian giữ connection và phát hiện connection bị giữ qua lời gọi LLM/HTTP
+lease_tracker = LeaseTracker(debug=env_config.DB_LEASE_DEBUG)
+lease_tracker.install(engine)
+
+# Engine riêng cho SQL do agent sinh ra (execute_query_on_sheet_rows): transaction
+# read-only, statement_timeout và pool nhỏ riêng để query nặng hoặc nhiều query
+# cùng lúc không chiếm hết connection của pool chính
+agent_query_engine = create_async_engine(
+    env_config.DATABASE_URL,
+    echo=False,
+    future=True,
+    pool_size=env_config.AGENT_QUERY_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=10,
+    pool_recycle=300,
+    pool_pre_ping=True,
+    connect_args={
+        "server_settings": {
+            "application_name": "agent_query",
+            "default_transaction_read_only": "on",
+            "statement_timeout": str(env_config.AGENT_QUERY_TIMEOUT_MS),
+            "idle_in_transaction_session_timeout": str(
+                env_config.AGENT_QUERY_TIMEOUT_MS * 2
+            ),
+        }
+    },
+)
+
 # Create session factory
 async_session = async_sessionmaker(
     engine,
@@ -133,6 +163,7 @@ async def init_default_setting():
 async def shutdown_models():
     """Close all connections during application shutdown"""
     await engine.dispose()
+    await agent_query_engine.dispose()
 
 
 async def process_background_with_session(func, *args, **kwargs):
@@ -160,3 +191,23 @@ async def with_session(func: Callable[[AsyncSession], Awaitable[T]]) -> T:
         except Exception:
             await session.rollback()
             raise
+
+
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """
+    Short-lived session for a group of queries: commits on exit and returns the
+    connection to the pool. Close the scope before awaiting LLM/HTTP calls.
+    """
+    async with async_session() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+def ensure_connection_released(operation: str):
+    """Debug check before an external call, see LeaseTracker.ensure_released"""
+    lease_tracker.ensure_released(operation)
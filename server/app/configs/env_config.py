@@ -12,11 +12,73 @@ CLIENT_URLS = os.getenv("CLIENT_URLS")
 API_VERSION = os.getenv("API_VERSION", "v2")
 PAGE_ACCESS_TOKEN = os.getenv("PAGE_ACCESS_TOKEN")
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
+APP_SECRET = os.getenv("APP_SECRET")
 PAGE_ID = os.getenv("PAGE_ID")
+MESSENGER_BATCH_MODE = os.getenv("MESSENGER_BATCH_MODE", "false").lower() == "true"
+# Gửi từng section (ngăn cách bởi ---) ngay khi LLM sinh xong thay vì chờ cả câu trả lời
+AGENT_STREAMING = os.getenv("AGENT_STREAMING", "false").lower() == "true"
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Dung lượng tối đa (byte) của cache short-term memory các guest trong process
+CONVERSATION_CACHE_MAX_BYTES = int(
+    os.getenv("CONVERSATION_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+# Rút gọn message history trước khi lưu/replay: bỏ thinking của model và cắt các
+# kết quả tool dài hơn số token này (0 để giữ nguyên)
+HISTORY_DROP_THINKING = os.getenv("HISTORY_DROP_THINKING", "true").lower() == "true"
+HISTORY_TOOL_RETURN_MAX_TOKENS = int(os.getenv("HISTORY_TOOL_RETURN_MAX_TOKENS", 500))
+# Giới hạn token của prompt ghép cho agent (sheets, summary, history, scripts) và
+# file tokenizer.json dùng để đếm token (không có thì ước lượng theo số ký tự)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 32000))
+PROMPT_TOKENIZER_PATH = os.getenv("PROMPT_TOKENIZER_PATH")
+# Nén lại các chat history cũ (định dạng legacy) trong background khi khởi động
+CHAT_HISTORY_MIGRATION = os.getenv("CHAT_HISTORY_MIGRATION", "false").lower() == "true"
+# Raise khi một task giữ DB connection qua lời gọi LLM/HTTP (chỉ nên bật khi dev)
+DB_LEASE_DEBUG = os.getenv("DB_LEASE_DEBUG", "false").lower() == "true"
+# Pool riêng (read-only) cho SQL do agent sinh ra: số connection, thời gian chạy
+# tối đa của một query và giới hạn số dòng / số byte kết quả trả về cho model
+AGENT_QUERY_POOL_SIZE = int(os.getenv("AGENT_QUERY_POOL_SIZE", 5))
+AGENT_QUERY_TIMEOUT_MS = int(os.getenv("AGENT_QUERY_TIMEOUT_MS", 5000))
+AGENT_QUERY_MAX_ROWS = int(os.getenv("AGENT_QUERY_MAX_ROWS", 200))
+AGENT_QUERY_MAX_BYTES = int(os.getenv("AGENT_QUERY_MAX_BYTES", 32 * 1024))
+# Định dạng kết quả query trả về cho model (xml, tsv hoặc json) và số ký tự tối đa
+# của một ô text
+AGENT_QUERY_RESULT_FORMAT = os.getenv("AGENT_QUERY_RESULT_FORMAT", "xml")
+AGENT_QUERY_MAX_CELL_CHARS = int(os.getenv("AGENT_QUERY_MAX_CELL_CHARS", 500))
+# Các fallback chạy ngay trong tool khi query của agent không có kết quả (theo thứ
+# tự, để trống để tắt): or_mode, hybrid; và số dòng tối đa của hybrid search
+AGENT_QUERY_FALLBACKS = [
+    step.strip()
+    for step in os.getenv("AGENT_QUERY_FALLBACKS", "or_mode,hybrid").split(",")
+    if step.strip()
+]
+AGENT_QUERY_FALLBACK_LIMIT = int(os.getenv("AGENT_QUERY_FALLBACK_LIMIT", 10))
+# Cache kết quả SQL của agent (dùng chung giữa các guest): dung lượng tối đa
+# (byte) và thời gian giữ một kết quả
+AGENT_QUERY_CACHE_MAX_BYTES = int(
+    os.getenv("AGENT_QUERY_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+)
+AGENT_QUERY_CACHE_TTL_SECONDS = int(os.getenv("AGENT_QUERY_CACHE_TTL_SECONDS", 600))
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_SCRIPT_COLLECTION_NAME = os.getenv("QDRANT_SCRIPT_COLLECTION_NAME")
 QDRANT_SHEET_COLLECTION_NAME = os.getenv("QDRANT_SHEET_COLLECTION_NAME")
+# Cấu hình collection Qdrant (áp dụng cả cho collection đã có khi khởi động):
+# vector jina lượng tử hóa int8 trong RAM (rescore bằng vector gốc), vector gốc
+# mặc định để trên disk khi lượng tử hóa (giữ cả hai trong RAM tốn hơn không
+# lượng tử hóa), tham số HNSW
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "true").lower() == "true"
+QDRANT_QUANTIZATION_OVERSAMPLING = float(
+    os.getenv("QDRANT_QUANTIZATION_OVERSAMPLING", 2.0)
+)
+QDRANT_ON_DISK_VECTORS = (
+    os.getenv("QDRANT_ON_DISK_VECTORS", str(QDRANT_QUANTIZATION)).lower() == "true"
+)
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", 16))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", 100))
+# Vector jina cắt còn QDRANT_MRL_DIMENSIONS chiều (Matryoshka, 0 để tắt) cho
+# collection mới: prefetch rộng gấp QDRANT_MRL_OVERSAMPLING lần trên vector nhỏ
+# rồi tính lại điểm bằng vector đầy đủ
+QDRANT_MRL_DIMENSIONS = int(os.getenv("QDRANT_MRL_DIMENSIONS", 256))
+QDRANT_MRL_OVERSAMPLING = int(os.getenv("QDRANT_MRL_OVERSAMPLING", 4))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 JINA_API_KEY = os.getenv("JINA_API_KEY")
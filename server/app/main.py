@@ -11,6 +11,10 @@ if True:
     from app.configs import database, env_config
     from app.middleware import catch_exceptions_middleware
     from app.routes import v1_include_router, v2_include_router
+    from app.services import chat_history_service, sheet_service
+    from app.services.integrations import outbox_service, sheet_rag_service
+    from app.services.integrations.messenger_dispatcher import dispatcher
+    from app.utils import asyncio_utils
 # cors config
 origins = env_config.CLIENT_URLS.split(",")
 
@@ -19,8 +23,21 @@ origins = env_config.CLIENT_URLS.split(",")
 async def lifespan(app: FastAPI):
     # Startup: Create tables
     await database.init_models()
+    # Dictionary nén chat history, phải được nạp trước khi lưu chat history mới
+    await chat_history_service.load_codec_dictionaries_on_startup()
+    if env_config.CHAT_HISTORY_MIGRATION:
+        asyncio_utils.run_background(chat_history_service.migrate_chat_histories)
+    # Index tìm kiếm không dấu cho các sheet import trước khi có index này
+    asyncio_utils.run_background(sheet_service.ensure_unaccent_indexes)
+    # Payload row_id (group-by) cho các chunk sheet được index trước đó
+    asyncio_utils.run_background(sheet_rag_service.backfill_row_ids)
+    # Start delivering agent replies from the outbox (resumes unsent replies)
+    outbox_service.start_worker()
     yield
-    # Shutdown: Dispose of the engine
+    # Shutdown: Stop the outbox worker, the outbound Messenger dispatcher
+    # and dispose of the engine
+    await outbox_service.stop_worker()
+    await dispatcher.close()
     await database.shutdown_models()
 
 
@@ -2,11 +2,13 @@ import datetime
 import uuid
 from typing import List
 
-from app.configs.constants import CHAT_ASSIGNMENT
+from app.configs.constants import CHAT_ASSIGNMENT, OUTBOX_STATUS
 from app.configs.database import Base
 from sqlalchemy import (
+    BigInteger,
     Column,
     DateTime,
+    Float,
     ForeignKey,
     Integer,
     LargeBinary,
@@ -315,6 +317,20 @@ class ChatHistory(Base):
     created_at = Column(DateTime, default=datetime.datetime.now)
 
 
+class CompressionDictionary(Base):
+    """
+    Zstd dictionary dùng để nén ChatHistory.content / qa_content, id là dict id
+    ghi trong header của dữ liệu đã nén. Dictionary mới nhất được dùng để nén.
+    """
+
+    __tablename__ = "compression_dictionaries"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    data = Column(LargeBinary, nullable=False)
+    sample_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+
 class Notification(Base):
     """
     params: [
@@ -409,3 +425,50 @@ class Setting(Base):
             "details": self.details if self.details else {},
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
+
+
+class WebhookEvent(Base):
+    """
+    Webhook event của Messenger đã được xử lý, dùng để chống xử lý trùng khi
+    Facebook gửi lại (redeliver) webhook.
+    event_key: message.mid, hoặc "<type>:<sender_id>:<watermark>" cho delivery/read
+    """
+
+    __tablename__ = "webhook_events"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    event_key = Column(String, nullable=False, unique=True, index=True)
+    sender_id = Column(String, nullable=True)
+    watermark = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now, index=True)
+
+
+class OutboxMessage(Base):
+    """
+    Tin nhắn trả lời của agent đang chờ gửi qua Messenger (transactional outbox).
+    Được ghi cùng transaction với các Chat tương ứng, worker gửi theo thứ tự
+    (created_at, sequence) của từng recipient.
+    status: pending | sending | delivered | failed
+    delay_before: số giây hiển thị typing trước khi gửi phần này
+    """
+
+    __tablename__ = "outbox_messages"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    guest_id = Column(
+        String, ForeignKey("guests.id", ondelete="CASCADE"), nullable=False
+    )
+    chat_id = Column(String, ForeignKey("chats.id", ondelete="SET NULL"))
+    recipient_id = Column(String, nullable=False, index=True)
+    sequence = Column(Integer, nullable=False, default=0)
+    payload = Column(JSONB, nullable=False)
+    delay_before = Column(Float, nullable=False, default=0)
+    status = Column(
+        String, nullable=False, default=OUTBOX_STATUS.PENDING.value, index=True
+    )
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, default=datetime.datetime.now, index=True)
+    claimed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    delivered_at = Column(DateTime, nullable=True)
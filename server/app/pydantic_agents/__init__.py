@@ -1,12 +1,19 @@
+from typing import Awaitable, Callable
+
 import logfire
-from app.configs.database import async_session, with_session
+from app.configs import env_config
+from app.configs.database import ensure_connection_released, session_scope, with_session
 from app.dtos.setting_dtos import SettingDetailsDto
 from app.exceptions.custom_exception import ForbiddenError
 from app.models import Script
 from app.pydantic_agents.info import InfoAgentDeps, info_agent
 from app.pydantic_agents.memory import memory_agent
-from app.pydantic_agents.synthetic import SyntheticAgentDeps, create_synthetic_agent
-from app.pydantic_agents.synthetic_tools import get_all_available_sheets
+from app.pydantic_agents.synthetic import SyntheticAgentDeps, get_synthetic_agent
+from app.pydantic_agents.synthetic_tools import (
+    get_output_scanner,
+    get_sheet_contexts,
+    query_result_columns,
+)
 from app.repositories import (
     chat_history_repository,
     guest_repository,
@@ -14,22 +21,49 @@ from app.repositories import (
 )
 from app.services import (
     alert_service,
+    chat_history_service,
     interest_service,
     script_service,
     setting_service,
+    sheet_service,
 )
 from app.services.integrations import script_rag_service
 from app.utils import asyncio_utils
-from app.utils.agent_utils import MessagePart, contains_xml_tags, dump_json_bytes
-from app.utils.message_utils import markdown_remove, parse_and_format_message
+from app.utils.agent_metrics import agent_metrics
+from app.utils.agent_utils import MessagePart
+from app.utils.conversation_cache import ConversationMemory
+from app.utils.message_utils import (
+    StreamingMessageFormatter,
+    markdown_remove,
+    parse_and_format_message,
+)
+from app.utils.prompt_assembler import (
+    AssembledPrompt,
+    PromptAssembler,
+    PromptItem,
+    PromptSection,
+    TokenEstimator,
+)
+from app.utils.script_context import (
+    SCRIPT_CONTEXT_PREFIX,
+    SCRIPT_REFERENCES_PREFIX,
+    ScriptEntry,
+    build_script_entries,
+    missing_references,
+    seen_script_versions,
+)
+from pydantic_ai import Agent
 from pydantic_ai.messages import (
     ModelMessage,
-    ModelMessagesTypeAdapter,
     ModelRequest,
     ModelResponse,
+    PartDeltaEvent,
+    PartStartEvent,
     TextPart,
+    TextPartDelta,
+    ToolCallPart,
 )
-from pydantic_ai.usage import UsageLimits
+from pydantic_ai.usage import Usage, UsageLimits
 
 logfire.configure(send_to_logfire="if-token-present")
 logger = logfire.instrument_pydantic_ai()
@@ -39,6 +73,22 @@ OLD_SCRIPTS_LENGTH = 10
 REMIND_INTERVAL = 5
 OVERLAP_MEMORY_COUNT = 5
 UPDATE_GUEST_INFO_INTERVAL = 3
+# Budget token của từng section trong prompt, tổng giới hạn bởi PROMPT_TOKEN_BUDGET
+SHEETS_TOKEN_BUDGET = 8000
+SUMMARY_TOKEN_BUDGET = 1000
+HISTORY_TOKEN_BUDGET = 12000
+SCRIPTS_TOKEN_BUDGET = 8000
+MAX_COLUMN_DESCRIPTION_CHARS = 300
+PERSISTENCE_INSTRUCTIONS = """
+## PERSISTENCE
+You are an agent - please keep going until the user's query is completely resolved, before ending your turn and yielding back to the user. Only terminate your turn when you are sure that the problem is solved.
+
+## PLANNING
+You MUST plan extensively before each function call, and reflect extensively on the outcomes of the previous function calls.
+"""
+
+token_estimator = TokenEstimator(env_config.PROMPT_TOKENIZER_PATH)
+prompt_assembler = PromptAssembler(env_config.PROMPT_TOKEN_BUDGET)
 
 
 def convert_messages_to_xml(message_histories: list[ModelMessage]) -> str:
@@ -57,224 +107,433 @@ def convert_messages_to_xml(message_histories: list[ModelMessage]) -> str:
     return "\n".join(xml_messages)
 
 
-async def invoke_agent(user_id, user_input: str) -> list[MessagePart]:
-    async with async_session() as db:
-        try:
+def assemble_agent_prompt(
+    user_input: str,
+    memory: ConversationMemory,
+    sheet_contexts: list[str],
+    scored_scripts: list[tuple[Script, float | None]],
+) -> AssembledPrompt:
+    """
+    Chọn các khối của prompt trong giới hạn token. Khi vượt budget: bỏ turn cũ
+    nhất của history trước, rồi đến script có điểm retrieval thấp nhất, rồi sheet.
+    Script đã có trong history được giữ lại chỉ được tham chiếu; nếu turn chứa
+    script bị cắt khỏi history thì ghép lại với script đó ở dạng đầy đủ.
+    history trả về các MemoryTurn, scripts trả về các ScriptEntry.
+    """
+    seen_versions = seen_script_versions(memory.turns)
+    while True:
+        entries = build_script_entries(
+            scored_scripts, seen_versions, script_service.agent_script_to_xml
+        )
+        prompt = prompt_assembler.assemble(
+            _prompt_sections(user_input, memory, sheet_contexts, entries)
+        )
+        kept_versions = seen_script_versions(reversed(prompt.values("history")))
+        if not missing_references(prompt.values("scripts"), kept_versions):
+            return prompt
+        # Chỉ thu hẹp dần để vòng lặp luôn dừng
+        seen_versions = {
+            script_id: version
+            for script_id, version in kept_versions.items()
+            if seen_versions.get(script_id) == version
+        }
+
+
+def _prompt_sections(
+    user_input: str,
+    memory: ConversationMemory,
+    sheet_contexts: list[str],
+    script_entries: list[ScriptEntry],
+) -> list[PromptSection]:
+    count = token_estimator.count
+    return [
+        PromptSection(
+            "instructions",
+            [PromptItem(PERSISTENCE_INSTRUCTIONS, count(PERSISTENCE_INSTRUCTIONS))],
+            priority=5,
+            min_items=1,
+        ),
+        PromptSection(
+            "user_input",
+            [PromptItem(user_input, count(user_input))],
+            priority=5,
+            min_items=1,
+        ),
+        PromptSection(
+            "summary",
+            (
+                [PromptItem(memory.summary, count(memory.summary))]
+                if memory.summary
+                else []
+            ),
+            budget=SUMMARY_TOKEN_BUDGET,
+            priority=4,
+            min_items=1,
+        ),
+        PromptSection(
+            "sheets",
+            [PromptItem(sheet_xml, count(sheet_xml)) for sheet_xml in sheet_contexts],
+            budget=SHEETS_TOKEN_BUDGET,
+            priority=2,
+        ),
+        PromptSection(
+            "scripts",
+            # Script vừa tìm theo điểm giảm dần, script của các turn trước ở cuối
+            [
+                PromptItem(entry, count(entry.xml))
+                for entry in sorted(script_entries, key=lambda e: e.score is None)
+            ],
+            budget=SCRIPTS_TOKEN_BUDGET,
+            priority=1,
+        ),
+        PromptSection(
+            "history",
+            [
+                PromptItem(turn, token_estimator.count_messages(turn.messages))
+                for turn in reversed(memory.turns)
+            ],
+            budget=HISTORY_TOKEN_BUDGET,
+            priority=0,
+        ),
+    ]
+
+
+def build_script_context(entries: list[ScriptEntry]) -> tuple[str, str | None]:
+    """
+    (nội dung gửi cho agent, nội dung lưu cùng turn). Chỉ các script gửi đầy đủ
+    được lưu, tham chiếu thì không cần lưu.
+    """
+    full_xmls = [entry.xml for entry in entries if not entry.is_reference]
+    references = [entry.xml for entry in entries if entry.is_reference]
+    stored = None
+    if full_xmls:
+        scripts_xml = script_service.wrap_scripts_xml(full_xmls)
+        stored = f"{SCRIPT_CONTEXT_PREFIX}\n{scripts_xml}"
+    content = stored or SCRIPT_CONTEXT_PREFIX
+    if references:
+        content += f"\n{SCRIPT_REFERENCES_PREFIX}\n" + "\n".join(references)
+    return content, stored
+
+
+def check_output_safety(output: str):
+    """
+    Chặn output chứa thẻ XML (hoặc kết quả query tsv/json của lượt) có thể bị lộ
+    do prompt injection
+    """
+    if get_output_scanner().contains(output):
+        raise ForbiddenError("Phát hiện nguy hiểm khai thác dữ liệu")
+
+
+def _text_delta(event) -> str | None:
+    """Text mới của một event stream (None nếu không phải text)"""
+    if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart):
+        return event.part.content
+    if isinstance(event, PartDeltaEvent) and isinstance(event.delta, TextPartDelta):
+        return event.delta.content_delta
+    return None
+
+
+async def stream_agent_output(
+    agent: Agent,
+    user_input: str,
+    on_parts: Callable[[list[MessagePart]], Awaitable[None]],
+    **run_kwargs,
+) -> tuple[str, bytes, list[MessagePart], Usage]:
+    """
+    Run the agent node by node (agent.iter) and stream the text of each model
+    response: every completed section (separated by ---) is handed to on_parts
+    while the model is still generating. A response that also calls a tool is
+    not the final answer (same as agent.run): its unsent text is discarded and
+    the run continues with the tool results. Every delta goes through the
+    output scanner before the formatter, so a section is never emitted once a
+    leaked XML tag has been seen.
+
+    Returns:
+        tuple: (full output, new messages json, remaining message parts, usage)
+    """
+    formatter = scan = None
+    async with agent.iter(user_input, **run_kwargs) as run:
+        async for node in run:
+            if not Agent.is_model_request_node(node):
+                continue
+            formatter = StreamingMessageFormatter()
+            # Tạo lại mỗi response: gồm cả kết quả query của các tool vừa chạy
+            scan = get_output_scanner().stream()
+            calls_tool = False
+            new_text_part = False
+            async with node.stream(run.ctx) as response:
+                async for event in response:
+                    if isinstance(event, PartStartEvent):
+                        calls_tool |= isinstance(event.part, ToolCallPart)
+                        new_text_part = isinstance(event.part, TextPart)
+                    delta = _text_delta(event)
+                    if calls_tool or not delta:
+                        continue
+                    # Các TextPart (không rỗng) của một response được nối bằng dòng
+                    # trống, giống output của agent.run
+                    if new_text_part and scan.text:
+                        delta = "\n\n" + delta
+                    new_text_part = False
+                    scan.feed(delta)
+                    if scan.violated:
+                        raise ForbiddenError("Phát hiện nguy hiểm khai thác dữ liệu")
+                    message_parts = formatter.feed(delta)
+                    if message_parts:
+                        await on_parts(message_parts)
+        scan.finish()
+        if scan.violated:
+            raise ForbiddenError("Phát hiện nguy hiểm khai thác dữ liệu")
+        output = run.result.output
+        if scan.text != output:
+            # Response cuối không có text: output là text của response trước đó
+            check_output_safety(output)
+            return (
+                output,
+                run.result.new_messages_json(),
+                parse_and_format_message(output),
+                run.usage(),
+            )
+        return (
+            output,
+            run.result.new_messages_json(),
+            formatter.flush(),
+            run.usage(),
+        )
+
+
+async def invoke_agent(
+    user_id,
+    user_input: str,
+    on_parts: Callable[[list[MessagePart]], Awaitable[None]] | None = None,
+) -> list[MessagePart]:
+    """
+    Generate the agent reply for a guest message.
+    If on_parts is given the reply is streamed: completed sections are passed
+    to on_parts as soon as they are generated and only the rest is returned.
+    """
+    query_result_columns.set([])
+    try:
+        # Gom các truy vấn DB vào một session ngắn, trả connection về pool
+        # trước khi gọi Qdrant/LLM (có thể mất 5-20s)
+        async with session_scope() as db:
             interest_ids = await interest_service.get_interest_ids_from_text(
                 db, user_input
             )
             await guest_repository.add_interests_to_guest_by_id(
                 db, user_id, interest_ids
             )
-            await db.commit()
 
-            chat_histories = await with_session(
-                lambda session: chat_history_repository.get_chat_histories_until_summary(
-                    session, user_id, max_limit=SHORT_TERM_MEMORY_LIMIT
+            # Short-term memory đã decode, chỉ đọc DB khi guest chưa có trong cache
+            memory = await chat_history_service.get_conversation_memory(
+                db, user_id, SHORT_TERM_MEMORY_LIMIT, OVERLAP_MEMORY_COUNT
+            )
+            setting_details = await setting_service.get_setting_details(db)
+
+        # Lấy history_count hiện tại để kiểm tra có nên lấy summary không
+        latest_count = memory.history_count
+        # Chỉ lấy old_script_ids từ OLD_SCRIPTS_LENGTH message cuối cùng
+        old_script_ids = memory.used_script_ids(OLD_SCRIPTS_LENGTH)
+        setting_details = SettingDetailsDto(**setting_details)
+        ensure_connection_released("script_rag_service.search_scored_scripts")
+        scored_scripts: list[tuple[Script, float | None]] = (
+            await script_rag_service.search_scored_scripts(
+                user_input, limit=setting_details.max_script_retrieval
+            )
+        )
+        script_ids_in_old_but_not_in_new = old_script_ids - {
+            script.id for script, _ in scored_scripts
+        }
+        if script_ids_in_old_but_not_in_new:
+            # Script của các turn trước không có điểm, xếp sau các script vừa tìm
+            old_scripts = await with_session(
+                lambda db: script_repository.get_scripts_by_ids(
+                    db, script_ids_in_old_but_not_in_new
                 )
             )
-            previous_summary_chat_history = None
-            if chat_histories and chat_histories[-1].summary:
-                # Nếu có summary, lấy message trước đó để làm history
-                previous_summary_chat_history = chat_histories.pop()
-            # Đảo ngược thứ tự chat_histories để có message mới nhất ở đầu
-            chat_histories = chat_histories[::-1]
-            message_history: list[ModelMessage] = []
+            scored_scripts.extend((script, None) for script in old_scripts)
+        sheet_contexts = await get_sheet_contexts(MAX_COLUMN_DESCRIPTION_CHARS)
+
+        prompt = assemble_agent_prompt(
+            user_input, memory, sheet_contexts, scored_scripts
+        )
+        logfire.info(
+            "Agent prompt: {total_tokens} tokens",
+            guest_id=user_id,
+            total_tokens=prompt.total_tokens,
+            breakdown=prompt.breakdown,
+        )
+
+        message_history: list[ModelMessage] = []
+        if prompt.values("sheets"):
+            sheets_xml = sheet_service.wrap_sheets_xml(prompt.values("sheets"))
             message_history.append(
                 ModelResponse(
                     parts=[
                         TextPart(
-                            content=f"Relevant sheets in XML format that help decide if we need to query from sheets. Carefully study the description and column description of each sheet to decide which sheets should be queried.\n{await get_all_available_sheets(None)}"
+                            content=f"Relevant sheets in XML format that help decide if we need to query from sheets. Carefully study the description and column description of each sheet to decide which sheets should be queried. Long column descriptions are shortened, call get_all_available_sheets for the full details.\n{sheets_xml}"
                         ),
                     ]
                 )
             )
-            if previous_summary_chat_history:
-                # Nếu có summary, thêm nó vào đầu message_history
-                message_history.append(
-                    ModelResponse(
-                        parts=[
-                            TextPart(
-                                content=f"Summary of previous conversation: {previous_summary_chat_history.summary}"
-                            )
-                        ]
-                    )
-                )
-
-            old_script_ids: set[str] = set()
-            # Chỉ lấy old_script_ids từ OLD_SCRIPTS_LENGTH message cuối cùng
-            old_scripts_histories = (
-                chat_histories[-OLD_SCRIPTS_LENGTH:]
-                if len(chat_histories) > OLD_SCRIPTS_LENGTH
-                else chat_histories
-            )
-            for message in old_scripts_histories:
-                if message.used_scripts:
-                    old_script_ids.update(message.used_scripts.split(","))
-
-            if previous_summary_chat_history:
-                overlap_chat_histories = await with_session(
-                    lambda session: chat_history_repository.get_latest_chat_histories_from_datetime(
-                        session,
-                        user_id,
-                        previous_summary_chat_history.created_at,
-                        OVERLAP_MEMORY_COUNT,
-                    )
-                )
-                chat_histories = overlap_chat_histories[::-1] + chat_histories
-            # Xây dựng message_history từ toàn bộ chat_histories
-            for message in chat_histories:
-                model_message = ModelMessagesTypeAdapter.validate_json(message.content)
-                message_history.extend(model_message)
-            setting_details = await setting_service.get_setting_details(db)
-            setting_details = SettingDetailsDto(**setting_details)
-            scripts: list[Script] = (
-                await script_rag_service.search_script_chunks(
-                    user_input, limit=setting_details.max_script_retrieval
-                )
-            )[::-1]
-            script_ids = [script.id for script in scripts]
-            script_ids_in_old_but_not_in_new = old_script_ids - set(script_ids)
-            if script_ids_in_old_but_not_in_new:
-                scripts.extend(
-                    await with_session(
-                        lambda db: script_repository.get_scripts_by_ids(
-                            db, script_ids_in_old_but_not_in_new
+        if prompt.values("summary"):
+            # Nếu có summary, thêm nó vào đầu message_history
+            message_history.append(
+                ModelResponse(
+                    parts=[
+                        TextPart(
+                            content=f"Summary of previous conversation: {memory.summary}"
                         )
-                    )
+                    ]
                 )
-
-            if scripts:
-                script_context = await script_service.agent_scripts_to_xml(scripts)
-            else:
-                script_context = ""
-            # Lấy history_count hiện tại để kiểm tra có nên lấy summary không
-            latest_count = await chat_history_repository.get_latest_history_count(
-                db, user_id
             )
+        # message_history gồm các turn từ summary gần nhất (có overlap), turn cũ
+        # nhất bị bỏ trước khi vượt budget
+        for turn in reversed(prompt.values("history")):
+            message_history.extend(turn.messages)
 
-            synthetic_agent_deps = SyntheticAgentDeps(
-                user_input=user_input, user_id=user_id
+        # Script liên quan nhất ở cuối, gần câu hỏi của khách nhất
+        script_entries: list[ScriptEntry] = prompt.values("scripts")[::-1]
+        script_ids = [
+            entry.script.id for entry in script_entries if entry.score is not None
+        ]
+        synthetic_agent_deps = SyntheticAgentDeps(
+            user_input=user_input, user_id=user_id
+        )
+        assistant_messages = []
+        # Script gửi đầy đủ được lưu cùng turn để các lượt sau chỉ cần tham chiếu
+        context_messages = []
+        if script_entries:
+            script_context, stored_script_context = build_script_context(script_entries)
+            assistant_messages.append(
+                ModelResponse(parts=[TextPart(content=script_context)])
             )
-            assistant_messages = []
-            if script_context:
-                assistant_messages.append(
-                    ModelResponse(
-                        parts=[
-                            TextPart(
-                                content=f"Related scripts in XML format. Important information needs to be reranked and filtered to answer the customer.\n{script_context}"
-                            ),
-                        ]
-                    )
+            if stored_script_context:
+                context_messages.append(
+                    ModelResponse(parts=[TextPart(content=stored_script_context)])
                 )
 
-            assistant_messages.append(
-                ModelResponse(
-                    parts=[
-                        TextPart(
-                            content="""
-## PERSISTENCE
-You are an agent - please keep going until the user's query is completely resolved, before ending your turn and yielding back to the user. Only terminate your turn when you are sure that the problem is solved.
-
-## PLANNING
-You MUST plan extensively before each function call, and reflect extensively on the outcomes of the previous function calls.
-"""
-                        ),
-                    ]
-                )
-            )
+        assistant_messages.append(
+            ModelResponse(parts=[TextPart(content=PERSISTENCE_INSTRUCTIONS)])
+        )
 
-            synthetic_agent = await create_synthetic_agent(user_id)
-            synthetic_result = await synthetic_agent.run(
-                user_input,
-                message_history=message_history + assistant_messages,
-                deps=synthetic_agent_deps,
-                usage_limits=UsageLimits(request_limit=10, total_tokens_limit=100000),
+        synthetic_agent = await get_synthetic_agent()
+        ensure_connection_released("synthetic_agent.run")
+        run_kwargs = dict(
+            message_history=message_history + assistant_messages,
+            deps=synthetic_agent_deps,
+            usage_limits=UsageLimits(request_limit=10, total_tokens_limit=100000),
+        )
+        if on_parts:
+            # Stream: các section hoàn chỉnh đã được gửi qua on_parts,
+            # message_parts chỉ còn phần cuối
+            (
+                agent_output,
+                new_messages_json,
+                message_parts,
+                usage,
+            ) = await stream_agent_output(
+                synthetic_agent, user_input, on_parts, **run_kwargs
             )
-            agent_output_str = synthetic_result.output
+        else:
+            synthetic_result = await synthetic_agent.run(user_input, **run_kwargs)
+            agent_output = synthetic_result.output
+            new_messages_json = synthetic_result.new_messages_json()
+            usage = synthetic_result.usage()
             # Làm sạch output để loại bỏ các thẻ XML có thể bị lộ do prompt injection
-            if contains_xml_tags(agent_output_str):
-                raise ForbiddenError("Phát hiện nguy hiểm khai thác dữ liệu")
-            agent_output_str = markdown_remove(agent_output_str)
+            check_output_safety(agent_output)
+            agent_output_str = markdown_remove(agent_output)
 
             # Xử lý message_parts để đảm bảo media parts chỉ chứa URL và tách riêng text mô tả
             message_parts = parse_and_format_message(agent_output_str)
 
-            # Typically [HumanMessage, AIMessage] or similar
-            # agent_new_messages = synthetic_result.new_messages()
-            # request_timestamp = (
-            #     agent_new_messages[0].parts[0].timestamp
-            #     if agent_new_messages
-            #     else datetime.datetime.now().isoformat()
-            # )
-
-            # get all object of type ModelResponse in agent_new_messages
-            # agent_new_responses = [
-            #     msg for msg in agent_new_messages if isinstance(msg, ModelResponse)
-            # ]
-
-            # Construct current turn's messages in the desired ModelRequest/ModelResponse format
-            # current_turn_interaction_objects = [
-            #     ModelRequest(
-            #         parts=[
-            #             UserPromptPart(content=user_input,
-            #                            timestamp=request_timestamp)
-            #         ]
-            #     ),
-            # ] + agent_new_responses
-            # current_turn_bytes = dump_json_bytes(
-            #     current_turn_interaction_objects
-            # )
-            current_qa_content_str = "".join(
-                [
-                    f"<user>{user_input}</user>\n",
-                    f"<assistant>{synthetic_result.output}</assistant>\n",
-                ]
-            )
-            current_qa_content_bytes = dump_json_bytes(current_qa_content_str)
-            script_ids_str = ",".join(script_ids)
+        # Số request LLM của lượt (mỗi lần model phải gọi lại tool là thêm một lượt)
+        agent_metrics.observe_turn(usage.requests)
+        logfire.info(
+            "Agent turn: {requests} LLM requests",
+            guest_id=user_id,
+            requests=usage.requests,
+            total_tokens=usage.total_tokens,
+        )
 
-            next_count = latest_count + 1
-            if next_count > 0 and next_count % UPDATE_GUEST_INFO_INTERVAL == 0:
-                asyncio_utils.run_background(
-                    run_info_agent_background, user_id, current_qa_content_str
-                )
+        # Typically [HumanMessage, AIMessage] or similar
+        # agent_new_messages = synthetic_result.new_messages()
+        # request_timestamp = (
+        #     agent_new_messages[0].parts[0].timestamp
+        #     if agent_new_messages
+        #     else datetime.datetime.now().isoformat()
+        # )
 
-            # Mỗi SHORT_TERM_MEMORY_LIMIT messages tạo summary
-            if next_count > 0 and next_count % SHORT_TERM_MEMORY_LIMIT == 0:
-                asyncio_utils.run_background(
-                    run_memory_with_summary,
-                    user_id,
-                    synthetic_result.new_messages_json(),
-                    script_ids_str,
-                    current_qa_content_str,
-                    current_qa_content_bytes,
-                )
-            else:
-                # Lưu message mà không tạo summary
-                asyncio_utils.run_background(
-                    save_message_without_summary,
-                    user_id,
-                    synthetic_result.new_messages_json(),
-                    script_ids_str,
-                    current_qa_content_bytes,
-                )
+        # get all object of type ModelResponse in agent_new_messages
+        # agent_new_responses = [
+        #     msg for msg in agent_new_messages if isinstance(msg, ModelResponse)
+        # ]
 
-            return message_parts
-        except ForbiddenError as e:
-            print(e)
-            await alert_service.insert_system_alert(db, user_id, f"{e.message}")
-            return [
-                MessagePart(
-                    type="text", payload="Xin lỗi, tôi không thể xử lí yêu cầu này."
-                )
+        # Construct current turn's messages in the desired ModelRequest/ModelResponse format
+        # current_turn_interaction_objects = [
+        #     ModelRequest(
+        #         parts=[
+        #             UserPromptPart(content=user_input,
+        #                            timestamp=request_timestamp)
+        #         ]
+        #     ),
+        # ] + agent_new_responses
+        # current_turn_bytes = dump_json_bytes(
+        #     current_turn_interaction_objects
+        # )
+        current_qa_content_str = "".join(
+            [
+                f"<user>{user_input}</user>\n",
+                f"<assistant>{agent_output}</assistant>\n",
             ]
-        except Exception as e:
-            print(e)
-            await alert_service.insert_system_alert(
+        )
+        script_ids_str = ",".join(script_ids)
+
+        next_count = latest_count + 1
+        if next_count > 0 and next_count % UPDATE_GUEST_INFO_INTERVAL == 0:
+            asyncio_utils.run_background(
+                run_info_agent_background, user_id, current_qa_content_str
+            )
+
+        # Mỗi SHORT_TERM_MEMORY_LIMIT messages tạo summary
+        if next_count > 0 and next_count % SHORT_TERM_MEMORY_LIMIT == 0:
+            asyncio_utils.run_background(
+                run_memory_with_summary,
+                user_id,
+                new_messages_json,
+                script_ids_str,
+                current_qa_content_str,
+                context_messages,
+            )
+        else:
+            # Lưu message mà không tạo summary
+            asyncio_utils.run_background(
+                save_message_without_summary,
+                user_id,
+                new_messages_json,
+                script_ids_str,
+                current_qa_content_str,
+                context_messages,
+            )
+
+        return message_parts
+    except ForbiddenError as e:
+        print(e)
+        await with_session(
+            lambda db: alert_service.insert_system_alert(db, user_id, f"{e.message}")
+        )
+        return [
+            MessagePart(
+                type="text", payload="Xin lỗi, tôi không thể xử lí yêu cầu này."
+            )
+        ]
+    except Exception as e:
+        print(e)
+        await with_session(
+            lambda db: alert_service.insert_system_alert(
                 db, user_id, f"Hệ thống bị lỗi khi cố gắng tạo phản hồi cho khách hàng"
             )
-            return [MessagePart(type="text", payload="Xin lỗi, vui lòng thử lại sau")]
+        )
+        return [MessagePart(type="text", payload="Xin lỗi, vui lòng thử lại sau")]
 
 
 async def run_memory_with_summary(
@@ -282,63 +541,66 @@ async def run_memory_with_summary(
     new_messages,
     script_ids,
     current_qa_content_str,
-    current_qa_content_bytes: bytes = None,
+    context_messages: list[ModelMessage] | None = None,
 ):
     """Chạy memory agent và tạo summary cho 10 messages gần nhất"""
-    async with async_session() as session:
-        list_qa_content_bytes = await with_session(
-            lambda session: chat_history_repository.get_latest_qa_content(
-                session, user_id, limit=SHORT_TERM_MEMORY_LIMIT
-            )
-        )
-        list_qa_content_str = [byte.decode("utf-8") for byte in list_qa_content_bytes]
-        list_qa_content_str.reverse()
-        qa_content_histories = "".join(list_qa_content_str).strip('"')
-        qa_content_histories = qa_content_histories + f"\n{current_qa_content_str}"
-        memory_agent_output = await memory_agent.run(
-            f"Below are the conversation messages that need summarization:\n{qa_content_histories}"
+    qa_content_histories = await with_session(
+        lambda session: chat_history_service.get_latest_qa_texts(
+            session, user_id, limit=SHORT_TERM_MEMORY_LIMIT
         )
-        summary = memory_agent_output.output
+    )
+    qa_content_histories = qa_content_histories + f"\n{current_qa_content_str}"
+    ensure_connection_released("memory_agent.run")
+    memory_agent_output = await memory_agent.run(
+        f"Below are the conversation messages that need summarization:\n{qa_content_histories}"
+    )
+    summary = memory_agent_output.output
 
-        # Lưu message hiện tại với summary
+    # Lưu message hiện tại với summary
+    content, qa_content = chat_history_service.encode_chat_history(
+        new_messages, current_qa_content_str, context_messages
+    )
+    async with session_scope() as session:
         chat_history = await chat_history_repository.insert_chat_history(
-            session,
-            user_id,
-            new_messages,
-            summary,
-            script_ids,
-            current_qa_content_bytes,
+            session, user_id, content, summary, script_ids, qa_content
         )
-        await session.commit()
+    chat_history_service.remember_chat_history(chat_history)
 
 
 async def save_message_without_summary(
-    user_id, new_messages, script_ids, current_qa_content_bytes: bytes = None
+    user_id,
+    new_messages,
+    script_ids,
+    current_qa_content_str,
+    context_messages: list[ModelMessage] | None = None,
 ):
     """Lưu message mà không tạo summary"""
-    async with async_session() as session:
-        await chat_history_repository.insert_chat_history_without_summary(
-            session, user_id, new_messages, script_ids, current_qa_content_bytes
+    content, qa_content = chat_history_service.encode_chat_history(
+        new_messages, current_qa_content_str, context_messages
+    )
+    async with session_scope() as session:
+        chat_history = (
+            await chat_history_repository.insert_chat_history_without_summary(
+                session, user_id, content, script_ids, qa_content
+            )
         )
-        await session.commit()
+    chat_history_service.remember_chat_history(chat_history)
 
 
 async def run_info_agent_background(user_id: str, current_qa_content_str: str = None):
     """Chạy info agent trong background để cập nhật thông tin khách hàng"""
     try:
-        list_qa_content_bytes = await with_session(
-            lambda session: chat_history_repository.get_latest_qa_content(
+        qa_content_str = await with_session(
+            lambda session: chat_history_service.get_latest_qa_texts(
                 session, user_id, limit=SHORT_TERM_MEMORY_LIMIT
             )
         )
-        list_qa_content_str = [byte.decode("utf-8") for byte in list_qa_content_bytes]
-        list_qa_content_str.reverse()
-        qa_content_str = "".join(list_qa_content_str).strip('"')
         if current_qa_content_str:
             qa_content_str += f"\n{current_qa_content_str}"
         if not qa_content_str:
             return
         info_agent_deps = InfoAgentDeps(user_id=user_id)
+        ensure_connection_released("info_agent.run")
         await info_agent.run(
             qa_content_str,
             usage_limits=UsageLimits(request_limit=5, total_tokens_limit=100000),
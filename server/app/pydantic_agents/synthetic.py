@@ -10,10 +10,19 @@ from app.pydantic_agents.synthetic_tools import (
     rag_hybrid_search,
 )
 from app.repositories import guest_info_repository
-from app.services import setting_service
+from app.services import notification_service, setting_service
+from app.utils.versioned_cache import VersionedCache
 from pydantic_ai import Agent, RunContext, Tool
 from pydantic_ai.models.google import GoogleModelSettings, ThinkingConfigDict
 
+# Agent + tools được build một lần và dùng lại giữa các lượt, build lại khi
+# notification thay đổi
+SYNTHETIC_AGENT_TTL_SECONDS = 60
+
+_synthetic_agent_cache: VersionedCache[Agent[SyntheticAgentDeps, str]] = VersionedCache(
+    notification_service.get_catalogue_version, SYNTHETIC_AGENT_TTL_SECONDS
+)
+
 
 async def get_instruction(context: RunContext[SyntheticAgentDeps]) -> str:
     guest_id = context.deps.user_id
@@ -73,11 +82,9 @@ async def get_instruction(context: RunContext[SyntheticAgentDeps]) -> str:
     return rendered
 
 
-async def create_synthetic_agent(
-    guest_id: str,
-) -> Agent[SyntheticAgentDeps, str]:
-
-    notify_tools = await get_notify_tools(guest_id)
+async def create_synthetic_agent() -> Agent[SyntheticAgentDeps, str]:
+    """Agent dùng chung cho mọi guest, guest được truyền qua deps khi run"""
+    notify_tools = await get_notify_tools()
 
     model = model_hub["gemini-2.5-flash"]
     synthetic_agent = Agent(
@@ -120,3 +127,7 @@ async def create_synthetic_agent(
     )
 
     return synthetic_agent
+
+
+async def get_synthetic_agent() -> Agent[SyntheticAgentDeps, str]:
+    return await _synthetic_agent_cache.get(create_synthetic_agent)
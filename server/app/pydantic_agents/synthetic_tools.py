@@ -1,27 +1,77 @@
 import re
-import xml.etree.ElementTree as ET
+from contextvars import ContextVar
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Any, Dict
 
 import pytz
+from app.configs import env_config
 from app.configs.constants import PARAM_VALIDATION
-from app.configs.database import async_session, with_session
+from app.configs.database import agent_query_engine, async_session, with_session
+from app.models import Notification
 from app.repositories import notification_repository, sheet_repository
 from app.services import alert_service, sheet_service
 from app.services.integrations import sheet_rag_service
 from app.utils import string_utils
+from app.utils.agent_metrics import agent_metrics
 from app.utils.agent_utils import (
+    XML_TAG_POLICY,
+    collect_capped_rows,
     dump_json,
     is_read_only_sql,
     normalize_postgres_query,
     normalize_tool_name,
+    output_scanner,
+    pgroonga_keywords,
+    relax_pgroonga_query,
+    rewrite_unaccent_predicates,
 )
+from app.utils.output_scanner import OutputScanner
+from app.utils.query_result_cache import is_cacheable_sql, referenced_tables
+from app.utils.result_encoder import get_result_encoder
+from app.utils.sheet_index import SheetIndex
+from jinja2 import TemplateSyntaxError
 from pydantic_ai import RunContext, Tool
 from pydantic_ai.exceptions import ModelRetry
 from pydantic_ai.tools import ToolDefinition
 from sqlalchemy import text
-from thefuzz import process
+
+QUERY_TRUNCATED_NOTE = (
+    "\n[Result truncated: only the first {rows} rows are shown. Narrow the query"
+    " with WHERE conditions, fewer columns, aggregation or a smaller LIMIT.]"
+)
+QUERY_FALLBACK_NOTE = (
+    "The query returned no rows. The rows below were found by fallback searches,"
+    " check that they match what the customer asked for:\n\n"
+)
+QUERY_FALLBACK_SECTION = '<fallback source="{source}">\n{rows}\n</fallback>'
+
+# Định dạng các dòng kết quả của execute_query_on_sheet_rows
+result_encoder = get_result_encoder(
+    env_config.AGENT_QUERY_RESULT_FORMAT, env_config.AGENT_QUERY_MAX_CELL_CHARS
+)
+# Cột của các kết quả query đã trả về cho model trong lượt hiện tại (invoke_agent
+# đặt list mới mỗi lượt), để phát hiện output chép lại kết quả ở định dạng tsv/json
+query_result_columns: ContextVar[list[list[str]] | None] = ContextVar(
+    "query_result_columns", default=None
+)
+
+
+def record_result_columns(columns: list[str]):
+    recorded = query_result_columns.get()
+    if recorded is not None:
+        recorded.append(list(columns))
+
+
+def get_output_scanner() -> OutputScanner:
+    """
+    Scanner output của lượt hiện tại: thẻ XML nội bộ và dòng header / dòng có số
+    cột của các kết quả query đã trả về cho model (theo AGENT_QUERY_RESULT_FORMAT).
+    """
+    policy = result_encoder.leak_policy(query_result_columns.get() or [])
+    if not policy.patterns:
+        return output_scanner
+    return OutputScanner([XML_TAG_POLICY, policy])
 
 
 @dataclass
@@ -69,8 +119,23 @@ def get_description_from_param(
     return result
 
 
-def create_tool(notification_id: str, guest_id: str, tool_info: Dict[str, Any]) -> Tool:
-    async def tool_function(**kwargs) -> str:
+def create_tool(notification: Notification, tool_info: Dict[str, Any]) -> Tool:
+    """
+    Tool gửi notification, dùng chung cho mọi guest (guest lấy từ deps khi chạy).
+    Params/content của notification được lấy lúc build tool, tool được build lại
+    khi danh sách notification thay đổi.
+    """
+    notification_id = notification.id
+    notification_label = notification.label
+    template_str = notification.content
+    notification_params = list(notification.params or [])
+    if template_str:
+        try:
+            string_utils.compile_tool_template(template_str, notification_id)
+        except TemplateSyntaxError as e:
+            print(f"Error compiling template of notification {notification_id}: {e}")
+
+    async def tool_function(ctx: RunContext[SyntheticAgentDeps], **kwargs) -> str:
         # Remove tool_description from kwargs if present
         kwargs.pop("tool_description", "")
 
@@ -83,41 +148,38 @@ def create_tool(notification_id: str, guest_id: str, tool_info: Dict[str, Any])
             raise ModelRetry(
                 f"Missing required parameters, can't not send notification now: {', '.join(empty_params)}"
             )  # Validate parameters based on notification params configuration
-        async with async_session() as session:
-            notification = await notification_repository.get_notification_by_id(
-                session, notification_id
-            )
 
-            # Collect all validation errors
-            validation_errors = []
-            if notification.params:
-                for param_config in notification.params:
-                    param_name = param_config.get("param_name")
-                    param_type = param_config.get("param_type", "String")
-                    validation = param_config.get("validation", "")
-
-                    if param_name in kwargs:
-                        param_value = str(kwargs[param_name])
-                        error_message = validate_param_value(
-                            param_name, param_value, param_type, validation
-                        )
-                        if error_message:  # If there's a validation error
-                            validation_errors.append(error_message)
-
-            # If there are validation errors, raise ModelRetry with all errors
-            if validation_errors:
-                all_errors = "\n".join([f"- {error}" for error in validation_errors])
-                raise ModelRetry(
-                    f"Parameter validation failed. Please fix the following errors:\n{all_errors}"
+        # Collect all validation errors
+        validation_errors = []
+        for param_config in notification_params:
+            param_name = param_config.get("param_name")
+            param_type = param_config.get("param_type", "String")
+            validation = param_config.get("validation", "")
+
+            if param_name in kwargs:
+                param_value = str(kwargs[param_name])
+                error_message = validate_param_value(
+                    param_name, param_value, param_type, validation
                 )
+                if error_message:  # If there's a validation error
+                    validation_errors.append(error_message)
 
-            template_str = notification.content
-            alert_content = string_utils.render_tool_template(template_str, **kwargs)
+        # If there are validation errors, raise ModelRetry with all errors
+        if validation_errors:
+            all_errors = "\n".join([f"- {error}" for error in validation_errors])
+            raise ModelRetry(
+                f"Parameter validation failed. Please fix the following errors:\n{all_errors}"
+            )
+
+        alert_content = string_utils.render_notification_template(
+            notification_id, template_str, kwargs
+        )
+        async with async_session() as session:
             await alert_service.insert_custom_alert(
-                session, guest_id, notification_id, alert_content
+                session, ctx.deps.user_id, notification_id, alert_content
             )
-            return f"""<status>success</status>
-  <message>Alert '{notification.label}' has been sent with content:
+        return f"""<status>success</status>
+  <message>Alert '{notification_label}' has been sent with content:
 
 {alert_content}
   </message>"""
@@ -135,7 +197,7 @@ def create_tool(notification_id: str, guest_id: str, tool_info: Dict[str, Any])
         name=tool_info["name"],
         description=tool_info["description"],
         prepare=prepare_tool,
-        takes_ctx=False,
+        takes_ctx=True,
         function=tool_function,
         max_retries=2,
     )
@@ -157,7 +219,7 @@ async def get_current_local_time(
     <time>{local_time.isoformat()}</time>"""
 
 
-async def get_notify_tools(guest_id: str) -> list[Tool]:
+async def get_notify_tools() -> list[Tool]:
     notify_tools_json = []
     all_notifications = await with_session(
         lambda db: notification_repository.get_all_notifications_by_status(
@@ -171,7 +233,7 @@ async def get_notify_tools(guest_id: str) -> list[Tool]:
             "description": f"**Call this tool to notify admin when the following conditions are met:**\n{notification.description}",
             "parameters": {"type": "object", "properties": {}, "required": []},
         }
-        for param in notification.params:
+        for param in notification.params or []:
             tool_json["parameters"]["properties"][param["param_name"]] = {
                 "type": get_type_from_param_type(param["param_type"]),
                 "description": get_description_from_param(
@@ -186,10 +248,10 @@ async def get_notify_tools(guest_id: str) -> list[Tool]:
             "description": "Tell me the details about the tool you are using.",
         }
         tool_json["parameters"]["required"].append("tool_description")
-        notify_tools_json.append(tool_json)
+        notify_tools_json.append((notification, tool_json))
     notify_tools = [
-        create_tool(tool_info["notification_id"], guest_id, tool_info)
-        for tool_info in notify_tools_json
+        create_tool(notification, tool_info)
+        for notification, tool_info in notify_tools_json
     ]
     return notify_tools
 
@@ -207,20 +269,16 @@ async def rag_hybrid_search(sheet_id: str, query: str, limit: int) -> str:
         query: The query string to search for.
         limit: The maximum number of results to return. Must be enough large number to search relative data.
     """
-    # replace _ to - in sheet_id
-    sheet_id = sheet_id.replace("_", "-")
-    sheets = await with_session(
-        lambda db: sheet_repository.get_all_sheets_by_status(db, "published")
-    )
-    sheet_ids = [sheet.id for sheet in sheets]
-    if sheet_id not in sheet_ids:
-        best_id, score = process.extractOne(sheet_id, sheet_ids)
-        if score < 60:
-            raise ModelRetry(
-                f"Invalid sheet_id: {sheet_id}. "
-                f"Best match '{best_id}' has only {score} points."
-            )
-        sheet_id = best_id
+    sheet_index = await with_session(sheet_service.get_published_sheet_index)
+    match = sheet_index.resolve(sheet_id)
+    if match.sheet is None:
+        raise ModelRetry("No sheets are available to search.")
+    if match.score < 60:
+        raise ModelRetry(
+            f"Invalid sheet_id: {sheet_id}. "
+            f"Best match '{match.sheet.id}' has only {match.score} points."
+        )
+    sheet_id = match.sheet.id
 
     sheet_chunks = await sheet_rag_service.search_chunks_by_sheet_id(
         sheet_id=sheet_id,
@@ -230,26 +288,6 @@ async def rag_hybrid_search(sheet_id: str, query: str, limit: int) -> str:
     return dump_json([sheet_chunk.chunk for sheet_chunk in sheet_chunks])
 
 
-def rows_to_xml(rows: list[dict[str, Any]]) -> str:
-    """
-    Converts a list of dictionaries (rows) into an XML string.
-    Each dictionary is converted to a <row> element,
-    and its key-value pairs become child elements.
-    """
-    xml_parts = []
-    for row_data in rows:
-        row_element = ET.Element("row")
-        for key, value in row_data.items():
-            # Ensure element names are valid XML names (e.g., no spaces, not starting with numbers if not careful)
-            # For simplicity, assuming keys are valid or need sanitization if not.
-            # A basic sanitization could be to replace invalid characters or prefix numbers.
-            # For now, we'll assume keys are simple enough.
-            col_element = ET.SubElement(row_element, str(key))
-            col_element.text = str(value)  # Ensure value is a string
-        xml_parts.append(ET.tostring(row_element, encoding="unicode"))
-    return "\n".join(xml_parts)
-
-
 async def get_all_available_sheets(context: RunContext[SyntheticAgentDeps]) -> str:
     """
     Get all available sheets in XML Format from the database to analyze structure in order to construct sql query.
@@ -268,6 +306,23 @@ async def get_all_available_sheets(context: RunContext[SyntheticAgentDeps]) -> s
         return f"Error fetching sheets: {str(e)}"
 
 
+async def get_sheet_contexts(
+    max_column_description_chars: int | None = None,
+) -> list[str]:
+    """<sheet> của từng sheet đã publish, để ghép vào prompt của agent"""
+    try:
+        sheets = await with_session(
+            lambda db: sheet_repository.get_all_sheets_by_status(db, "published")
+        )
+        return [
+            sheet_service.agent_sheet_to_xml(sheet, max_column_description_chars)
+            for sheet in sheets
+        ]
+    except Exception as e:
+        print(f"Error fetching sheets: {e}")
+        return []
+
+
 async def execute_query_on_sheet_rows(sql_query: str) -> str:
     """
     Carefully study the sheet_description before thinking about the SQL query.
@@ -329,35 +384,170 @@ async def execute_query_on_sheet_rows(sql_query: str) -> str:
         sql_query: The PostgreSQL valid query string to search for.
     """
     try:
-        async with async_session() as db:
-            query = normalize_postgres_query(sql_query)
-            if not is_read_only_sql(query):
-                raise ModelRetry(
-                    "Query must be read-only SQL. Please check your query again."
-                )
-            sheets = await sheet_repository.get_all_sheets_by_status(db, "published")
-            table_names = [sheet.table_name for sheet in sheets]
-            query = replace_table_if_needed(query, table_names)
-            # execute the query and return the result
-            result = await db.execute(text(query))
-            # Fetch all results as dictionaries
-            rows = result.mappings().all()
-            # if rows is empty, raise ModelRetry
-            if not rows:
-                return (
-                    "No data found. Please check your query again."
-                    "Using **rag_hybrid_search** tool to search by phrase for relevant items of sheet."
-                )
-            return rows_to_xml([dict(r) for r in rows])
+        query = normalize_postgres_query(sql_query)
+        if not is_read_only_sql(query):
+            raise ModelRetry(
+                "Query must be read-only SQL. Please check your query again."
+            )
+        sheet_index = await with_session(sheet_service.get_published_sheet_index)
+        query = replace_table_if_needed(query, sheet_index)
+        # Từ khóa giữ nguyên dấu trong query gốc cho fallback hybrid search
+        unaccented_query = unaccent_sheet_query(query, sheet_index)
+
+        # Kết quả được cache theo câu SQL đã chuẩn hóa + data version các bảng
+        cache_key = None
+        tables = referenced_tables(query, sheet_index.table_names)
+        if tables and is_cacheable_sql(query):
+            cache_key = sheet_service.agent_query_cache.make_key(
+                unaccented_query, sheet_service.get_table_versions(tables)
+            )
+            cached = sheet_service.agent_query_cache.get(cache_key)
+            if cached is not None:
+                content, results_columns = cached
+                for columns in results_columns:
+                    record_result_columns(columns)
+                return content
+
+        recorded = query_result_columns.get()
+        recorded_before = len(recorded) if recorded is not None else 0
+        header_lines, rows, truncated = await run_sheet_query(unaccented_query)
+        if rows:
+            content = "\n".join(header_lines + rows)
+            if truncated:
+                content += QUERY_TRUNCATED_NOTE.format(rows=len(rows))
+        else:
+            # Thử các fallback ngay trong tool thay vì để model gọi thêm lượt nữa
+            content = await run_query_fallbacks(query, sheet_index)
+        if not content:
+            content = (
+                "No data found. Please check your query again."
+                "Using **rag_hybrid_search** tool to search by phrase for relevant items of sheet."
+            )
+        if cache_key is not None:
+            # Lưu kèm cột của các kết quả để lần dùng cache sau vẫn ghi nhận được
+            results_columns = recorded[recorded_before:] if recorded is not None else []
+            sheet_service.agent_query_cache.put(
+                cache_key, (content, results_columns), len(content.encode())
+            )
+        return content
     except ModelRetry as model_retry:
         raise model_retry
     except Exception as e:
         print(f"Error executing query: {e}")
+        if "statement timeout" in str(e):
+            raise ModelRetry(
+                "Query took too long and was cancelled. Narrow it with WHERE "
+                "conditions, fewer columns or a smaller LIMIT."
+            )
         raise ModelRetry(
             f"Error executing query: {str(e)}. Please reanalyze sheets structure using **get_all_available_sheets** tool."
         )
 
 
+async def run_sheet_query(query: str) -> tuple[list[str], list[str], bool]:
+    """
+    Chạy query trên pool riêng (read-only, statement_timeout), đọc qua server-side
+    cursor và chỉ lấy tối đa AGENT_QUERY_MAX_ROWS dòng / AGENT_QUERY_MAX_BYTES.
+    Trả về dòng header (nếu có), các dòng kết quả đã encode và kết quả có bị cắt
+    hay không.
+    """
+    async with agent_query_engine.connect() as conn:
+        result = await conn.stream(text(query))
+        record_result_columns(list(result.keys()))
+        header = result_encoder.header(list(result.keys()))
+        header_lines = [header] if header is not None else []
+        rows, truncated = await collect_capped_rows(
+            result.mappings(),
+            result_encoder.row,
+            env_config.AGENT_QUERY_MAX_ROWS,
+            env_config.AGENT_QUERY_MAX_BYTES
+            - sum(len(line.encode()) + 1 for line in header_lines),
+        )
+        await result.close()
+    return header_lines, rows, truncated
+
+
+def unaccent_sheet_query(query: str, sheet_index: SheetIndex) -> str:
+    """
+    Điều kiện &@~ trên các cột text của sheet được query chuyển sang tìm kiếm
+    không dấu (index PGroonga trên vi_unaccent), khách hay gõ không dấu.
+    """
+    try:
+        table_name = get_table_name_from_query(query)
+    except ModelRetry:
+        return query
+    match = sheet_index.resolve(table_name)
+    if match.sheet is None or match.score < 100:
+        return query
+    return rewrite_unaccent_predicates(query, match.sheet.text_columns)
+
+
+async def run_fallback_step(
+    step: str, query: str, sheet_index: SheetIndex
+) -> str | None:
+    """Section kết quả của một fallback, None nếu không chạy hoặc không có dữ liệu"""
+    if step == "or_mode":
+        relaxed_query = relax_pgroonga_query(query)
+        if not relaxed_query:
+            return None
+        header_lines, rows, _ = await run_sheet_query(
+            unaccent_sheet_query(relaxed_query, sheet_index)
+        )
+        agent_metrics.observe_fallback(step, bool(rows))
+        if not rows:
+            return None
+        return QUERY_FALLBACK_SECTION.format(
+            source="the same query with the full-text keywords joined by OR",
+            rows="\n".join(header_lines + rows),
+        )
+    if step == "hybrid":
+        keywords = pgroonga_keywords(query)
+        try:
+            table_name = get_table_name_from_query(query)
+        except ModelRetry:
+            return None
+        match = sheet_index.resolve(table_name)
+        if not keywords or match.sheet is None or match.score < 100:
+            return None
+        sheet, rows = await sheet_rag_service.search_rows_by_sheet_id(
+            match.sheet.id,
+            " ".join(keywords),
+            env_config.AGENT_QUERY_FALLBACK_LIMIT,
+        )
+        agent_metrics.observe_fallback(step, bool(rows))
+        if not rows:
+            return None
+        record_result_columns(list(rows[0].keys()))
+        return QUERY_FALLBACK_SECTION.format(
+            source=f"hybrid search for '{' '.join(keywords)}' on sheet"
+            f" '{sheet.name}' (all columns)",
+            rows=result_encoder.encode(rows),
+        )
+    return None
+
+
+async def run_query_fallbacks(query: str, sheet_index: SheetIndex) -> str | None:
+    """
+    Query không có kết quả: chạy lần lượt các fallback trong AGENT_QUERY_FALLBACKS
+    (or_mode: nới điều kiện PGroonga sang OR, hybrid: hybrid search trên sheet của
+    query) và gộp kết quả kèm ghi chú nguồn, None nếu không fallback nào có dữ liệu.
+    Fallback lỗi (timeout, Jina/Qdrant...) được bỏ qua: query gốc vẫn hợp lệ.
+    """
+    sections = []
+    for step in env_config.AGENT_QUERY_FALLBACKS:
+        try:
+            section = await run_fallback_step(step, query, sheet_index)
+        except Exception as e:
+            print(f"Error running query fallback {step}: {e}")
+            agent_metrics.observe_fallback_error(step)
+            continue
+        if section:
+            sections.append(section)
+    if not sections:
+        return None
+    return QUERY_FALLBACK_NOTE + "\n\n".join(sections)
+
+
 def get_table_name_from_query(query: str) -> str:
     """
     Extract table name after FROM clause, handling both single and double quotes.
@@ -381,7 +571,7 @@ def get_table_name_from_query(query: str) -> str:
 
 
 def replace_table_if_needed(
-    query: str, available_table_names: list[str], min_score: int = 60
+    query: str, sheet_index: SheetIndex, min_score: int = 60
 ) -> str:
     # Extract table name from query
     try:
@@ -391,18 +581,18 @@ def replace_table_if_needed(
         return query
 
     # If table name is not in the list, find and replace
-    if table_in_query not in available_table_names:
-        best_table, score_table = process.extractOne(
-            table_in_query, available_table_names
-        )
-        if score_table < min_score:
+    if table_in_query not in sheet_index.table_names:
+        match = sheet_index.resolve(table_in_query)
+        if match.sheet is None:
+            raise ModelRetry(f"Invalid table name: {table_in_query}. No sheets found.")
+        if match.score < min_score:
             raise ModelRetry(
                 f"Invalid table name: {table_in_query}. "
-                f"Best match '{best_table}' has only {score_table} points."
+                f"Best match '{match.sheet.table_name}' has only {match.score} points."
             )
 
         # Replace table name in FROM clause with the best match
-        query = query.replace(table_in_query, best_table)
+        query = query.replace(table_in_query, match.sheet.table_name)
 
     return query
 
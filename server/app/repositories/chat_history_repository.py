@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from app.models import ChatHistory
-from sqlalchemy import select
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -168,3 +168,43 @@ async def get_latest_qa_content(
     )
     result = await db.execute(stmt)
     return result.scalars().all()
+
+
+async def get_chat_history_samples(
+    db: AsyncSession, limit: int = 2000
+) -> list[ChatHistory]:
+    """Các chat history mới nhất, làm mẫu để train dictionary nén"""
+    stmt = select(ChatHistory).order_by(ChatHistory.created_at.desc()).limit(limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+async def get_chat_histories_to_recompress(
+    db: AsyncSession, header: bytes, limit: int = 200, exclude_ids=()
+) -> list[ChatHistory]:
+    """
+    Các chat history có content hoặc qa_content chưa được nén với header hiện
+    tại (định dạng legacy hoặc dictionary cũ), trừ exclude_ids (row lỗi). Lock các
+    row được trả về, bỏ qua row đang bị lock để nhiều process có thể chạy
+    migration cùng lúc.
+    """
+    length = len(header)
+    stmt = (
+        select(ChatHistory)
+        .where(
+            or_(
+                func.substring(ChatHistory.content, 1, length) != header,
+                and_(
+                    ChatHistory.qa_content != None,
+                    func.substring(ChatHistory.qa_content, 1, length) != header,
+                ),
+            )
+        )
+        .order_by(ChatHistory.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    if exclude_ids:
+        stmt = stmt.where(ChatHistory.id.notin_(list(exclude_ids)))
+    result = await db.execute(stmt)
+    return result.scalars().all()
@@ -0,0 +1,23 @@
+from app.models import CompressionDictionary
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def get_dictionaries(
+    db: AsyncSession, ids: list[int] | None = None
+) -> list[CompressionDictionary]:
+    """Các dictionary theo thứ tự tạo (cũ -> mới), lọc theo ids nếu có"""
+    stmt = select(CompressionDictionary).order_by(CompressionDictionary.created_at)
+    if ids is not None:
+        stmt = stmt.where(CompressionDictionary.id.in_(ids))
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+async def insert_dictionary(
+    db: AsyncSession, dict_id: int, data: bytes, sample_count: int
+) -> CompressionDictionary:
+    dictionary = CompressionDictionary(id=dict_id, data=data, sample_count=sample_count)
+    db.add(dictionary)
+    await db.flush()
+    return dictionary
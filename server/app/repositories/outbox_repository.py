@@ -0,0 +1,135 @@
+from datetime import datetime
+
+from app.configs.constants import OUTBOX_STATUS
+from app.models import OutboxMessage
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def insert_outbox_messages(
+    db: AsyncSession, messages: list[OutboxMessage]
+) -> list[OutboxMessage]:
+    db.add_all(messages)
+    await db.flush()
+    return messages
+
+
+async def get_pending_recipient_ids(
+    db: AsyncSession, now: datetime, limit: int = 100
+) -> list[str]:
+    """
+    Get recipients that have at least one message ready to be delivered.
+    """
+    stmt = (
+        select(OutboxMessage.recipient_id)
+        .where(
+            OutboxMessage.status == OUTBOX_STATUS.PENDING.value,
+            OutboxMessage.available_at <= now,
+        )
+        .group_by(OutboxMessage.recipient_id)
+        .order_by(OutboxMessage.recipient_id)
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def claim_messages(
+    db: AsyncSession, recipient_id: str, now: datetime
+) -> list[OutboxMessage]:
+    """
+    Lock the undelivered messages of a recipient in order and mark the leading
+    ready ones as sending. Stops at the first message that is still waiting for
+    a retry or already being sent, so parts are never delivered out of order.
+    """
+    stmt = (
+        select(OutboxMessage)
+        .where(
+            OutboxMessage.recipient_id == recipient_id,
+            OutboxMessage.status.in_(
+                [OUTBOX_STATUS.PENDING.value, OUTBOX_STATUS.SENDING.value]
+            ),
+        )
+        .order_by(OutboxMessage.created_at, OutboxMessage.sequence)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(stmt)
+    claimed = []
+    for message in result.scalars().all():
+        if message.status != OUTBOX_STATUS.PENDING.value or message.available_at > now:
+            break
+        message.status = OUTBOX_STATUS.SENDING.value
+        message.claimed_at = now
+        claimed.append(message)
+    await db.flush()
+    return claimed
+
+
+async def mark_delivered(db: AsyncSession, message_id: str, delivered_at: datetime):
+    stmt = (
+        update(OutboxMessage)
+        .where(OutboxMessage.id == message_id)
+        .values(
+            status=OUTBOX_STATUS.DELIVERED.value,
+            attempts=OutboxMessage.attempts + 1,
+            delivered_at=delivered_at,
+            last_error=None,
+        )
+    )
+    await db.execute(stmt)
+
+
+async def mark_undelivered(
+    db: AsyncSession,
+    message_id: str,
+    status: str,
+    available_at: datetime,
+    error: str | None = None,
+):
+    """
+    Record a failed attempt. status is pending (retry at available_at) or failed.
+    """
+    stmt = (
+        update(OutboxMessage)
+        .where(OutboxMessage.id == message_id)
+        .values(
+            status=status,
+            attempts=OutboxMessage.attempts + 1,
+            available_at=available_at,
+            last_error=error,
+        )
+    )
+    await db.execute(stmt)
+
+
+async def release_messages(db: AsyncSession, message_ids: list[str]):
+    """
+    Put claimed messages back to pending without counting an attempt.
+    """
+    if not message_ids:
+        return
+    stmt = (
+        update(OutboxMessage)
+        .where(
+            OutboxMessage.id.in_(message_ids),
+            OutboxMessage.status == OUTBOX_STATUS.SENDING.value,
+        )
+        .values(status=OUTBOX_STATUS.PENDING.value)
+    )
+    await db.execute(stmt)
+
+
+async def release_stale_messages(db: AsyncSession, before: datetime) -> int:
+    """
+    Put messages stuck in sending (worker stopped mid-reply) back to pending.
+    """
+    stmt = (
+        update(OutboxMessage)
+        .where(
+            OutboxMessage.status == OUTBOX_STATUS.SENDING.value,
+            OutboxMessage.claimed_at < before,
+        )
+        .values(status=OUTBOX_STATUS.PENDING.value)
+    )
+    result = await db.execute(stmt)
+    return result.rowcount or 0
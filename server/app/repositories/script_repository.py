@@ -1,14 +1,14 @@
 from app.models import Script, script_attachments
-from sqlalchemy import delete, insert
+from sqlalchemy import delete, func, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 
 async def count_scripts(db: AsyncSession) -> int:
-    stmt = select(Script)
+    stmt = select(func.count()).select_from(Script)
     result = await db.execute(stmt)
-    return len(result.scalars().all())
+    return result.scalar_one()
 
 
 async def count_scripts_by_status(db: AsyncSession, status: str) -> int:
@@ -93,6 +93,14 @@ async def delete_multiple_sheets(db: AsyncSession, sheet_ids: list[str]) -> None
     return None
 
 
+async def get_all_sheets(db: AsyncSession) -> list[Sheet]:
+    """
+    Get all sheets from the database, regardless of status.
+    """
+    result = await db.execute(select(Sheet))
+    return result.scalars().all()
+
+
 async def get_all_sheets_by_status(db: AsyncSession, status: str) -> list[Sheet]:
     """
     Get all sheets from the database.
@@ -0,0 +1,60 @@
+import uuid
+from datetime import datetime
+
+from app.models import WebhookEvent
+from sqlalchemy import delete, exists, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def insert_event_if_absent(
+    db: AsyncSession,
+    event_key: str,
+    sender_id: str | None = None,
+    watermark: int | None = None,
+) -> bool:
+    """
+    Insert a webhook event key. Returns True if the key was inserted,
+    False if it already exists (duplicate event).
+    """
+    stmt = (
+        insert(WebhookEvent)
+        .values(
+            id=str(uuid.uuid4()),
+            event_key=event_key,
+            sender_id=sender_id,
+            watermark=watermark,
+            created_at=datetime.now(),
+        )
+        .on_conflict_do_nothing(index_elements=[WebhookEvent.event_key])
+        .returning(WebhookEvent.id)
+    )
+    result = await db.execute(stmt)
+    return result.scalar() is not None
+
+
+async def event_exists(db: AsyncSession, event_key: str) -> bool:
+    """
+    Check whether a webhook event key has already been claimed.
+    """
+    stmt = select(exists().where(WebhookEvent.event_key == event_key))
+    result = await db.execute(stmt)
+    return bool(result.scalar())
+
+
+async def delete_event(db: AsyncSession, event_key: str) -> int:
+    """
+    Delete a webhook event key so the event can be claimed again.
+    """
+    stmt = delete(WebhookEvent).where(WebhookEvent.event_key == event_key)
+    result = await db.execute(stmt)
+    return result.rowcount or 0
+
+
+async def delete_events_before(db: AsyncSession, before: datetime) -> int:
+    """
+    Delete webhook events created before the given datetime.
+    """
+    stmt = delete(WebhookEvent).where(WebhookEvent.created_at < before)
+    result = await db.execute(stmt)
+    return result.rowcount or 0
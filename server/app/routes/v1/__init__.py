@@ -5,6 +5,7 @@ from .route_alerts import router as alerts_router
 from .route_conversations import router as conversations_router
 from .route_guests import router as guests_router
 from .route_interests import router as interests_router
+from .route_metrics import router as metrics_router
 from .route_notifications import router as notifications_router
 from .route_scripts import router as scripts_router
 from .route_setting import router as settings_router
@@ -39,3 +40,4 @@ def include_router(app: FastAPI):
     app.include_router(settings_router)
     app.include_router(notifications_router)
     app.include_router(alerts_router)
+    app.include_router(metrics_router)
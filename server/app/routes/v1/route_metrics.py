@@ -0,0 +1,35 @@
+from typing import Any, Dict
+
+from app.configs.database import lease_tracker
+from app.services import chat_history_service, sheet_service
+from app.services.integrations import outbox_service
+from app.services.integrations.messenger_dispatcher import dispatcher
+from app.utils.agent_metrics import agent_metrics
+from app.utils.string_utils import tool_template_cache
+from fastapi import APIRouter, status
+
+router = APIRouter(prefix="/v1/metrics", tags=["Metrics"])
+
+
+@router.get(
+    "",
+    response_model=Dict[str, Any],
+    status_code=status.HTTP_200_OK,
+    summary="Get in-process runtime metrics",
+    description="""
+    Snapshot of the in-memory counters of this process: Messenger dispatcher,
+    reply outbox, DB connection leases, agent caches, query fallbacks and the
+    chat history migration. Counters reset when the process restarts.
+    """,
+)
+def get_metrics():
+    return {
+        "messenger_dispatcher": dispatcher.get_metrics(),
+        "outbox": outbox_service.get_metrics(),
+        "db_leases": lease_tracker.get_metrics(),
+        "conversation_cache": chat_history_service.conversation_cache.get_metrics(),
+        "agent_query_cache": sheet_service.get_agent_query_cache_metrics(),
+        "tool_template_cache": tool_template_cache.get_metrics(),
+        "agent": agent_metrics.get_metrics(),
+        "chat_history_migration": chat_history_service.get_migration_metrics(),
+    }
@@ -1,7 +1,9 @@
+import json
 from typing import Optional
 
 from app.configs import env_config
 from app.dtos import common_error_responses
+from app.services import webhook_event_service
 from app.services.integrations import messenger_service
 from app.utils import asyncio_utils
 from fastapi import APIRouter, HTTPException, Query, Request, status
@@ -107,7 +109,8 @@ async def get_webhook(
     messages, postbacks, and other interactions.
     
     **Event Processing:**
-    1. Validates the webhook payload structure
+    1. Verifies the X-Hub-Signature-256 header (when APP_SECRET is configured)
+       and validates the webhook payload structure
     2. Extracts sender, recipient, and event data
     3. Processes events asynchronously in background tasks
     4. Returns immediate acknowledgment to Facebook
@@ -133,6 +136,12 @@ async def get_webhook(
                 "application/json": {"example": {"detail": "Invalid JSON payload"}}
             },
         },
+        403: {
+            "description": "Invalid X-Hub-Signature-256 signature",
+            "content": {
+                "application/json": {"example": {"detail": "Invalid signature"}}
+            },
+        },
         404: {
             "description": "Webhook event is not from a page subscription",
             "content": {
@@ -150,9 +159,19 @@ async def post_webhook(request: Request):
     """
     Handle POST request for Facebook Messenger webhook events.
     """
+    raw_body = await request.body()
+    # Verify the payload signature before parsing
+    if not webhook_event_service.verify_signature(
+        raw_body, request.headers.get("X-Hub-Signature-256")
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid signature",
+        )
+
     try:
         # Parse request body
-        body = await request.json()
+        body = json.loads(raw_body)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -2,6 +2,8 @@
 Các định nghĩa SQL cần thiết cho hệ thống
 """
 
+from app.utils.unaccent import VI_UNACCENT_FUNCTION
+
 # Setup PGroonga extension
 SETUP_PGROONGA = """
 CREATE EXTENSION IF NOT EXISTS pgroonga;
@@ -35,6 +37,9 @@ async def create_custom_functions_and_triggers(conn):
         # Tạo index PGroonga mới cho các trường cụ thể của guest_info
         await conn.execute(CREATE_PGROONGA_GUEST_INFO_INDEX)
 
+        # Hàm bỏ dấu dùng cho index tìm kiếm không dấu trên các bảng sheet
+        await conn.execute(VI_UNACCENT_FUNCTION)
+
         print("PGroonga setup successfully.")
     except Exception as e:
         print(f"Lỗi khi thực thi SQL setup: {e}")
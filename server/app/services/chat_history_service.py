@@ -1,6 +1,285 @@
+import asyncio
+import time
 import xml.etree.ElementTree as ET
 
+from app.configs import env_config
+from app.configs.database import session_scope, with_session
+from app.models import ChatHistory
+from app.repositories import chat_history_repository, compression_dictionary_repository
 from app.utils.agent_utils import MessagePart
+from app.utils.conversation_cache import (
+    ConversationMemory,
+    ConversationMemoryCache,
+    MemoryTurn,
+)
+from app.utils.history_codec import HistoryCodec, dictionary_id, train_dictionary
+from app.utils.history_pruner import HistoryPruner
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+
+MIGRATION_BATCH_SIZE = 200
+MIGRATION_PAUSE = 0.5  # seconds giữa các batch, tránh chiếm DB
+DICTIONARY_SAMPLE_LIMIT = 2000
+
+conversation_cache = ConversationMemoryCache(env_config.CONVERSATION_CACHE_MAX_BYTES)
+history_codec = HistoryCodec()
+history_pruner = HistoryPruner(
+    drop_thinking=env_config.HISTORY_DROP_THINKING,
+    max_tool_return_tokens=env_config.HISTORY_TOOL_RETURN_MAX_TOKENS,
+)
+_migration_stats: dict = {}
+
+
+async def load_codec_dictionaries(db: AsyncSession, dict_ids: list[int] | None = None):
+    """
+    Nạp dictionary vào history_codec. Khi nạp tất cả (lúc khởi động), dictionary
+    mới nhất được dùng để nén.
+    """
+    dictionaries = await compression_dictionary_repository.get_dictionaries(
+        db, dict_ids
+    )
+    for dictionary in dictionaries:
+        history_codec.add_dictionary(
+            dictionary.id, dictionary.data, active=dict_ids is None
+        )
+
+
+async def ensure_codec_dictionaries(db: AsyncSession, contents: list[bytes | None]):
+    """Nạp các dictionary (do process khác train) mà contents cần để giải nén"""
+    missing = {
+        dict_id
+        for dict_id in map(dictionary_id, contents)
+        if dict_id is not None and not history_codec.has_dictionary(dict_id)
+    }
+    if missing:
+        await load_codec_dictionaries(db, list(missing))
+
+
+async def get_conversation_memory(
+    db: AsyncSession, guest_id: str, max_limit: int, overlap_count: int
+) -> ConversationMemory:
+    """
+    Short-term memory của guest: lấy từ cache, nếu chưa có thì đọc các
+    chat history đến summary gần nhất (và overlap_count history tính đến
+    summary đó) rồi decode một lần.
+    """
+    memory = conversation_cache.get(guest_id)
+    if memory is not None:
+        return memory
+
+    token = conversation_cache.begin_load(guest_id)
+    chat_histories = await chat_history_repository.get_chat_histories_until_summary(
+        db, guest_id, max_limit=max_limit
+    )
+    overlap_chat_histories = []
+    if chat_histories and chat_histories[-1].summary:
+        overlap_chat_histories = (
+            await chat_history_repository.get_latest_chat_histories_from_datetime(
+                db, guest_id, chat_histories[-1].created_at, overlap_count
+            )
+        )
+    await ensure_codec_dictionaries(
+        db,
+        [history.content for history in chat_histories + overlap_chat_histories],
+    )
+    memory = ConversationMemory.from_chat_histories(
+        chat_histories,
+        overlap_chat_histories,
+        window_size=max_limit,
+        codec=history_codec,
+        pruner=history_pruner,
+    )
+    conversation_cache.put(guest_id, memory, token)
+    return memory
+
+
+def remember_chat_history(chat_history: ChatHistory):
+    """
+    Cập nhật cache sau khi một chat history đã được commit: turn không có
+    summary được append, summary mới thì đọc lại từ DB ở lượt sau.
+    """
+    if chat_history.summary:
+        conversation_cache.invalidate(chat_history.guest_id)
+        return
+    conversation_cache.append(
+        chat_history.guest_id,
+        MemoryTurn.from_chat_history(chat_history, history_codec, history_pruner),
+        chat_history.history_count,
+    )
+
+
+def encode_chat_history(
+    messages_json: bytes,
+    qa_content: str,
+    context_messages: list[ModelMessage] | None = None,
+) -> tuple[bytes, bytes]:
+    """
+    content (đã bỏ thinking, cắt bớt kết quả tool dài) và qa_content ở định
+    dạng nén để lưu vào chat_histories. context_messages (vd. script đã gửi
+    cho agent) được lưu trước các message của turn.
+    """
+    messages = history_pruner.prune(
+        (context_messages or []) + ModelMessagesTypeAdapter.validate_json(messages_json)
+    )
+    return (
+        history_codec.encode_model_messages(messages),
+        history_codec.encode_text(qa_content),
+    )
+
+
+async def get_latest_qa_texts(db: AsyncSession, guest_id: str, limit: int) -> str:
+    """Nối qa_content của limit chat history gần nhất (cũ -> mới)"""
+    qa_contents = await chat_history_repository.get_latest_qa_content(
+        db, guest_id, limit=limit
+    )
+    await ensure_codec_dictionaries(db, qa_contents)
+    return "".join(history_codec.decode_text(data) for data in reversed(qa_contents))
+
+
+async def train_codec_dictionary() -> int | None:
+    """
+    Train dictionary từ các chat history mới nhất và dùng nó để nén từ giờ.
+    Trả về dict id, None nếu chưa đủ mẫu.
+    """
+    async with session_scope() as db:
+        histories = await chat_history_repository.get_chat_history_samples(
+            db, DICTIONARY_SAMPLE_LIMIT
+        )
+        await ensure_codec_dictionaries(
+            db,
+            [h.content for h in histories] + [h.qa_content for h in histories],
+        )
+    samples = []
+    for history in histories:
+        samples.append(history_codec.messages_payload_of(history.content))
+        if history.qa_content:
+            samples.append(history_codec.text_payload_of(history.qa_content))
+
+    dictionary = await asyncio.to_thread(train_dictionary, samples)
+    if dictionary is None:
+        return None
+    dict_id = dictionary.dict_id()
+    await with_session(
+        lambda db: compression_dictionary_repository.insert_dictionary(
+            db, dict_id, dictionary.as_bytes(), len(samples)
+        )
+    )
+    history_codec.add_dictionary(dict_id, dictionary.as_bytes())
+    return dict_id
+
+
+def _recompress(data: bytes, is_messages: bool, stats: dict) -> bytes:
+    """Nén lại một giá trị, ghi nhận kích thước và thời gian decode trước/sau"""
+    if is_messages:
+        decode, payload_of = (
+            history_codec.decode_messages,
+            history_codec.messages_payload_of,
+        )
+    else:
+        decode, payload_of = history_codec.decode_text, history_codec.text_payload_of
+    start = time.perf_counter()
+    decode(data)
+    stats["decode_before"] += time.perf_counter() - start
+
+    encoded = history_codec.compress(payload_of(data))
+
+    start = time.perf_counter()
+    decode(encoded)
+    stats["decode_after"] += time.perf_counter() - start
+    stats["bytes_before"] += len(data)
+    stats["bytes_after"] += len(encoded)
+    return encoded
+
+
+def _migration_report(stats: dict) -> dict:
+    rows = stats["rows"] or 1
+    return {
+        "rows": stats["rows"],
+        "failed": stats["failed"],
+        "avg_bytes_before": stats["bytes_before"] / rows,
+        "avg_bytes_after": stats["bytes_after"] / rows,
+        "avg_decode_ms_before": stats["decode_before"] * 1000 / rows,
+        "avg_decode_ms_after": stats["decode_after"] * 1000 / rows,
+    }
+
+
+async def migrate_chat_histories(
+    batch_size: int = MIGRATION_BATCH_SIZE, pause: float = MIGRATION_PAUSE
+) -> dict:
+    """
+    Background job: nén lại các chat history ở định dạng legacy (hoặc nén với
+    dictionary cũ) bằng dictionary hiện tại, train dictionary nếu chưa có.
+    Trả về (và in ra) kích thước, thời gian decode trung bình mỗi row trước/sau.
+    Row không giải nén được được giữ nguyên, bỏ qua ở các batch sau và đếm vào
+    "failed".
+    """
+    global _migration_stats
+    stats = {
+        "rows": 0,
+        "failed": 0,
+        "bytes_before": 0,
+        "bytes_after": 0,
+        "decode_before": 0.0,
+        "decode_after": 0.0,
+    }
+    skipped_ids: set[str] = set()
+    try:
+        if not history_codec.active_dictionary_id:
+            await train_codec_dictionary()
+        while True:
+            async with session_scope() as db:
+                histories = (
+                    await chat_history_repository.get_chat_histories_to_recompress(
+                        db, history_codec.header, batch_size, exclude_ids=skipped_ids
+                    )
+                )
+                if not histories:
+                    break
+                await ensure_codec_dictionaries(
+                    db,
+                    [h.content for h in histories] + [h.qa_content for h in histories],
+                )
+                for history in histories:
+                    row_stats = {key: 0 for key in stats}
+                    try:
+                        content = _recompress(history.content, True, row_stats)
+                        qa_content = history.qa_content
+                        if qa_content:
+                            qa_content = _recompress(qa_content, False, row_stats)
+                    except Exception as e:
+                        print(f"Error recompressing chat history {history.id}: {e}")
+                        skipped_ids.add(history.id)
+                        stats["failed"] += 1
+                        continue
+                    history.content = content
+                    history.qa_content = qa_content
+                    for key, value in row_stats.items():
+                        stats[key] += value
+                    stats["rows"] += 1
+            _migration_stats = _migration_report(stats)
+            await asyncio.sleep(pause)
+    except Exception as e:
+        print(f"Error migrating chat histories: {e}")
+
+    _migration_stats = _migration_report(stats)
+    print(
+        "Chat history migration: {rows} rows ({failed} failed), avg size "
+        "{avg_bytes_before:.0f} -> "
+        "{avg_bytes_after:.0f} bytes, avg decode {avg_decode_ms_before:.3f} -> "
+        "{avg_decode_ms_after:.3f} ms".format(**_migration_stats)
+    )
+    return _migration_stats
+
+
+def get_migration_metrics() -> dict:
+    return dict(_migration_stats)
+
+
+async def load_codec_dictionaries_on_startup():
+    try:
+        await with_session(lambda db: load_codec_dictionaries(db))
+    except Exception as e:
+        print(f"Error loading compression dictionaries: {e}")
 
 
 async def agent_messages_to_xml(user_input: str, message_parts: list[MessagePart]):
@@ -1,4 +1,5 @@
 import json
+import math
 
 import aiohttp
 from app.configs import env_config
@@ -49,6 +50,16 @@ async def get_embeddings(texts: str | list[str]) -> list[list[float]]:
             return [item["embedding"] for item in data]
 
 
+def truncate_embedding(embedding: list[float], dimensions: int) -> list[float]:
+    """
+    Embedding jina-embeddings-v3 (Matryoshka): giữ `dimensions` chiều đầu và chuẩn
+    hóa lại, tương đương gọi API với "dimensions" nhỏ hơn.
+    """
+    truncated = embedding[:dimensions]
+    norm = math.sqrt(sum(value * value for value in truncated))
+    return [value / norm for value in truncated] if norm else truncated
+
+
 async def rerank(query: str, texts: list[str]) -> list[ReRankResult]:
     """
     Rerank text documents based on their relevance to a query using Jina AI API
@@ -2,9 +2,55 @@ import os
 import sys
 
 from app.configs import env_config
+from app.services.clients.jina import truncate_embedding
 from app.utils import asyncio_utils
 from qdrant_client import AsyncQdrantClient
-from qdrant_client.models import Distance, Modifier, SparseVectorParams, VectorParams
+from qdrant_client.models import (
+    Disabled,
+    Distance,
+    HnswConfigDiff,
+    Modifier,
+    PayloadSchemaType,
+    Prefetch,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    SparseVectorParams,
+    VectorParams,
+    VectorParamsDiff,
+)
+
+DENSE_VECTOR_SIZE = 1024
+
+# Vector Matryoshka (jina cắt ngắn), tên gồm số chiều để đổi số chiều không đụng
+# vector cũ. Chỉ collection tạo mới có vector này (Qdrant không thêm được named
+# vector vào collection đã có), collection cũ vẫn search một bước trên "jina"
+MRL_VECTOR_NAME = (
+    f"jina_{env_config.QDRANT_MRL_DIMENSIONS}"
+    if 0 < env_config.QDRANT_MRL_DIMENSIONS < DENSE_VECTOR_SIZE
+    else None
+)
+_mrl_collections: set[str] = set()
+
+# Payload được filter (search theo sheet, xóa theo id) và group-by
+SCRIPT_PAYLOAD_INDEXES = {"script_id": PayloadSchemaType.KEYWORD}
+SHEET_PAYLOAD_INDEXES = {
+    "sheet_id": PayloadSchemaType.KEYWORD,
+    "row_id": PayloadSchemaType.INTEGER,
+}
+
+# Search trên vector lượng tử hóa lấy dư oversampling lần rồi rescore bằng vector gốc
+DENSE_SEARCH_PARAMS = (
+    SearchParams(
+        quantization=QuantizationSearchParams(
+            rescore=True, oversampling=env_config.QDRANT_QUANTIZATION_OVERSAMPLING
+        )
+    )
+    if env_config.QDRANT_QUANTIZATION
+    else None
+)
 
 
 def create_qdrant_client() -> AsyncQdrantClient:
@@ -12,22 +58,176 @@ def create_qdrant_client() -> AsyncQdrantClient:
     return AsyncQdrantClient(url=env_config.QDRANT_URL, prefer_grpc=True)
 
 
-async def init_qdrant():
-    client = create_qdrant_client()
+def get_quantization_config() -> ScalarQuantization | None:
+    if not env_config.QDRANT_QUANTIZATION:
+        return None
+    return ScalarQuantization(
+        scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8, quantile=0.99, always_ram=True
+        )
+    )
 
-    if not await client.collection_exists(env_config.QDRANT_SCRIPT_COLLECTION_NAME):
+
+def get_hnsw_config() -> HnswConfigDiff:
+    return HnswConfigDiff(
+        m=env_config.QDRANT_HNSW_M, ef_construct=env_config.QDRANT_HNSW_EF_CONSTRUCT
+    )
+
+
+def _quantization_changed(current, wanted: ScalarQuantization | None) -> bool:
+    # So sánh từng field: quantile trả về qua gRPC là float32
+    if wanted is None or not isinstance(current, ScalarQuantization):
+        return wanted is not None or isinstance(current, ScalarQuantization)
+    return (
+        current.scalar.type != wanted.scalar.type
+        or bool(current.scalar.always_ram) != wanted.scalar.always_ram
+        or abs((current.scalar.quantile or 1.0) - wanted.scalar.quantile) > 1e-6
+    )
+
+
+async def ensure_collection(
+    client: AsyncQdrantClient, collection_name: str, payload_indexes: dict
+):
+    """
+    Tạo collection nếu chưa có, collection đã có thì cập nhật tại chỗ (Qdrant tự
+    lượng tử hóa / build lại index ở background) khi cấu hình khác với env.
+    """
+    quantization_config = get_quantization_config()
+    if not await client.collection_exists(collection_name):
+        vectors_config = {
+            "jina": VectorParams(
+                size=DENSE_VECTOR_SIZE,
+                distance=Distance.COSINE,
+                on_disk=env_config.QDRANT_ON_DISK_VECTORS,
+                # Vector đầy đủ chỉ dùng tính lại điểm, không cần graph HNSW
+                hnsw_config=HnswConfigDiff(m=0) if MRL_VECTOR_NAME else None,
+            )
+        }
+        if MRL_VECTOR_NAME:
+            vectors_config[MRL_VECTOR_NAME] = VectorParams(
+                size=env_config.QDRANT_MRL_DIMENSIONS, distance=Distance.COSINE
+            )
         await client.create_collection(
-            collection_name=env_config.QDRANT_SCRIPT_COLLECTION_NAME,
-            vectors_config={"jina": VectorParams(size=1024, distance=Distance.COSINE)},
+            collection_name=collection_name,
+            vectors_config=vectors_config,
             sparse_vectors_config={"bm25": SparseVectorParams(modifier=Modifier.IDF)},
+            hnsw_config=get_hnsw_config(),
+            quantization_config=quantization_config,
+        )
+        info = None
+        use_mrl = MRL_VECTOR_NAME is not None
+    else:
+        info = await client.get_collection(collection_name)
+        config = info.config
+        vector_names = set(config.params.vectors)
+        jina_params = config.params.vectors["jina"]
+        jina_hnsw = jina_params.hnsw_config
+        # "jina" chỉ không có graph HNSW (m=0) khi có vector Matryoshka thay thế.
+        # Graph đã build lại thì giữ search một bước: point thêm trong lúc tắt MRL
+        # không có vector Matryoshka
+        use_mrl = (
+            MRL_VECTOR_NAME in vector_names
+            and jina_hnsw is not None
+            and jina_hnsw.m == 0
+        )
+        # QDRANT_MRL_DIMENSIONS tắt / đổi số chiều sau khi tạo collection: search
+        # một bước trên "jina" cần lại graph HNSW, nếu không sẽ là full scan
+        jina_hnsw_changed = (
+            jina_hnsw is not None
+            and not use_mrl
+            and (
+                jina_hnsw.m != env_config.QDRANT_HNSW_M
+                or jina_hnsw.ef_construct != env_config.QDRANT_HNSW_EF_CONSTRUCT
+            )
         )
+        changed = (
+            jina_hnsw_changed
+            or bool(jina_params.on_disk) != env_config.QDRANT_ON_DISK_VECTORS
+            or config.hnsw_config.m != env_config.QDRANT_HNSW_M
+            or config.hnsw_config.ef_construct != env_config.QDRANT_HNSW_EF_CONSTRUCT
+            or _quantization_changed(config.quantization_config, quantization_config)
+        )
+        if changed:
+            jina_diff = VectorParamsDiff(on_disk=env_config.QDRANT_ON_DISK_VECTORS)
+            if jina_hnsw is not None and not use_mrl:
+                jina_diff.hnsw_config = get_hnsw_config()
+            if jina_hnsw_changed and jina_hnsw.m == 0:
+                print(
+                    f"Warning: QDRANT_MRL_DIMENSIONS changed for Qdrant collection "
+                    f"{collection_name}, rebuilding HNSW graph of jina vectors"
+                )
+            await client.update_collection(
+                collection_name=collection_name,
+                vectors_config={"jina": jina_diff},
+                hnsw_config=get_hnsw_config(),
+                # Disabled để bỏ lượng tử hóa của collection đã bật trước đó
+                quantization_config=quantization_config or Disabled.DISABLED,
+            )
+            print(f"Updated Qdrant collection config: {collection_name}")
 
-    if not await client.collection_exists(env_config.QDRANT_SHEET_COLLECTION_NAME):
-        await client.create_collection(
-            collection_name=env_config.QDRANT_SHEET_COLLECTION_NAME,
-            vectors_config={"jina": VectorParams(size=1024, distance=Distance.COSINE)},
-            sparse_vectors_config={"bm25": SparseVectorParams(modifier=Modifier.IDF)},
+    if use_mrl:
+        _mrl_collections.add(collection_name)
+    else:
+        _mrl_collections.discard(collection_name)
+
+    payload_schema = info.payload_schema if info else {}
+    for field_name, field_schema in payload_indexes.items():
+        if field_name not in payload_schema:
+            await client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=field_schema,
+            )
+
+
+def get_dense_vectors(collection_name: str, embedding: list[float]) -> dict:
+    """Các named vector dense của một point: jina và vector Matryoshka nếu có"""
+    vectors = {"jina": embedding}
+    if collection_name in _mrl_collections:
+        vectors[MRL_VECTOR_NAME] = truncate_embedding(
+            embedding, env_config.QDRANT_MRL_DIMENSIONS
+        )
+    return vectors
+
+
+def get_dense_prefetch(
+    collection_name: str, embedding: list[float], limit: int | None = None
+) -> Prefetch:
+    """
+    Prefetch dense cho hybrid search. Collection có vector Matryoshka: lấy rộng
+    trên vector nhỏ rồi tính lại điểm các ứng viên bằng vector jina đầy đủ.
+    """
+    if collection_name not in _mrl_collections:
+        return Prefetch(
+            query=embedding, using="jina", limit=limit, params=DENSE_SEARCH_PARAMS
         )
+    candidates = (limit or 10) * env_config.QDRANT_MRL_OVERSAMPLING
+    return Prefetch(
+        prefetch=Prefetch(
+            query=truncate_embedding(embedding, env_config.QDRANT_MRL_DIMENSIONS),
+            using=MRL_VECTOR_NAME,
+            limit=candidates,
+            params=DENSE_SEARCH_PARAMS,
+        ),
+        query=embedding,
+        using="jina",
+        limit=limit,
+    )
+
+
+async def init_qdrant():
+    if env_config.QDRANT_QUANTIZATION and not env_config.QDRANT_ON_DISK_VECTORS:
+        print(
+            "Warning: QDRANT_QUANTIZATION without QDRANT_ON_DISK_VECTORS keeps both "
+            "int8 and float32 jina vectors in RAM (more than without quantization)"
+        )
+    client = create_qdrant_client()
+    await ensure_collection(
+        client, env_config.QDRANT_SCRIPT_COLLECTION_NAME, SCRIPT_PAYLOAD_INDEXES
+    )
+    await ensure_collection(
+        client, env_config.QDRANT_SHEET_COLLECTION_NAME, SHEET_PAYLOAD_INDEXES
+    )
 
 
 # Only initialize Qdrant if not running in test mode
@@ -0,0 +1,650 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import urlencode
+
+import aiohttp
+from app.configs import env_config
+
+GRAPH_API_URL = "https://graph.facebook.com/v22.0"
+
+# Độ ưu tiên: số nhỏ hơn được gửi trước
+PRIORITY_REPLY = 0
+PRIORITY_SENDER_ACTION = 1
+
+PAGE_RATE = 20  # requests / second cho toàn page
+PAGE_BURST = 40
+RECIPIENT_RATE = 2  # requests / second cho mỗi người nhận
+RECIPIENT_BURST = 5
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 5
+MAX_BACKOFF = 30  # seconds
+BATCH_WINDOW = 0.005  # seconds gom request thành một Graph API batch
+BATCH_SIZE = 50  # số request tối đa trong một batch của Graph API
+USAGE_THROTTLE_PERCENT = 90  # % usage trong X-*-Usage header bắt đầu giãn request
+RECIPIENT_IDLE_SECONDS = 300  # bỏ token bucket của người nhận không hoạt động
+
+# Graph API error codes cho rate limit / throttling
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613}
+TYPING_ACTIONS = {"typing_on", "typing_off"}
+
+
+class TokenBucket:
+    """Token bucket đơn giản, refill liên tục theo rate tokens / second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        """Số giây cần đợi trước khi có thể lấy một token"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, tokens: int = 1) -> None:
+        self._refill(time.monotonic())
+        self.tokens -= tokens
+
+    def pause(self, seconds: float) -> None:
+        """Chặn bucket trong seconds giây (Retry-After, usage header)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+@dataclass
+class OutboundRequest:
+    recipient_id: str
+    payload: Dict[str, Any]
+    priority: int
+    kind: str  # "message" hoặc tên sender action
+    future: asyncio.Future
+    submitted_at: float = field(default_factory=time.monotonic)
+    attempt: int = 0
+    not_before: float = 0.0
+    queued: bool = False
+    in_flight: bool = False
+    cancelled: bool = False
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def parse_usage_headers(headers) -> tuple[float, float]:
+    """
+    Đọc X-App-Usage, X-Page-Usage và X-Business-Use-Case-Usage.
+
+    Returns:
+        tuple: (usage cao nhất theo %, số giây cần đợi để lấy lại quyền truy cập)
+    """
+    max_usage = 0.0
+    regain_seconds = 0.0
+    if not headers:
+        return max_usage, regain_seconds
+
+    for header in ("X-App-Usage", "X-Page-Usage", "X-Ad-Account-Usage"):
+        value = headers.get(header)
+        if not value:
+            continue
+        try:
+            usage = json.loads(value)
+        except ValueError:
+            continue
+        for metric in ("call_count", "total_time", "total_cputime"):
+            max_usage = max(max_usage, float(usage.get(metric, 0) or 0))
+
+    value = headers.get("X-Business-Use-Case-Usage")
+    if value:
+        try:
+            business_usage = json.loads(value)
+        except ValueError:
+            business_usage = {}
+        for entries in business_usage.values():
+            for usage in entries or []:
+                for metric in ("call_count", "total_time", "total_cputime"):
+                    max_usage = max(max_usage, float(usage.get(metric, 0) or 0))
+                regain_minutes = usage.get("estimated_time_to_regain_access", 0) or 0
+                regain_seconds = max(regain_seconds, float(regain_minutes) * 60)
+
+    return max_usage, regain_seconds
+
+
+class DispatcherMetrics:
+    def __init__(self):
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.latency_total: Dict[str, float] = {}
+        self.latency_max: Dict[str, float] = {}
+        self.latency_count: Dict[str, int] = {}
+
+    def observe_latency(self, kind: str, seconds: float) -> None:
+        self.latency_total[kind] = self.latency_total.get(kind, 0.0) + seconds
+        self.latency_max[kind] = max(self.latency_max.get(kind, 0.0), seconds)
+        self.latency_count[kind] = self.latency_count.get(kind, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "throttled": self.throttled,
+            "latency": {
+                kind: {
+                    "count": count,
+                    "avg_seconds": self.latency_total[kind] / count,
+                    "max_seconds": self.latency_max[kind],
+                }
+                for kind, count in self.latency_count.items()
+            },
+        }
+
+
+class MessengerDispatcher:
+    """
+    Hàng đợi gửi tin nhắn ra Messenger Send API.
+
+    - Token bucket cho toàn page và cho từng người nhận
+    - Tin trả lời (PRIORITY_REPLY) được gửi trước typing indicator và mark_seen
+    - Giữ đúng thứ tự các request của cùng một người nhận
+    - Gộp các typing action dư thừa chưa được gửi
+    - Retry trong worker (tôn trọng Retry-After và usage headers), không chặn caller
+    - Caller nhận về asyncio.Future[bool]
+    - batch_mode: gom các request trong BATCH_WINDOW thành một Graph API batch
+      request, các request cùng người nhận được nối bằng depends_on
+    """
+
+    def __init__(
+        self,
+        page_rate: float = PAGE_RATE,
+        page_burst: float = PAGE_BURST,
+        recipient_rate: float = RECIPIENT_RATE,
+        recipient_burst: float = RECIPIENT_BURST,
+        concurrency: int = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        batch_mode: bool = False,
+        batch_window: float = BATCH_WINDOW,
+        api_url: str = GRAPH_API_URL,
+    ):
+        self.page_rate = page_rate
+        self.page_burst = page_burst
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.batch_mode = batch_mode
+        self.batch_window = batch_window
+        self.api_url = api_url
+        self.metrics = DispatcherMetrics()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._ready: Optional[asyncio.PriorityQueue] = None
+        self._workers: list[asyncio.Task] = []
+        self._batch_slots: Optional[asyncio.Semaphore] = None
+        self._batch_tasks: set[asyncio.Task] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._sequence = itertools.count()
+        self._lanes: Dict[str, Deque[OutboundRequest]] = {}
+        self._page_bucket = TokenBucket(self.page_rate, self.page_burst)
+        self._recipient_buckets: Dict[str, TokenBucket] = {}
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Event loop mới (restart, test) - không dùng lại queue / session của loop cũ
+            self._loop = loop
+            self._reset()
+        if self._ready is None:
+            self._ready = asyncio.PriorityQueue()
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        if self.batch_mode:
+            # Một worker gom batch, tối đa concurrency batch được gửi song song
+            if self._batch_slots is None:
+                self._batch_slots = asyncio.Semaphore(self.concurrency)
+            if not self._workers:
+                self._workers.append(loop.create_task(self._batch_worker()))
+            return
+        while len(self._workers) < self.concurrency:
+            self._workers.append(loop.create_task(self._worker()))
+
+    def send_message(
+        self, recipient_id: str, message: Dict[str, Any], messaging_type="RESPONSE"
+    ) -> asyncio.Future:
+        payload = {
+            "recipient": {"id": recipient_id},
+            "messaging_type": messaging_type,
+            "message": message,
+        }
+        future = self._submit(recipient_id, payload, PRIORITY_REPLY, "message")
+        # Tin nhắn tự tắt typing indicator, bỏ các typing action đang chờ
+        for request in list(self._lanes.get(recipient_id, ())):
+            if request.kind in TYPING_ACTIONS and not request.in_flight:
+                self._drop(request)
+        return future
+
+    def send_action(self, recipient_id: str, action: str) -> asyncio.Future:
+        if action in TYPING_ACTIONS:
+            # Gộp với typing action chưa gửi của cùng người nhận
+            for request in reversed(self._lanes.get(recipient_id, ())):
+                if request.cancelled or request.in_flight:
+                    continue
+                if request.kind in TYPING_ACTIONS:
+                    request.kind = action
+                    request.payload["sender_action"] = action
+                    self.metrics.coalesced += 1
+                    return request.future
+                break
+        payload = {"recipient": {"id": recipient_id}, "sender_action": action}
+        return self._submit(recipient_id, payload, PRIORITY_SENDER_ACTION, action)
+
+    def _submit(
+        self, recipient_id: str, payload: Dict[str, Any], priority: int, kind: str
+    ) -> asyncio.Future:
+        self._ensure_started()
+        request = OutboundRequest(
+            recipient_id=recipient_id,
+            payload=payload,
+            priority=priority,
+            kind=kind,
+            future=self._loop.create_future(),
+        )
+        self.metrics.submitted += 1
+        lane = self._lanes.setdefault(recipient_id, deque())
+        lane.append(request)
+        if len(lane) == 1:
+            self._enqueue(request)
+        return request.future
+
+    def _enqueue(self, request: OutboundRequest) -> None:
+        """Đưa request đầu lane vào hàng đợi ưu tiên (nếu chưa có trong đó)"""
+        if request.queued or request.future.done():
+            return
+        request.queued = True
+        self._ready.put_nowait((request.priority, next(self._sequence), request))
+
+    def _take(self, request: OutboundRequest) -> bool:
+        """Kiểm tra request vừa lấy ra khỏi hàng đợi có gửi được ngay không"""
+        request.queued = False
+        if request.future.done():
+            lane = self._lanes.get(request.recipient_id)
+            if lane and lane[0] is request:
+                self._advance(request)
+            return False
+        if request.in_flight:
+            return False
+        delay = request.not_before - time.monotonic()
+        if delay > 0:
+            self._loop.call_later(delay, self._enqueue, request)
+            return False
+        return True
+
+    def _drop(self, request: OutboundRequest) -> None:
+        request.cancelled = True
+        self.metrics.dropped += 1
+        if not request.future.done():
+            request.future.set_result(True)
+        # Head đang đợi call_later (token người nhận, retry) không nằm trong hàng
+        # đợi: _take sẽ không gặp lại nó nên phải chuyển lane sang request kế tiếp
+        lane = self._lanes.get(request.recipient_id)
+        if lane and lane[0] is request and not request.queued:
+            self._advance(request)
+
+    def _advance(self, request: OutboundRequest) -> None:
+        """Bỏ request đã xong khỏi lane và đưa request kế tiếp vào hàng đợi"""
+        lane = self._lanes.get(request.recipient_id)
+        if lane and lane[0] is request:
+            lane.popleft()
+        while lane and lane[0].future.done():
+            lane.popleft()
+        if lane:
+            self._enqueue(lane[0])
+        else:
+            self._lanes.pop(request.recipient_id, None)
+
+    def _recipient_bucket(self, recipient_id: str) -> TokenBucket:
+        bucket = self._recipient_buckets.get(recipient_id)
+        if bucket is None:
+            if len(self._recipient_buckets) > 10000:
+                now = time.monotonic()
+                self._recipient_buckets = {
+                    key: value
+                    for key, value in self._recipient_buckets.items()
+                    if now - value.updated_at < RECIPIENT_IDLE_SECONDS
+                }
+            bucket = TokenBucket(self.recipient_rate, self.recipient_burst)
+            self._recipient_buckets[recipient_id] = bucket
+        return bucket
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, request = await self._ready.get()
+            if not self._take(request):
+                continue
+
+            page_wait = self._page_bucket.wait_time()
+            if page_wait > 0:
+                # Trả lại hàng đợi để request ưu tiên cao hơn được lấy trước sau khi đợi
+                self._enqueue(request)
+                await asyncio.sleep(page_wait)
+                continue
+            recipient_bucket = self._recipient_bucket(request.recipient_id)
+            recipient_wait = recipient_bucket.wait_time()
+            if recipient_wait > 0:
+                self._loop.call_later(recipient_wait, self._enqueue, request)
+                continue
+
+            self._page_bucket.consume()
+            recipient_bucket.consume()
+            request.in_flight = True
+            try:
+                await self._process(request)
+            except Exception as e:
+                print(f"Error in messenger dispatcher: {e}")
+                request.in_flight = False
+                self._finish(request, False)
+
+    async def _batch_worker(self) -> None:
+        while True:
+            _, _, first = await self._ready.get()
+            if not self._take(first):
+                continue
+            # Đợi thêm request (của các guest khác) trong cửa sổ batch
+            await asyncio.sleep(self.batch_window)
+
+            page_wait = self._page_bucket.wait_time()
+            if page_wait > 0:
+                self._enqueue(first)
+                await asyncio.sleep(page_wait)
+                continue
+
+            heads = [first]
+            while not self._ready.empty() and len(heads) < BATCH_SIZE:
+                _, _, request = self._ready.get_nowait()
+                if self._take(request):
+                    heads.append(request)
+
+            batch: List[OutboundRequest] = []
+            for head in heads:
+                if len(batch) >= BATCH_SIZE:
+                    self._enqueue(head)
+                    continue
+                recipient_bucket = self._recipient_bucket(head.recipient_id)
+                recipient_wait = recipient_bucket.wait_time()
+                if recipient_wait > 0:
+                    self._loop.call_later(recipient_wait, self._enqueue, head)
+                    continue
+                # Lấy cả các request đang chờ phía sau head (thứ tự được giữ bằng
+                # depends_on), mỗi request là một call tới người nhận nên tốn một
+                # token. Hết token thì phần còn lại của lane đợi batch sau
+                taken = 0
+                for request in self._lanes.get(head.recipient_id, ()):
+                    if len(batch) >= BATCH_SIZE:
+                        break
+                    if request.future.done():
+                        continue
+                    if taken and recipient_bucket.wait_time() > 0:
+                        break
+                    recipient_bucket.consume()
+                    taken += 1
+                    request.in_flight = True
+                    batch.append(request)
+
+            if not batch:
+                continue
+            # Graph API tính mỗi request trong batch là một call
+            self._page_bucket.consume(len(batch))
+            await self._batch_slots.acquire()
+            task = self._loop.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[OutboundRequest]) -> None:
+        try:
+            await self._process_batch(batch)
+        except Exception as e:
+            print(f"Error in messenger dispatcher batch: {e}")
+            for request in batch:
+                request.in_flight = False
+            for request in batch:
+                if not request.future.done():
+                    self._finish(request, False)
+        finally:
+            self._batch_slots.release()
+
+    async def _process(self, request: OutboundRequest) -> None:
+        try:
+            status, headers, body = await self.post(request.payload)
+        except Exception as e:
+            print(f"Error during request: {e}, attempt {request.attempt + 1}")
+            status, headers, body = None, None, None
+        request.in_flight = False
+        retryable, retry_after = self._evaluate(request, status, headers, body)
+        if retryable is None:
+            self._finish(request, True)
+        else:
+            self._retry_or_fail(request, retryable, retry_after)
+
+    async def _process_batch(self, batch: List[OutboundRequest]) -> None:
+        try:
+            results = await self.post_batch([request.payload for request in batch])
+        except Exception as e:
+            print(f"Error during batch request: {e}")
+            results = [(None, None, None)] * len(batch)
+        for request in batch:
+            request.in_flight = False
+
+        blocked: set[str] = set()
+        for request, result in zip(batch, results):
+            if request.future.done() or request.recipient_id in blocked:
+                # Request phía sau một request lỗi (depends_on) được gửi lại sau
+                continue
+            status, headers, body = result or (None, None, None)
+            retryable, retry_after = self._evaluate(request, status, headers, body)
+            if retryable is None:
+                self._finish(request, True)
+                continue
+            blocked.add(request.recipient_id)
+            self._retry_or_fail(request, retryable, retry_after)
+
+    def _evaluate(
+        self, request: OutboundRequest, status, headers, body
+    ) -> tuple[Optional[bool], Optional[float]]:
+        """
+        Đánh giá kết quả của một request.
+
+        Returns:
+            tuple: (None nếu thành công, hoặc retryable: bool; retry_after giây)
+        """
+        if status is None:
+            return True, None
+
+        retry_after = self._apply_rate_limit_headers(headers)
+        if status == 200:
+            return None, None
+
+        print(f"Request failed with status {status}, attempt {request.attempt + 1}")
+        error_code = None
+        if isinstance(body, dict):
+            error_code = (body.get("error") or {}).get("code")
+        if status == 429 or error_code in RATE_LIMIT_ERROR_CODES:
+            self.metrics.throttled += 1
+            if retry_after is None:
+                retry_after = min(2 ** (request.attempt + 1), MAX_BACKOFF)
+            self._page_bucket.pause(retry_after)
+            return True, retry_after
+        return status >= 500, retry_after
+
+    def _retry_or_fail(
+        self, request: OutboundRequest, retryable: bool, retry_after: Optional[float]
+    ) -> None:
+        request.attempt += 1
+        if not retryable or request.attempt >= self.max_retries:
+            print(
+                f"Messenger request failed after {request.attempt} attempt(s) "
+                f"for recipient {request.recipient_id}"
+            )
+            self._finish(request, False)
+            return
+        # Retry trong dispatcher, giữ lane để không gửi sai thứ tự
+        self.metrics.retried += 1
+        delay = (
+            retry_after
+            if retry_after is not None
+            else min(2**request.attempt, MAX_BACKOFF)
+        )
+        request.not_before = time.monotonic() + delay
+        self._enqueue(request)
+
+    def _finish(self, request: OutboundRequest, success: bool) -> None:
+        if success:
+            self.metrics.sent += 1
+        else:
+            self.metrics.failed += 1
+        self.metrics.observe_latency(
+            request.kind, time.monotonic() - request.submitted_at
+        )
+        if not request.future.done():
+            request.future.set_result(success)
+        self._advance(request)
+
+    def _apply_rate_limit_headers(self, headers) -> Optional[float]:
+        retry_after = parse_retry_after(headers)
+        usage, regain_seconds = parse_usage_headers(headers)
+        if regain_seconds > 0:
+            retry_after = max(retry_after or 0.0, regain_seconds)
+        if retry_after:
+            self._page_bucket.pause(retry_after)
+        elif usage >= USAGE_THROTTLE_PERCENT:
+            # Gần chạm giới hạn - giãn request trước khi bị Graph API chặn
+            self._page_bucket.pause(min(usage - USAGE_THROTTLE_PERCENT + 1, 10))
+        return retry_after
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def post(self, payload: Dict[str, Any]) -> tuple[int, Any, Any]:
+        """POST một payload tới /{PAGE_ID}/messages, trả về (status, headers, body)"""
+        async with self._get_session().post(
+            f"{self.api_url}/{env_config.PAGE_ID}/messages",
+            params={"access_token": env_config.PAGE_ACCESS_TOKEN},
+            json=payload,
+            headers={"Content-Type": "application/json"},
+        ) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = None
+            return response.status, response.headers, body
+
+    async def post_batch(
+        self, payloads: List[Dict[str, Any]]
+    ) -> List[Optional[tuple[int, Any, Any]]]:
+        """
+        Gửi nhiều payload trong một Graph API batch request.
+        Các payload cùng người nhận được nối bằng depends_on để giữ thứ tự.
+
+        Returns:
+            list: (status, headers, body) cho từng payload, None nếu không được thực thi
+        """
+        items = []
+        last_names: Dict[str, str] = {}
+        for index, payload in enumerate(payloads):
+            recipient_id = payload["recipient"]["id"]
+            item = {
+                "method": "POST",
+                "relative_url": f"{env_config.PAGE_ID}/messages",
+                "body": urlencode(
+                    {
+                        key: json.dumps(value) if isinstance(value, dict) else value
+                        for key, value in payload.items()
+                    }
+                ),
+                "name": f"request_{index}",
+                "omit_response_on_success": False,
+            }
+            if recipient_id in last_names:
+                item["depends_on"] = last_names[recipient_id]
+            last_names[recipient_id] = item["name"]
+            items.append(item)
+
+        async with self._get_session().post(
+            f"{self.api_url}/",
+            data={
+                "access_token": env_config.PAGE_ACCESS_TOKEN or "",
+                "batch": json.dumps(items),
+                "include_headers": "true",
+            },
+        ) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = None
+            if response.status != 200 or not isinstance(body, list):
+                return [(response.status, response.headers, body)] * len(payloads)
+
+        results: List[Optional[tuple[int, Any, Any]]] = []
+        for item in body:
+            if not item:
+                results.append(None)
+                continue
+            headers = {
+                header.get("name"): header.get("value")
+                for header in item.get("headers") or []
+            }
+            try:
+                item_body = json.loads(item.get("body") or "null")
+            except ValueError:
+                item_body = None
+            results.append((item.get("code"), headers, item_body))
+        results.extend([None] * (len(payloads) - len(results)))
+        return results
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metrics = self.metrics.to_dict()
+        metrics["queued"] = sum(len(lane) for lane in self._lanes.values())
+        return metrics
+
+    async def close(self) -> None:
+        for worker in [*self._workers, *self._batch_tasks]:
+            worker.cancel()
+        self._workers = []
+        self._batch_tasks = set()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+dispatcher = MessengerDispatcher(batch_mode=env_config.MESSENGER_BATCH_MODE)
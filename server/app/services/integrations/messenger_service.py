@@ -11,14 +11,12 @@ from app.dtos.setting_dtos import SettingDetailsDto
 from app.models import Guest, GuestInfo
 from app.pydantic_agents import invoke_agent
 from app.repositories import guest_info_repository, guest_repository
-from app.services import chat_service, setting_service
+from app.services import chat_service, setting_service, webhook_event_service
 from app.services.clients import cloudinary
-from app.utils.message_utils import (
-    get_attachment_type_name,
-    markdown_to_messenger,
-    messenger_to_markdown,
-    send_message_to_ws,
-)
+from app.services.integrations import outbox_service
+from app.services.integrations.messenger_dispatcher import dispatcher
+from app.utils.message_utils import get_attachment_type_name, send_message_to_ws
+from app.utils.messenger_format import messenger_to_markdown
 from sqlalchemy.ext.asyncio import AsyncSession
 
 SENDER_ACTION = {
@@ -83,6 +81,13 @@ async def process_message(sender_psid, receipient_psid, timestamp, webhook_event
     """
     Process incoming messages and implements waiting logic
     """
+    # Bỏ qua webhook bị Facebook gửi lại trước khi ghi DB hay gọi agent
+    try:
+        if not await webhook_event_service.claim_event(webhook_event):
+            return
+    except Exception as e:
+        print(f"Error checking duplicate webhook event: {e}")
+
     async with async_session() as db:
         try:
             message = webhook_event.get("message")
@@ -115,6 +120,8 @@ async def process_message(sender_psid, receipient_psid, timestamp, webhook_event
                     db, PROVIDERS.MESSENGER, sender_psid
                 )
                 if not guest:
+                    # Trả connection về pool trước khi gọi Graph API/Cloudinary
+                    await db.commit()
                     guest = await insert_guest(db, sender_psid)
                     if not guest:
                         print(f"Failed to create guest for sender_psid: {sender_psid}")
@@ -161,60 +168,39 @@ async def process_message(sender_psid, receipient_psid, timestamp, webhook_event
                 )
         except Exception as e:
             print(f"Error in process_message: {e}")
+            await webhook_event_service.release_event(webhook_event)
 
 
 async def process_after_wait(sender_psid, wait_seconds: float, guest: Guest):
     """
-    Đợi một khoảng thời gian rồi xử lý tin nhắn tích lũy
+    Đợi một khoảng thời gian rồi xử lý tin nhắn tích lũy.
+    Không giữ session ở đây: handle_chat chờ LLM, các truy vấn DB tự mở session ngắn
     """
-    async with async_session() as db:
-        try:
-            await asyncio.sleep(wait_seconds)
+    try:
+        await asyncio.sleep(wait_seconds)
 
-            # Lấy dữ liệu người dùng
-            if sender_psid in map_message:
-                user_data = map_message[sender_psid]
+        # Lấy dữ liệu người dùng
+        if sender_psid in map_message:
+            user_data = map_message[sender_psid]
 
-                # Lấy tin nhắn đã tích lũy
-                texts = user_data["texts"]
-                attachments = user_data["attachments"]
+            # Lấy tin nhắn đã tích lũy
+            texts = user_data["texts"]
+            attachments = user_data["attachments"]
 
-                # Xóa dữ liệu người dùng
-                del map_message[sender_psid]
+            # Xóa dữ liệu người dùng
+            del map_message[sender_psid]
 
-                # Gộp tin nhắn
-                combined_message = combine_messages(texts, attachments)
+            # Gộp tin nhắn
+            combined_message = combine_messages(texts, attachments)
 
-                # Xử lý tin nhắn
-                if combined_message:
-                    # Handle the chat message
-                    await handle_chat(sender_psid, combined_message, guest)
-                    await db.commit()
-        except asyncio.CancelledError as ex:
-            await db.rollback()
-            raise ex
-        except Exception as e:
-            await db.rollback()
-            print(f"Error in process_after_wait: {e}")
-
-
-async def send_agent_response_ws(
-    guest_id: str, text: str, attachments: list, created_at: datetime
-):
-    await with_session(
-        lambda db: chat_service.insert_chat(
-            db,
-            guest_id,
-            CHAT_SIDES.STAFF,
-            text,
-            attachments,
-            created_at,
-        )
-    )
-    guest = await with_session(
-        lambda db: guest_repository.get_guest_by_id(db, guest_id)
-    )
-    await send_message_to_ws(guest)
+            # Xử lý tin nhắn
+            if combined_message:
+                # Handle the chat message
+                await handle_chat(sender_psid, combined_message, guest)
+    except asyncio.CancelledError as ex:
+        raise ex
+    except Exception as e:
+        print(f"Error in process_after_wait: {e}")
 
 
 async def handle_chat(sender_psid, message, guest: Guest):
@@ -224,49 +210,38 @@ async def handle_chat(sender_psid, message, guest: Guest):
         await send_action(sender_psid, SENDER_ACTION["mark_seen"])
         # Start typing indicator in a background task
         typing_task = asyncio.create_task(keep_typing(sender_psid))
+        enqueued_parts = 0
+
+        async def enqueue_parts(message_parts):
+            nonlocal enqueued_parts
+            # Ghi reply vào outbox cùng transaction với các Chat, worker sẽ gửi
+            await with_session(
+                lambda db: outbox_service.enqueue_reply(
+                    db,
+                    guest.id,
+                    sender_psid,
+                    message_parts,
+                    is_continuation=enqueued_parts > 0,
+                )
+            )
+            outbox_service.notify()
+            enqueued_parts += len(message_parts)
+
         try:
-            # Handle the message
-            message_parts = await invoke_agent(guest.id, message)
+            # Handle the message, ở chế độ stream các section đầu được gửi ngay
+            message_parts = await invoke_agent(
+                guest.id,
+                message,
+                on_parts=enqueue_parts if env_config.AGENT_STREAMING else None,
+            )
             # cancel typing task
             if typing_task:
                 typing_task.cancel()
             # send typing_off action
             await send_action(sender_psid, SENDER_ACTION["typing_off"])
 
-            for i, part in enumerate(message_parts):
-                if part.type == "text":
-                    response = {"text": markdown_to_messenger(part.payload)}
-                elif part.type == "link":
-                    response = {"text": part.payload}
-                else:
-                    response = {
-                        "attachments": [
-                            {
-                                "type": part.type,
-                                "payload": {
-                                    "url": part.payload,
-                                },
-                            }
-                        ]
-                    }
-                await call_send_api(sender_psid, response)
-                await send_agent_response_ws(
-                    guest.id,
-                    part.payload if part.type == "text" or part.type == "link" else "",
-                    response.get("attachments", []),
-                    datetime.now(),
-                )
-
-                # Tính delay dựa vào số ký tự của part tiếp theo
-                if i < len(message_parts) - 1:  # Nếu không phải part cuối cùng
-                    next_part = message_parts[i + 1]
-                    char_count = len(str(next_part.payload))
-                    # Cứ 100 ký tự thì đợi 1 giây, tối thiểu 0.5 giây
-                    delay_time = max(0.5, char_count / 100)
-                    delay_typing = asyncio.create_task(keep_typing(sender_psid))
-                    await asyncio.sleep(delay_time)
-                    delay_typing.cancel()
-                    await send_action(sender_psid, SENDER_ACTION["typing_off"])
+            if message_parts:
+                await enqueue_parts(message_parts)
 
         except Exception as e:
             print(f"Error in handle_chat: {e}")
@@ -303,13 +278,12 @@ def combine_messages(texts, attachments):
     return combined_message
 
 
-async def send_action(sender_psid, action):
-    url = f"https://graph.facebook.com/v22.0/{env_config.PAGE_ID}/messages"
-
-    payload = {"recipient": {"id": sender_psid}, "sender_action": action}
-
-    params = {"access_token": env_config.PAGE_ACCESS_TOKEN}
-    await post_to_messenger(url, payload, params)
+async def send_action(sender_psid, action) -> asyncio.Future:
+    """
+    Queue a sender action (mark_seen, typing_on, typing_off) on the dispatcher.
+    Does not wait for delivery; returns the delivery future.
+    """
+    return dispatcher.send_action(sender_psid, action)
 
 
 async def keep_typing(sender_psid):
@@ -379,7 +353,8 @@ async def handle_message(sender_psid, received_message):
 
 async def call_send_api(sender_psid, response) -> bool:
     """
-    Sends response messages via the Send API (Graph API v22.0)
+    Sends response messages via the Send API (Graph API v22.0).
+    Rate limiting, ordering and retries are handled by the messenger dispatcher.
 
     Args:
         sender_psid: The recipient ID
@@ -393,71 +368,5 @@ async def call_send_api(sender_psid, response) -> bool:
         print("Missing PAGE_ID or PAGE_ACCESS_TOKEN")
         return False
 
-    # API endpoint
-    url = f"https://graph.facebook.com/v22.0/{env_config.PAGE_ID}/messages"
-
-    # JSON payload
-    payload = {
-        "recipient": {"id": sender_psid},
-        "messaging_type": "RESPONSE",
-        "message": response,
-    }
-    params = {"access_token": env_config.PAGE_ACCESS_TOKEN}
-    headers = {"Content-Type": "application/json"}
-
-    # Send the message and return the result
-    return await post_to_messenger(url, payload, params, headers)
-
-
-async def post_to_messenger(url, payload, params, headers=None, retry=5) -> bool:
-    """
-    Sends a POST request to the Messenger API with retry logic.
-    Returns True if the request was successful, False otherwise.
-
-    Args:
-        url: The URL to send the request to
-        payload: The JSON payload to send
-        params: URL parameters
-        headers: HTTP headers (can be None)
-        retry: Number of retry attempts (default: 5)
-
-    Returns:
-        bool: True if successful, False if all retries failed
-    """
-    attempt = 0
-    # Set default headers if None
-    if headers is None:
-        headers = {"Content-Type": "application/json"}
-
-    while attempt < retry:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url, params=params, json=payload, headers=headers
-                ) as response:
-                    if response.status == 200:
-                        return True
-                    else:
-                        print(
-                            f"Request failed with status {response.status}, attempt {attempt + 1}/{retry}"
-                        )
-                        attempt += 1
-                        if attempt < retry:
-                            # Exponential backoff: wait 2^attempt seconds before retrying
-                            await asyncio.sleep(2**attempt)
-                        else:
-                            print(f"All {retry} attempts failed for request to {url}")
-                            return False
-        except Exception as e:
-            print(f"Error during request: {e}, attempt {attempt + 1}/{retry}")
-            attempt += 1
-            if attempt < retry:
-                # Exponential backoff: wait 2^attempt seconds before retrying
-                await asyncio.sleep(2**attempt)
-            else:
-                print(
-                    f"All {retry} attempts failed for request to {url} due to exception: {e}"
-                )
-                return False
-
-    return False
+    # Queue the message on the dispatcher and wait for its delivery result
+    return await dispatcher.send_message(sender_psid, response)
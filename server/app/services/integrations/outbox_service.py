@@ -0,0 +1,266 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+
+from app.configs.constants import CHAT_SIDES, OUTBOX_STATUS
+from app.configs.database import with_session
+from app.models import Chat, OutboxMessage
+from app.repositories import chat_repository, guest_repository, outbox_repository
+from app.services.integrations.messenger_dispatcher import dispatcher
+from app.utils.agent_utils import MessagePart
+from app.utils.message_utils import build_message_response, send_message_to_ws
+from sqlalchemy.ext.asyncio import AsyncSession
+
+POLL_INTERVAL = 2  # seconds, khi không có notify
+SENDING_TIMEOUT = 120  # seconds, tin nhắn "sending" lâu hơn coi như worker đã dừng
+MAX_DELIVERY_ATTEMPTS = 3  # dispatcher đã tự retry lỗi rate limit bên trong
+RETRY_BASE_DELAY = 30  # seconds, nhân đôi sau mỗi lần thất bại
+MIN_DELAY_BETWEEN_PARTS = 0.5  # seconds
+TYPING_REFRESH = 8  # seconds, typing indicator của Messenger tự tắt sau ~20s
+LATENCY_SAMPLES = 1000
+
+_worker_task: asyncio.Task | None = None
+_wakeup: asyncio.Event | None = None
+# Recipient đang được gửi trong process này, mỗi recipient một task để giữ thứ tự
+_delivering: dict[str, asyncio.Task] = {}
+
+_metrics = {"delivered": 0, "retried": 0, "failed": 0}
+_latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+
+def get_part_delay(part: MessagePart) -> float:
+    """Cứ 100 ký tự thì đợi 1 giây, tối thiểu MIN_DELAY_BETWEEN_PARTS"""
+    return max(MIN_DELAY_BETWEEN_PARTS, len(str(part.payload)) / 100)
+
+
+async def enqueue_reply(
+    db: AsyncSession,
+    guest_id: str,
+    recipient_id: str,
+    message_parts: list[MessagePart],
+    is_continuation: bool = False,
+) -> list[OutboxMessage]:
+    """
+    Write the agent reply as Chat records plus outbox messages in the caller's
+    transaction. Nothing is sent here; the delivery worker picks the messages
+    up once the transaction is committed and notify() is called.
+    is_continuation: the parts follow parts already enqueued for this reply
+    (streamed reply), so the first part is paced as well.
+    """
+    now = datetime.now()
+    messages = []
+    chat = None
+    for i, part in enumerate(message_parts):
+        response = build_message_response(part)
+        # Lệch 1 micro giây để các part giữ đúng thứ tự khi sắp xếp theo created_at
+        created_at = now + timedelta(microseconds=i)
+        chat = Chat(
+            guest_id=guest_id,
+            content={
+                "side": CHAT_SIDES.STAFF,
+                "message": {
+                    "text": part.payload if part.type in ("text", "link") else "",
+                    "attachments": response.get("attachments", []),
+                },
+            },
+            created_at=created_at,
+        )
+        await chat_repository.insert_chat(db, chat)
+        messages.append(
+            OutboxMessage(
+                guest_id=guest_id,
+                chat_id=chat.id,
+                recipient_id=recipient_id,
+                sequence=i,
+                payload=response,
+                delay_before=(get_part_delay(part) if i > 0 or is_continuation else 0),
+                status=OUTBOX_STATUS.PENDING.value,
+                attempts=0,
+                available_at=created_at,
+                created_at=created_at,
+            )
+        )
+
+    if chat:
+        guest = await guest_repository.get_guest_by_id(db, guest_id)
+        guest.last_message_id = chat.id
+        await guest_repository.update_guest(db, guest)
+    await outbox_repository.insert_outbox_messages(db, messages)
+    return messages
+
+
+def notify():
+    """Đánh thức worker ngay sau khi outbox có tin nhắn mới (đã commit)"""
+    if _wakeup:
+        _wakeup.set()
+
+
+def start_worker():
+    global _worker_task, _wakeup
+    if _worker_task and not _worker_task.done():
+        return
+    _wakeup = asyncio.Event()
+    _worker_task = asyncio.create_task(_run_worker())
+
+
+async def stop_worker():
+    global _worker_task
+    tasks = list(_delivering.values())
+    if _worker_task:
+        tasks.append(_worker_task)
+    for task in tasks:
+        task.cancel()
+    # Tin nhắn đang "sending" sẽ được trả về pending khi khởi động lại
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _worker_task = None
+
+
+async def _run_worker():
+    try:
+        # Khôi phục các reply bị dừng giữa chừng ở lần chạy trước
+        released = await with_session(
+            lambda db: outbox_repository.release_stale_messages(db, datetime.now())
+        )
+        if released:
+            print(f"Outbox: resumed {released} undelivered messages")
+    except Exception as e:
+        print(f"Error releasing outbox messages: {e}")
+
+    while True:
+        _wakeup.clear()
+        try:
+            await _dispatch_pending()
+        except Exception as e:
+            print(f"Error in outbox worker: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _dispatch_pending():
+    now = datetime.now()
+    await with_session(
+        lambda db: outbox_repository.release_stale_messages(
+            db, now - timedelta(seconds=SENDING_TIMEOUT)
+        )
+    )
+    recipient_ids = await with_session(
+        lambda db: outbox_repository.get_pending_recipient_ids(db, now)
+    )
+    for recipient_id in recipient_ids:
+        if recipient_id not in _delivering:
+            _delivering[recipient_id] = asyncio.create_task(
+                deliver_recipient(recipient_id)
+            )
+
+
+async def deliver_recipient(recipient_id: str):
+    """
+    Deliver the ready outbox messages of one recipient in order until none is
+    left. Stops at the first part scheduled for a retry so later parts wait;
+    a part that failed for good is skipped.
+    """
+    try:
+        while True:
+            messages = await with_session(
+                lambda db: outbox_repository.claim_messages(
+                    db, recipient_id, datetime.now()
+                )
+            )
+            if not messages:
+                return
+            if dispatcher.batch_mode:
+                # Gửi tất cả các part trong cùng một Graph API batch, bỏ qua pacing
+                results = await asyncio.gather(
+                    *[
+                        dispatcher.send_message(recipient_id, message.payload)
+                        for message in messages
+                    ]
+                )
+                settled = [
+                    await _record_result(message, delivered)
+                    for message, delivered in zip(messages, results)
+                ]
+                if not all(settled):
+                    return
+                continue
+
+            for i, message in enumerate(messages):
+                if message.delay_before > 0:
+                    await _pace(recipient_id, message.delay_before)
+                delivered = await dispatcher.send_message(recipient_id, message.payload)
+                if not await _record_result(message, delivered):
+                    # Part đang chờ retry, các part sau phải đợi để giữ thứ tự
+                    await with_session(
+                        lambda db: outbox_repository.release_messages(
+                            db, [m.id for m in messages[i + 1 :]]
+                        )
+                    )
+                    return
+    except Exception as e:
+        print(f"Error delivering outbox messages to {recipient_id}: {e}")
+    finally:
+        _delivering.pop(recipient_id, None)
+
+
+async def _pace(recipient_id: str, delay: float):
+    """Hiển thị typing trong lúc chờ gửi part tiếp theo"""
+    remaining = delay
+    while remaining > 0:
+        dispatcher.send_action(recipient_id, "typing_on")
+        step = min(remaining, TYPING_REFRESH)
+        await asyncio.sleep(step)
+        remaining -= step
+
+
+async def _record_result(message: OutboxMessage, delivered: bool) -> bool:
+    """Returns False if the message is scheduled for a retry"""
+    now = datetime.now()
+    if delivered:
+        await with_session(
+            lambda db: outbox_repository.mark_delivered(db, message.id, now)
+        )
+        _metrics["delivered"] += 1
+        _latencies.append((now - message.created_at).total_seconds())
+        await _notify_inbox(message.guest_id)
+        return True
+
+    attempts = message.attempts + 1
+    if attempts >= MAX_DELIVERY_ATTEMPTS:
+        status, available_at = OUTBOX_STATUS.FAILED.value, now
+        _metrics["failed"] += 1
+    else:
+        status = OUTBOX_STATUS.PENDING.value
+        available_at = now + timedelta(seconds=RETRY_BASE_DELAY * 2 ** (attempts - 1))
+        _metrics["retried"] += 1
+    await with_session(
+        lambda db: outbox_repository.mark_undelivered(
+            db, message.id, status, available_at, "Send API request failed"
+        )
+    )
+    return status == OUTBOX_STATUS.FAILED.value
+
+
+async def _notify_inbox(guest_id: str):
+    try:
+        guest = await with_session(
+            lambda db: guest_repository.get_guest_by_id(db, guest_id)
+        )
+        if guest:
+            await send_message_to_ws(guest)
+    except Exception as e:
+        print(f"Error sending outbox update to ws: {e}")
+
+
+def get_metrics() -> dict:
+    """Delivery counters and latency (enqueue -> Send API success) in seconds"""
+    latencies = sorted(_latencies)
+    metrics = dict(_metrics)
+    metrics["delivering"] = len(_delivering)
+    if latencies:
+        metrics["latency_avg"] = sum(latencies) / len(latencies)
+        metrics["latency_p50"] = latencies[len(latencies) // 2]
+        metrics["latency_p95"] = latencies[int(len(latencies) * 0.95)]
+        metrics["latency_max"] = latencies[-1]
+    return metrics
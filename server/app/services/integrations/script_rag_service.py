@@ -7,7 +7,11 @@ from app.dtos import ScriptChunkDto
 from app.models import Script
 from app.repositories import script_repository
 from app.services.clients import jina
-from app.services.clients.qdrant import create_qdrant_client
+from app.services.clients.qdrant import (
+    create_qdrant_client,
+    get_dense_prefetch,
+    get_dense_vectors,
+)
 from app.utils.rag_utils import markdown_splitter
 from fastembed import SparseEmbedding, SparseTextEmbedding
 from qdrant_client import models
@@ -23,6 +27,9 @@ from qdrant_client.models import (
 
 sparse_embedding_model = SparseTextEmbedding(model_name="Qdrant/bm25")
 
+# Số chunk mỗi nhánh prefetch lấy cho mỗi script cần trả về (group-by script_id)
+PREFETCH_CHUNKS_PER_SCRIPT = 10
+
 
 def get_description_for_embedding(script: Script):
     description = script.description
@@ -44,7 +51,9 @@ async def get_points_struct_for_embedding(
         point = PointStruct(
             id=str(uuid.uuid4()),
             vector={
-                "jina": dense_embedding,
+                **get_dense_vectors(
+                    env_config.QDRANT_SCRIPT_COLLECTION_NAME, dense_embedding
+                ),
                 "bm25": SparseVector(
                     indices=sparse_embedding.indices.tolist(),
                     values=sparse_embedding.values.tolist(),
@@ -190,46 +199,36 @@ async def update_script(script_id) -> None:
 
 
 async def search_script_chunks(query: str, limit: int = 5) -> list[Script]:
-    async with async_session() as session:
-        count_db_scripts = await script_repository.count_scripts(session)
-        if count_db_scripts < limit:
-            return await script_repository.get_all_scripts(session)
-        search_result = await query_script_points(query, limit)
-
-        # Tạo dict để lưu script_id và điểm cao nhất
-        script_scores = {}
-        for point in search_result:
-            script_id = point.payload["script_id"]
-            score = point.score
-            if script_id not in script_scores or score > script_scores[script_id]:
-                script_scores[script_id] = score
-
-        # Sắp xếp theo điểm cao nhất và lấy chỉ script_id
-        script_ids = [
-            script_id
-            for script_id, _ in sorted(
-                script_scores.items(), key=lambda x: x[1], reverse=True
-            )
-        ]
-        scripts = await with_session(
-            lambda session: script_repository.get_scripts_by_ids(session, script_ids)
+    return [script for script, _ in await search_scored_scripts(query, limit)]
+
+
+async def search_scored_scripts(
+    query: str, limit: int = 5
+) -> list[tuple[Script, float]]:
+    """
+    Các script liên quan đến query kèm điểm cao nhất của các chunk, sắp xếp theo
+    điểm giảm dần. Related script lấy điểm của script cha.
+    """
+    count_db_scripts = await with_session(script_repository.count_scripts)
+    if count_db_scripts < limit:
+        scripts = await with_session(script_repository.get_all_scripts)
+        return [(script, 0.0) for script in scripts]
+    script_scores = await query_script_scores(query, limit)
+    scripts = await with_session(
+        lambda session: script_repository.get_scripts_by_ids(
+            session, list(script_scores)
         )
-        final_scripts = {}
-        # count = 0
-        for script in scripts:
-            if script.id not in final_scripts:
-                final_scripts[script.id] = script
-                # count += 1
-                # if count >= limit:
-                #     break
-            related_scripts = script.related_scripts
-            for related_script in related_scripts:
-                if related_script.id not in final_scripts:
-                    final_scripts[related_script.id] = related_script
-                    # count += 1
-                    # if count >= limit:
-                    #     break
-        return list(final_scripts.values())
+    )
+    scripts = sorted(scripts, key=lambda script: script_scores[script.id], reverse=True)
+    final_scripts = {}
+    for script in scripts:
+        score = script_scores[script.id]
+        if script.id not in final_scripts:
+            final_scripts[script.id] = (script, score)
+        for related_script in script.related_scripts:
+            if related_script.id not in final_scripts:
+                final_scripts[related_script.id] = (related_script, score)
+    return sorted(final_scripts.values(), key=lambda item: item[1], reverse=True)
 
 
 async def test_search_script_chunks(query: str, limit: int = 5):
@@ -245,6 +244,42 @@ async def test_search_script_chunks(query: str, limit: int = 5):
         ]
 
 
+async def query_script_scores(query: str, limit: int = 5) -> dict[str, float]:
+    """
+    `limit` script khác nhau khớp nhất kèm điểm cao nhất của các chunk: group-by
+    theo script_id, mỗi script chỉ lấy chunk điểm cao nhất và không tải payload.
+    """
+    client = create_qdrant_client()
+    sparse_embedding = next(iter(sparse_embedding_model.query_embed(query)))
+    dense_embeddings = await jina.get_embeddings(query)
+    prefetch_limit = limit * PREFETCH_CHUNKS_PER_SCRIPT
+    result = await client.query_points_groups(
+        collection_name=env_config.QDRANT_SCRIPT_COLLECTION_NAME,
+        group_by="script_id",
+        query=models.FusionQuery(fusion=models.Fusion.DBSF),
+        prefetch=[
+            get_dense_prefetch(
+                env_config.QDRANT_SCRIPT_COLLECTION_NAME,
+                dense_embeddings[0],
+                prefetch_limit,
+            ),
+            models.Prefetch(
+                query=models.SparseVector(
+                    indices=sparse_embedding.indices.tolist(),
+                    values=sparse_embedding.values.tolist(),
+                ),
+                using="bm25",
+                limit=prefetch_limit,
+            ),
+        ],
+        score_threshold=0.5,
+        limit=limit,
+        group_size=1,
+        with_payload=False,
+    )
+    return {group.id: group.hits[0].score for group in result.groups}
+
+
 async def query_script_points(query: str, limit: int = 5) -> list[ScoredPoint]:
     client = create_qdrant_client()
     sparse_embeddings: Iterable[SparseEmbedding] = sparse_embedding_model.query_embed(
@@ -256,9 +291,8 @@ async def query_script_points(query: str, limit: int = 5) -> list[ScoredPoint]:
         collection_name=env_config.QDRANT_SCRIPT_COLLECTION_NAME,
         query=models.FusionQuery(fusion=models.Fusion.DBSF),
         prefetch=[
-            models.Prefetch(
-                query=dense_embeddings[0],
-                using="jina",
+            get_dense_prefetch(
+                env_config.QDRANT_SCRIPT_COLLECTION_NAME, dense_embeddings[0]
             ),
             models.Prefetch(
                 query=models.SparseVector(
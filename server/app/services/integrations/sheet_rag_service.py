@@ -7,7 +7,7 @@ from app.dtos import SheetChunkDto
 from app.models import Sheet
 from app.repositories import sheet_repository
 from app.services.clients import jina
-from app.services.clients.qdrant import create_qdrant_client
+from app.services.clients.qdrant import create_qdrant_client, get_dense_prefetch
 from app.utils import rag_utils
 from fastembed import SparseEmbedding, SparseTextEmbedding
 from qdrant_client import models
@@ -15,14 +15,25 @@ from qdrant_client.http.models import (
     FieldCondition,
     Filter,
     FilterSelector,
+    IsEmptyCondition,
     MatchAny,
     MatchValue,
+    PayloadField,
     ScoredPoint,
 )
 from qdrant_client.models import PointStruct
 
 sparse_embedding_model = SparseTextEmbedding(model_name="Qdrant/bm25")
 
+# Số chunk mỗi nhánh prefetch lấy cho mỗi dòng cần trả về, để group-by đủ `limit`
+# dòng khác nhau khi một dòng có nhiều chunk khớp
+PREFETCH_CHUNKS_PER_ROW = 10
+
+
+def get_row_id_of_chunk(chunk_id: str) -> int:
+    """Row id của chunk, chunk id có dạng {row_id}_{index}"""
+    return int(chunk_id.split("_")[0])
+
 
 async def get_points_struct_for_embedding(
     sheet_chunks: list[SheetChunkDto],
@@ -44,6 +55,7 @@ async def get_points_struct_for_embedding(
                 "sheet_id": sheet_chunk.sheet_id,
                 "sheet_name": sheet_chunk.sheet_name,
                 "id": sheet_chunk.id,
+                "row_id": get_row_id_of_chunk(sheet_chunk.id),
             },
         )
         points.append(point)
@@ -125,37 +137,38 @@ async def delete_sheets(sheet_ids: list[str]) -> None:
     )
 
 
-async def search_chunks_by_sheet_id(
+async def search_rows_by_sheet_id(
     sheet_id: str, query: str, limit: int = 5
-) -> list[SheetChunkDto]:
-    search_result = await query_sheet_points(query, sheet_id, 100)
-    item_ids = set()
-    count = 0
-    for point in search_result:
-        id = point.payload["id"].split("_")[0]  # Get the first part of the ID
-        if id not in item_ids:
-            item_ids.add(id)
-        count += 1
-        if count >= limit:
-            break
+) -> tuple[Sheet | None, list[dict]]:
+    """Các dòng (đủ cột) của sheet khớp nhất với query theo hybrid search"""
+    row_ids = await query_sheet_row_ids(query, sheet_id, limit)
     async with async_session() as session:
         sheet: Sheet = await sheet_repository.get_sheet_by_id(session, sheet_id)
         if not sheet:
-            return []
-        # Convert string IDs to integers before passing to repository
-        int_item_ids = [int(id) for id in item_ids]
+            return None, []
         items = await sheet_repository.get_rows_with_ids(
-            session, sheet.table_name, int_item_ids
+            session, sheet.table_name, row_ids
         )
-        return [
-            SheetChunkDto(
-                sheet_id=sheet_id,
-                sheet_name=sheet.name,
-                chunk=get_sheet_row_content_all_column(item),
-                id=str(item["id"]),
-            )
-            for item in items
-        ]
+    # Giữ thứ tự theo điểm của hybrid search
+    rank = {row_id: index for index, row_id in enumerate(row_ids)}
+    return sheet, sorted(items, key=lambda item: rank.get(item["id"], len(rank)))
+
+
+async def search_chunks_by_sheet_id(
+    sheet_id: str, query: str, limit: int = 5
+) -> list[SheetChunkDto]:
+    sheet, items = await search_rows_by_sheet_id(sheet_id, query, limit)
+    if not sheet:
+        return []
+    return [
+        SheetChunkDto(
+            sheet_id=sheet_id,
+            sheet_name=sheet.name,
+            chunk=get_sheet_row_content_all_column(item),
+            id=str(item["id"]),
+        )
+        for item in items
+    ]
 
 
 async def test_search_chunks_by_sheet_id(sheet_id: str, query: str, limit: int = 5):
@@ -173,6 +186,93 @@ async def test_search_chunks_by_sheet_id(sheet_id: str, query: str, limit: int =
     return await search_chunks_by_sheet_id(sheet_id, query, limit)
 
 
+def get_hybrid_prefetch(query: str, dense_embedding: list[float], limit: int):
+    sparse_embedding = next(iter(sparse_embedding_model.query_embed(query)))
+    return [
+        get_dense_prefetch(
+            env_config.QDRANT_SHEET_COLLECTION_NAME, dense_embedding, limit
+        ),
+        models.Prefetch(
+            query=models.SparseVector(
+                indices=sparse_embedding.indices.tolist(),
+                values=sparse_embedding.values.tolist(),
+            ),
+            using="bm25",
+            limit=limit,
+        ),
+    ]
+
+
+async def query_sheet_row_ids(query: str, sheet_id: str, limit: int = 5) -> list[int]:
+    """
+    Id của `limit` dòng khác nhau khớp nhất: group-by theo row_id (mỗi dòng lấy
+    chunk điểm cao nhất), không cần tải payload của các chunk.
+    """
+    client = create_qdrant_client()
+    dense_embeddings = await jina.get_embeddings(query)
+    result = await client.query_points_groups(
+        collection_name=env_config.QDRANT_SHEET_COLLECTION_NAME,
+        group_by="row_id",
+        prefetch=get_hybrid_prefetch(
+            query, dense_embeddings[0], limit * PREFETCH_CHUNKS_PER_ROW
+        ),
+        query=models.FusionQuery(fusion=models.Fusion.RRF),
+        query_filter=Filter(
+            must=[FieldCondition(key="sheet_id", match=MatchValue(value=sheet_id))]
+        ),
+        limit=limit,
+        group_size=1,
+        with_payload=False,
+    )
+    return [int(group.id) for group in result.groups]
+
+
+async def backfill_row_ids() -> None:
+    """
+    Background job: thêm payload row_id (dùng để group-by) cho các chunk được
+    index trước khi có field này.
+    """
+    client = create_qdrant_client()
+    collection_name = env_config.QDRANT_SHEET_COLLECTION_NAME
+    missing_row_id = Filter(
+        must=[IsEmptyCondition(is_empty=PayloadField(key="row_id"))]
+    )
+    updated = 0
+    offset = None
+    try:
+        while True:
+            points, offset = await client.scroll(
+                collection_name=collection_name,
+                scroll_filter=missing_row_id,
+                limit=256,
+                offset=offset,
+                with_payload=["id"],
+                with_vectors=False,
+            )
+            if points:
+                await client.batch_update_points(
+                    collection_name=collection_name,
+                    update_operations=[
+                        models.SetPayloadOperation(
+                            set_payload=models.SetPayload(
+                                payload={
+                                    "row_id": get_row_id_of_chunk(point.payload["id"])
+                                },
+                                points=[point.id],
+                            )
+                        )
+                        for point in points
+                    ],
+                )
+                updated += len(points)
+            if offset is None:
+                break
+        if updated:
+            print(f"Backfilled row_id for {updated} sheet chunks")
+    except Exception as e:
+        print(f"Error backfilling row_id of sheet chunks: {e}")
+
+
 async def query_sheet_points(
     query: str, sheet_id: str, limit: int = 5
 ) -> list[ScoredPoint]:
@@ -185,9 +285,8 @@ async def query_sheet_points(
     search_result = await client.query_points(
         collection_name=env_config.QDRANT_SHEET_COLLECTION_NAME,
         prefetch=[
-            models.Prefetch(
-                query=dense_embeddings[0],
-                using="jina",
+            get_dense_prefetch(
+                env_config.QDRANT_SHEET_COLLECTION_NAME, dense_embeddings[0]
             ),
             models.Prefetch(
                 query=models.SparseVector(
@@ -5,12 +5,51 @@ import pandas as pd
 from app.dtos import PaginationDto
 from app.models import Notification
 from app.repositories import notification_repository
+from app.utils import string_utils
 from app.utils.excel_utils import adjust_column_widths_in_worksheet
 from fastapi import HTTPException
 from openpyxl.styles import Alignment
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.attributes import flag_modified
 
+# Version của danh sách notification, tăng sau mỗi lần thêm/sửa/xóa để các tool
+# và agent đã build theo version cũ (synthetic agent) được build lại
+_catalogue_version = 0
+
+
+def get_catalogue_version() -> int:
+    return _catalogue_version
+
+
+def invalidate_catalogue():
+    global _catalogue_version
+    _catalogue_version += 1
+
+
+def _validate_content(content: str | None):
+    """Template của notification phải compile được trước khi lưu"""
+    if not content:
+        return
+    error = string_utils.validate_tool_template(content)
+    if error:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid notification content template: {error}"
+        )
+
+
+def _precompile_content(notification_obj: Notification):
+    if notification_obj.content:
+        string_utils.compile_tool_template(
+            notification_obj.content, notification_obj.id
+        )
+
+
+def _after_commit(notifications: list[Notification]):
+    """Chỉ gọi sau khi commit: agent build lại từ version mới thấy được thay đổi"""
+    invalidate_catalogue()
+    for notification_obj in notifications:
+        _precompile_content(notification_obj)
+
 
 async def get_notifications(db: AsyncSession, page: int, limit: int) -> PaginationDto:
     """
@@ -54,9 +93,13 @@ async def get_notification_by_id(db: AsyncSession, notification_id: str) -> dict
     return notification.to_dict() if notification else None
 
 
-async def insert_notification(db: AsyncSession, notification: dict) -> None:
+async def insert_notification(
+    db: AsyncSession, notification: dict, commit: bool = True
+) -> Notification:
     """
     Insert a new notification into the database.
+    commit=False: caller commits (import nhiều notification trong một transaction)
+    rồi gọi _after_commit.
     """
     try:
         # Validate params if present
@@ -104,6 +147,8 @@ async def insert_notification(db: AsyncSession, notification: dict) -> None:
                     detail=f"Duplicate index values found: {set(duplicates)}",
                 )
 
+        _validate_content(notification.get("content"))
+
         notification_obj = Notification(
             label=notification.get("label"),
             status=notification.get("status"),
@@ -114,6 +159,10 @@ async def insert_notification(db: AsyncSession, notification: dict) -> None:
             created_at=datetime.now(),
         )
         await notification_repository.insert_notification(db, notification_obj)
+        if commit:
+            await db.commit()
+            _after_commit([notification_obj])
+        return notification_obj
     except HTTPException:
         raise
     except Exception as e:
@@ -181,6 +230,8 @@ async def update_notification(
             notification_obj.params = params
             flag_modified(notification_obj, "params")
 
+        _validate_content(notification.get("content"))
+
         notification_obj.label = notification.get("label", notification_obj.label)
         notification_obj.status = notification.get("status", notification_obj.status)
         notification_obj.color = notification.get("color", notification_obj.color)
@@ -190,6 +241,7 @@ async def update_notification(
         notification_obj.content = notification.get("content", notification_obj.content)
 
         await db.commit()
+        _after_commit([notification_obj])
     except HTTPException:
         raise
     except Exception as e:
@@ -203,6 +255,8 @@ async def delete_notification(db: AsyncSession, notification_id: str) -> None:
     try:
         await notification_repository.delete_notification(db, notification_id)
         await db.commit()
+        invalidate_catalogue()
+        string_utils.tool_template_cache.discard(notification_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -218,6 +272,9 @@ async def delete_multiple_notifications(
             db, notification_ids
         )
         await db.commit()
+        invalidate_catalogue()
+        for notification_id in notification_ids:
+            string_utils.tool_template_cache.discard(notification_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -388,6 +445,7 @@ async def upload_notifications_from_excel(
             )
 
         # Iterate through each notification in the data sheet
+        inserted = []
         for idx, row in data_df.iterrows():
             # Get notification ID from the row
             # Find corresponding parameters sheet (n_{id})
@@ -494,8 +552,10 @@ async def upload_notifications_from_excel(
             }
 
             # Insert notification to database
-            await insert_notification(db, notification)
+            inserted.append(await insert_notification(db, notification, commit=False))
 
+        await db.commit()
+        _after_commit(inserted)
         return f"Successfully imported {len(data_df)} notifications"
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
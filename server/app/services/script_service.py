@@ -6,6 +6,7 @@ from app.dtos import PaginationDto
 from app.models import Script
 from app.repositories import script_repository
 from app.utils.excel_utils import adjust_column_widths_in_worksheet
+from app.utils.script_context import script_version
 from fastapi import HTTPException
 from openpyxl.styles import Alignment
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -390,23 +391,36 @@ async def get_script_template() -> BytesIO:
         )
 
 
-async def agent_scripts_to_xml(scripts: list[Script]) -> str:
-    root = ET.Element("scripts")
+def agent_script_to_xml(script: Script) -> str:
+    # id và version để các lượt sau tham chiếu tới script đã gửi (script_context)
+    script_elem = ET.Element(
+        "script",
+        id=script.id,
+        version=script_version(script.description, script.solution),
+    )
+
+    questions_elem = ET.SubElement(script_elem, "questions")
+
+    # Split description by newlines and create question elements
+    question_lines = script.description.split("\n")
+    for question_line in question_lines:
+        question_line = question_line.strip()
+        if question_line:  # Only add non-empty questions
+            question_elem = ET.SubElement(questions_elem, "question")
+            question_elem.text = question_line
 
-    for script in scripts:
-        script_elem = ET.SubElement(root, "script")
+    information = ET.SubElement(script_elem, "information")
+    information.text = script.solution
 
-        questions_elem = ET.SubElement(script_elem, "questions")
+    return ET.tostring(script_elem, encoding="unicode")
 
-        # Split description by newlines and create question elements
-        question_lines = script.description.split("\n")
-        for question_line in question_lines:
-            question_line = question_line.strip()
-            if question_line:  # Only add non-empty questions
-                question_elem = ET.SubElement(questions_elem, "question")
-                question_elem.text = question_line
 
-        information = ET.SubElement(script_elem, "information")
-        information.text = script.solution
+def wrap_scripts_xml(script_xmls: list[str]) -> str:
+    """Ghép các <script> thành <scripts>, giống ET.tostring của cả cây"""
+    if not script_xmls:
+        return "<scripts />"
+    return "<scripts>" + "".join(script_xmls) + "</scripts>"
 
-    return ET.tostring(root, encoding="unicode")
+
+async def agent_scripts_to_xml(scripts: list[Script]) -> str:
+    return wrap_scripts_xml([agent_script_to_xml(script) for script in scripts])
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import math
 import xml.etree.ElementTree as ET
@@ -5,16 +6,110 @@ from datetime import datetime
 from io import BytesIO
 
 import pandas as pd
-from app.configs.database import Base
+from app.configs import env_config
+from app.configs.database import Base, session_scope
 from app.dtos import PaginationDto, PagingDto, SheetColumnConfigDto
 from app.models import Sheet
 from app.repositories import sheet_repository
 from app.utils.excel_utils import adjust_column_widths_in_worksheet
+from app.utils.query_result_cache import QueryResultCache
+from app.utils.sheet_index import TEXT_COLUMN_TYPES, SheetIndex
+from app.utils.versioned_cache import VersionedCache
 from openpyxl.styles import Alignment
 from sqlalchemy import Boolean, Column, DateTime, Integer, Numeric, String, Text, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.attributes import flag_modified
 
+_catalogue_version = 0
+
+
+def get_catalogue_version() -> int:
+    return _catalogue_version
+
+
+def invalidate_catalogue():
+    global _catalogue_version
+    _catalogue_version += 1
+
+
+# Index các sheet đã publish cho tool của agent, build lại khi sheet thay đổi
+SHEET_INDEX_TTL_SECONDS = 60
+_sheet_index_cache: VersionedCache[SheetIndex] = VersionedCache(
+    get_catalogue_version, SHEET_INDEX_TTL_SECONDS
+)
+
+
+async def get_published_sheet_index(db: AsyncSession) -> SheetIndex:
+    async def build() -> SheetIndex:
+        sheets = await sheet_repository.get_all_sheets_by_status(db, "published")
+        return SheetIndex(sheets)
+
+    return await _sheet_index_cache.get(build)
+
+
+# Kết quả SQL của agent trên các bảng sheet, key gồm data version của từng bảng:
+# version tăng khi bảng được tạo (import) hoặc xóa
+agent_query_cache = QueryResultCache(
+    env_config.AGENT_QUERY_CACHE_MAX_BYTES, env_config.AGENT_QUERY_CACHE_TTL_SECONDS
+)
+_table_versions: dict[str, int] = {}
+
+
+def get_table_versions(table_names: list[str]) -> dict[str, int]:
+    return {table: _table_versions.get(table, 0) for table in table_names}
+
+
+def invalidate_table(table_name: str):
+    _table_versions[table_name] = _table_versions.get(table_name, 0) + 1
+    agent_query_cache.invalidate_table(table_name)
+
+
+def get_agent_query_cache_metrics() -> dict:
+    return agent_query_cache.get_metrics()
+
+
+def unaccent_index_sql(table_name: str, column_name: str) -> str:
+    """
+    Index PGroonga trên vi_unaccent(cột) để tìm kiếm không dấu. Tên index dùng
+    hash của tên cột để không vượt quá 63 ký tự (Postgres cắt tên dài, hai cột
+    cùng tiền tố sẽ trùng tên index).
+    """
+    column_hash = hashlib.sha1(column_name.encode()).hexdigest()[:10]
+    return (
+        f'CREATE INDEX IF NOT EXISTS "pgroonga_ua_{table_name}_{column_hash}" '
+        f'ON "{table_name}" USING pgroonga (vi_unaccent("{column_name}"))'
+    )
+
+
+async def ensure_unaccent_indexes():
+    """
+    Background job: tạo index không dấu cho các sheet được import trước khi có
+    index này. Mỗi bảng một transaction, index đã có thì bỏ qua.
+    """
+    try:
+        async with session_scope() as db:
+            sheets = await sheet_repository.get_all_sheets(db)
+            tables = [(sheet.table_name, sheet.column_config or []) for sheet in sheets]
+    except Exception as e:
+        print(f"Error loading sheets for unaccent indexes: {e}")
+        return
+    columns = 0
+    for table_name, column_config in tables:
+        if not table_name:
+            continue
+        try:
+            async with session_scope() as db:
+                for col in column_config:
+                    if col.get("column_type") not in TEXT_COLUMN_TYPES:
+                        continue
+                    await db.execute(
+                        text(unaccent_index_sql(table_name, col["column_name"]))
+                    )
+                    columns += 1
+        except Exception as e:
+            print(f"Error creating unaccent indexes for {table_name}: {e}")
+    print(f"Unaccent indexes ensured for {columns} sheet columns")
+
 
 async def get_sheets(db: AsyncSession, page: int, limit: int) -> PaginationDto:
     """
@@ -264,7 +359,7 @@ async def insert_sheet(db: AsyncSession, sheet: dict) -> str:
 
         # Create PGroonga indexes on all String and Text columns for better text search performance
         for col in columns:
-            if col.column_type in ["String", "Text"]:
+            if col.column_type in TEXT_COLUMN_TYPES:
                 col_index_name = (
                     f"pgroonga_{sanitized_table_name}_{col.column_name}_idx"
                 )
@@ -275,6 +370,9 @@ async def insert_sheet(db: AsyncSession, sheet: dict) -> str:
                 """
                 )
                 await db.execute(col_index_sql)
+                await db.execute(
+                    text(unaccent_index_sql(sanitized_table_name, col.column_name))
+                )
 
         # Insert rows into the dynamically created table
         # Note: id will be automatically assigned by the database
@@ -283,6 +381,8 @@ async def insert_sheet(db: AsyncSession, sheet: dict) -> str:
 
         # Commit the transaction and refresh the new_sheet instance
         await db.commit()
+        invalidate_catalogue()
+        invalidate_table(sanitized_table_name)
         await db.refresh(new_sheet)
 
         return new_sheet.id
@@ -337,6 +437,7 @@ async def update_sheet(db: AsyncSession, sheet_id: str, sheet: dict) -> None:
 
         # Commit the changes
         await db.commit()
+        invalidate_catalogue()
 
         return None
     except Exception as e:
@@ -351,6 +452,7 @@ async def delete_sheet(db: AsyncSession, sheet_id: str) -> None:
     """
     try:
         sheet = await sheet_repository.get_sheet_by_id(db, sheet_id)
+        table_name = None
 
         if sheet:
             # 1. Xóa bảng động - sử dụng table_name
@@ -362,6 +464,9 @@ async def delete_sheet(db: AsyncSession, sheet_id: str) -> None:
         # 2. Xóa bản ghi sheet từ bảng sheets
         await sheet_repository.delete_sheet(db, sheet_id)
         await db.commit()
+        invalidate_catalogue()
+        if table_name:
+            invalidate_table(table_name)
         return None
     except Exception as e:
         await db.rollback()
@@ -370,6 +475,7 @@ async def delete_sheet(db: AsyncSession, sheet_id: str) -> None:
 
 async def delete_multiple_sheets(db: AsyncSession, sheet_ids: list[str]) -> None:
     try:
+        table_names = []
         for sheet_id in sheet_ids:
             # Get the sheet to access its table_name
             sheet = await sheet_repository.get_sheet_by_id(db, sheet_id)
@@ -378,9 +484,13 @@ async def delete_multiple_sheets(db: AsyncSession, sheet_ids: list[str]) -> None
                 drop_table_sql = text(f'DROP TABLE IF EXISTS "{table_name}" CASCADE')
 
                 await db.execute(drop_table_sql)
+                table_names.append(table_name)
 
         await sheet_repository.delete_multiple_sheets(db, sheet_ids)
         await db.commit()
+        invalidate_catalogue()
+        for table_name in table_names:
+            invalidate_table(table_name)
         return None
     except Exception as e:
         await db.rollback()
@@ -526,26 +636,46 @@ async def get_sheet_rows_by_sheet_id(
     return PagingDto(skip=skip, limit=limit, total=count, data=data_list)
 
 
-async def agent_sheets_to_xml(sheets: list[Sheet]) -> str:
-    root = ET.Element("sheets")
-
-    for sheet in sheets:
-        sheet_dict = sheet.to_dict()
-        sheet_elem = ET.SubElement(root, "sheet")
-
-        for key in ["id", "name", "description", "table_name"]:
-            child = ET.SubElement(sheet_elem, key)
-            child.text = str(sheet_dict.get(key, ""))
-
-        columns_elem = ET.SubElement(sheet_elem, "column_config")
-        for col in sheet_dict.get("column_config", []):
-            col_elem = ET.SubElement(columns_elem, "column")
-            for col_key in ["column_name", "column_type", "description"]:
-                col_child = ET.SubElement(col_elem, col_key)
-                val = col.get(col_key, "")
-                if isinstance(val, bool):
-                    col_child.text = str(val).lower()
-                else:
-                    col_child.text = str(val)
+def agent_sheet_to_xml(
+    sheet: Sheet, max_column_description_chars: int | None = None
+) -> str:
+    """
+    <sheet> của một sheet. max_column_description_chars: cắt bớt description của
+    từng cột (agent vẫn xem được bản đầy đủ qua tool get_all_available_sheets)
+    """
+    sheet_dict = sheet.to_dict()
+    sheet_elem = ET.Element("sheet")
+
+    for key in ["id", "name", "description", "table_name"]:
+        child = ET.SubElement(sheet_elem, key)
+        child.text = str(sheet_dict.get(key, ""))
+
+    columns_elem = ET.SubElement(sheet_elem, "column_config")
+    for col in sheet_dict.get("column_config", []):
+        col_elem = ET.SubElement(columns_elem, "column")
+        for col_key in ["column_name", "column_type", "description"]:
+            col_child = ET.SubElement(col_elem, col_key)
+            val = col.get(col_key, "")
+            if isinstance(val, bool):
+                col_child.text = str(val).lower()
+            else:
+                col_child.text = str(val)
+            if (
+                col_key == "description"
+                and max_column_description_chars is not None
+                and len(col_child.text) > max_column_description_chars
+            ):
+                col_child.text = col_child.text[:max_column_description_chars] + "..."
+
+    return ET.tostring(sheet_elem, encoding="unicode")
+
+
+def wrap_sheets_xml(sheet_xmls: list[str]) -> str:
+    """Ghép các <sheet> thành <sheets>, giống ET.tostring của cả cây"""
+    if not sheet_xmls:
+        return "<sheets />"
+    return "<sheets>" + "".join(sheet_xmls) + "</sheets>"
 
-    return ET.tostring(root, encoding="unicode")
+
+async def agent_sheets_to_xml(sheets: list[Sheet]) -> str:
+    return wrap_sheets_xml([agent_sheet_to_xml(sheet) for sheet in sheets])
@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import time
+from datetime import datetime, timedelta
+
+from app.configs import env_config
+from app.configs.database import with_session
+from app.repositories import webhook_event_repository
+from app.utils import asyncio_utils
+from app.utils.bloom_filter import RotatingBloomFilter
+
+EVENT_TTL_SECONDS = 24 * 60 * 60  # Facebook không redeliver webhook quá 1 ngày
+CLEANUP_INTERVAL_SECONDS = 60 * 60
+BLOOM_CAPACITY = 200_000
+BLOOM_ERROR_RATE = 1e-6
+
+# Lớp chặn trùng trong bộ nhớ: key đã thấy trong process hiện tại chỉ cần kiểm
+# tra lại bằng một SELECT (Bloom filter có thể báo nhầm) thay vì INSERT
+_seen_events = RotatingBloomFilter(
+    EVENT_TTL_SECONDS, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE
+)
+_last_cleanup_at = 0.0
+
+
+def verify_signature(payload: bytes, signature_header: str | None) -> bool:
+    """
+    Verify the X-Hub-Signature-256 header of a Messenger webhook request.
+    Verification is skipped when APP_SECRET is not configured.
+
+    Args:
+        payload: Raw request body
+        signature_header: Value of the X-Hub-Signature-256 header
+
+    Returns:
+        bool: True if the signature is valid (or verification is disabled)
+    """
+    if not env_config.APP_SECRET:
+        return True
+    if not signature_header or not signature_header.startswith("sha256="):
+        return False
+    expected = hmac.new(
+        env_config.APP_SECRET.encode("utf-8"), payload, hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len("sha256=") :])
+
+
+def get_event_key(webhook_event: dict) -> tuple[str | None, int | None]:
+    """
+    Build the idempotency key of a webhook event.
+    Messages are keyed by message.mid, delivery/read events by their watermark.
+
+    Returns:
+        tuple: (event_key, watermark), event_key is None if the event has no identity
+    """
+    message = webhook_event.get("message")
+    if message and message.get("mid"):
+        return message["mid"], None
+
+    sender_id = webhook_event.get("sender", {}).get("id")
+    for event_type in ("delivery", "read"):
+        event = webhook_event.get(event_type)
+        if event and event.get("watermark"):
+            watermark = int(event["watermark"])
+            return f"{event_type}:{sender_id}:{watermark}", watermark
+
+    return None, None
+
+
+async def claim_event(webhook_event: dict) -> bool:
+    """
+    Claim a webhook event for processing.
+    A hit in the in-memory Bloom filter (event probably seen by this process)
+    is confirmed against webhook_events before the event is dropped, so a false
+    positive does not lose a message. Otherwise the key is inserted into
+    webhook_events, whose unique index rejects events seen by other workers
+    or before a restart.
+
+    The key is claimed before processing: the webhook is acknowledged with 200
+    before processing starts, so Facebook does not redeliver an event that was
+    in progress when the process died. Processing errors call release_event so
+    that a later redelivery is processed.
+
+    Returns:
+        bool: True if the event is new and should be processed, False if duplicate
+    """
+    event_key, watermark = get_event_key(webhook_event)
+    if not event_key:
+        return True
+    if event_key in _seen_events and await with_session(
+        lambda db: webhook_event_repository.event_exists(db, event_key)
+    ):
+        return False
+
+    sender_id = webhook_event.get("sender", {}).get("id")
+    inserted = await with_session(
+        lambda db: webhook_event_repository.insert_event_if_absent(
+            db, event_key, sender_id, watermark
+        )
+    )
+    _seen_events.add(event_key)
+    _schedule_cleanup()
+    return inserted
+
+
+async def release_event(webhook_event: dict):
+    """Bỏ claim của event xử lý bị lỗi để lần Facebook gửi lại vẫn được xử lý"""
+    event_key, _ = get_event_key(webhook_event)
+    if not event_key:
+        return
+    try:
+        await with_session(
+            lambda db: webhook_event_repository.delete_event(db, event_key)
+        )
+    except Exception as e:
+        print(f"Error releasing webhook event {event_key}: {e}")
+
+
+def _schedule_cleanup():
+    global _last_cleanup_at
+    now = time.monotonic()
+    if now - _last_cleanup_at < CLEANUP_INTERVAL_SECONDS:
+        return
+    _last_cleanup_at = now
+    asyncio_utils.run_background(delete_expired_events)
+
+
+async def delete_expired_events() -> int:
+    """Xóa các webhook event đã quá EVENT_TTL_SECONDS"""
+    try:
+        before = datetime.now() - timedelta(seconds=EVENT_TTL_SECONDS)
+        return await with_session(
+            lambda db: webhook_event_repository.delete_events_before(db, before)
+        )
+    except Exception as e:
+        print(f"Error deleting expired webhook events: {e}")
+        return 0
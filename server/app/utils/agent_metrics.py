@@ -0,0 +1,47 @@
+"""
+Metrics của synthetic agent trong process: số request LLM mỗi lượt (mỗi lần tool
+trả lỗi / không có dữ liệu thường tốn thêm một request) và số lần các fallback
+của execute_query_on_sheet_rows được chạy / tìm thấy dữ liệu / bị lỗi.
+"""
+
+from collections import Counter
+
+
+class AgentMetrics:
+    def __init__(self):
+        self.turns = 0
+        self.llm_requests = 0
+        # số request LLM của một lượt -> số lượt
+        self.requests_per_turn: Counter[int] = Counter()
+        self.fallback_runs: Counter[str] = Counter()
+        self.fallback_hits: Counter[str] = Counter()
+        self.fallback_errors: Counter[str] = Counter()
+
+    def observe_turn(self, requests: int):
+        self.turns += 1
+        self.llm_requests += requests
+        self.requests_per_turn[requests] += 1
+
+    def observe_fallback(self, step: str, found: bool):
+        self.fallback_runs[step] += 1
+        if found:
+            self.fallback_hits[step] += 1
+
+    def observe_fallback_error(self, step: str):
+        self.fallback_errors[step] += 1
+
+    def get_metrics(self) -> dict:
+        return {
+            "turns": self.turns,
+            "llm_requests": self.llm_requests,
+            "llm_requests_per_turn": (
+                self.llm_requests / self.turns if self.turns else 0.0
+            ),
+            "requests_per_turn_histogram": dict(sorted(self.requests_per_turn.items())),
+            "fallback_runs": dict(self.fallback_runs),
+            "fallback_hits": dict(self.fallback_hits),
+            "fallback_errors": dict(self.fallback_errors),
+        }
+
+
+agent_metrics = AgentMetrics()
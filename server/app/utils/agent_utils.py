@@ -1,9 +1,11 @@
 import hashlib
 import json
 import re
-from typing import Any, Literal
+from typing import Any, AsyncIterable, Callable, Literal
 
 import sqlparse
+from app.utils.output_scanner import OutputScanner, SafetyPolicy
+from app.utils.unaccent import unaccent
 from pydantic import BaseModel, Field, TypeAdapter
 from unidecode import unidecode
 
@@ -49,6 +51,97 @@ def is_read_only_sql(sql_text: str) -> bool:
     return True
 
 
+async def collect_capped_rows(
+    rows: AsyncIterable[Any],
+    to_text: Callable[[Any], str],
+    max_rows: int,
+    max_bytes: int,
+) -> tuple[list[str], bool]:
+    """
+    Đọc dần các dòng kết quả (vd. server-side cursor) và chuyển thành text, dừng
+    khi đủ max_rows dòng hoặc tổng số byte vượt max_bytes (dòng đầu tiên luôn
+    được giữ). Trả về các dòng đã đọc và có bị cắt hay không.
+    """
+    texts = []
+    size = 0
+    async for row in rows:
+        if len(texts) >= max_rows:
+            return texts, True
+        row_text = to_text(row)
+        size += len(row_text.encode()) + 1
+        if texts and size > max_bytes:
+            return texts, True
+        texts.append(row_text)
+    return texts, False
+
+
+# Điều kiện full text search của PGroonga: "cột" &@~ '"từ khóa 1" OR "từ khóa 2"'
+PGROONGA_QUERY_PATTERN = re.compile(r"&@~\s*'((?:[^']|'')*)'")
+_PGROONGA_TERM_PATTERN = re.compile(r'"([^"]*)"|([^\s()"]+)')
+_PGROONGA_OPERATORS = {"OR", "AND", "NOT"}
+
+
+def _pgroonga_terms(literal: str) -> list[str]:
+    terms = []
+    for phrase, word in _PGROONGA_TERM_PATTERN.findall(literal.replace("''", "'")):
+        term = (phrase or word).strip()
+        if term and term.upper() not in _PGROONGA_OPERATORS and term[0] != "-":
+            terms.append(term)
+    return terms
+
+
+def pgroonga_keywords(query: str) -> list[str]:
+    """Các từ khóa trong điều kiện &@~ của query (không trùng, theo thứ tự)"""
+    keywords = []
+    for literal in PGROONGA_QUERY_PATTERN.findall(query):
+        for term in _pgroonga_terms(literal):
+            if term not in keywords:
+                keywords.append(term)
+    return keywords
+
+
+def relax_pgroonga_query(query: str) -> str | None:
+    """
+    Nới điều kiện &@~ sang OR: các từ khóa (AND search) được nối bằng OR, một cụm
+    từ duy nhất được tách thành các từ. None nếu query không đổi.
+    """
+
+    def relax(match: re.Match) -> str:
+        terms = _pgroonga_terms(match.group(1))
+        if len(terms) == 1:
+            terms = terms[0].split()
+        terms = list(dict.fromkeys(terms))
+        if len(terms) < 2:
+            return match.group(0)
+        keywords = " OR ".join(f'"{term}"' for term in terms)
+        return "&@~ '" + keywords.replace("'", "''") + "'"
+
+    relaxed = PGROONGA_QUERY_PATTERN.sub(relax, query)
+    return relaxed if relaxed != query else None
+
+
+# "cot" / tb."cot" / cot đứng trước &@~ '...'
+_PGROONGA_PREDICATE_PATTERN = re.compile(
+    r'((?:(?:"[^"]+"|[A-Za-z_]\w*)\.)?(?:"([^"]+)"|([A-Za-z_]\w*)))'
+    r"\s*&@~\s*'((?:[^']|'')*)'"
+)
+
+
+def rewrite_unaccent_predicates(query: str, text_columns) -> str:
+    """
+    Tìm kiếm không dấu: "cot" &@~ 'tàn nhang' -> vi_unaccent("cot") &@~ 'tan nhang'
+    cho các cột text (có index PGroonga trên vi_unaccent), cột khác giữ nguyên.
+    """
+
+    def rewrite(match: re.Match) -> str:
+        column = match.group(2) or match.group(3)
+        if column not in text_columns and column.lower() not in text_columns:
+            return match.group(0)
+        return f"vi_unaccent({match.group(1)}) &@~ '{unaccent(match.group(4))}'"
+
+    return _PGROONGA_PREDICATE_PATTERN.sub(rewrite, query)
+
+
 def normalize_query_quotes(query: str) -> str:
     """
     Normalize SQL query by ensuring table names are properly quoted with double quotes.
@@ -181,6 +274,40 @@ class CurrentTimeResponse(BaseModel):
     )
 
 
+# Thẻ dữ liệu nội bộ (system prompt, sheets, scripts...) không được xuất hiện trong
+# output: nếu có thì output đã bị lộ do prompt injection
+DANGEROUS_XML_TAGS = [
+    # Thẻ dữ liệu system
+    "sheets",
+    "sheet",
+    "scripts",
+    "script",
+    "user",
+    "assistant",
+    "system",
+    "context",
+    "data",
+    "metadata",
+    # Thẻ cấu trúc dữ liệu
+    "columns",
+    "column",
+    "description",
+    "sample_data",
+    "rows",
+    "row",
+]
+XML_TAG_POLICY = SafetyPolicy(
+    "xml_tag",
+    (
+        # Thẻ mở <tag ...>, \s*[^>]* của pattern cũ tương đương [^>]*
+        rf"<(?:{'|'.join(DANGEROUS_XML_TAGS)})[^>]*>",
+        # Thẻ đóng tương ứng
+        rf"</(?:{'|'.join(DANGEROUS_XML_TAGS)})\s*>",
+    ),
+)
+output_scanner = OutputScanner([XML_TAG_POLICY])
+
+
 def contains_xml_tags(output: str) -> bool:
     """
     Kiểm tra xem output có chứa các thẻ XML có thể bị lộ do prompt injection hay không.
@@ -194,48 +321,4 @@ def contains_xml_tags(output: str) -> bool:
     if not output or not isinstance(output, str):
         return False
 
-    # Danh sách các thẻ XML nguy hiểm cần phát hiện
-    dangerous_xml_patterns = [
-        # Thẻ dữ liệu system
-        r"<sheets\s*[^>]*>",
-        r"<sheet\s*[^>]*>",
-        r"<scripts\s*[^>]*>",
-        r"<script\s*[^>]*>",
-        r"<user\s*[^>]*>",
-        r"<assistant\s*[^>]*>",
-        r"<system\s*[^>]*>",
-        r"<context\s*[^>]*>",
-        r"<data\s*[^>]*>",
-        r"<metadata\s*[^>]*>",
-        # Thẻ cấu trúc dữ liệu
-        r"<columns\s*[^>]*>",
-        r"<column\s*[^>]*>",
-        r"<description\s*[^>]*>",
-        r"<sample_data\s*[^>]*>",
-        r"<rows\s*[^>]*>",
-        r"<row\s*[^>]*>",
-        # Thẻ đóng tương ứng
-        r"</sheets\s*>",
-        r"</sheet\s*>",
-        r"</scripts\s*>",
-        r"</script\s*>",
-        r"</user\s*>",
-        r"</assistant\s*>",
-        r"</system\s*>",
-        r"</context\s*>",
-        r"</data\s*>",
-        r"</metadata\s*>",
-        r"</columns\s*>",
-        r"</column\s*>",
-        r"</description\s*>",
-        r"</sample_data\s*>",
-        r"</rows\s*>",
-        r"</row\s*>",
-    ]
-
-    # Kiểm tra từng pattern nguy hiểm
-    for pattern in dangerous_xml_patterns:
-        if re.search(pattern, output, flags=re.IGNORECASE):
-            return True
-
-    return False
+    return output_scanner.contains(output)
@@ -0,0 +1,77 @@
+import hashlib
+import math
+import time
+
+
+class BloomFilter:
+    """
+    Bloom filter đơn giản dùng bytearray và double hashing (blake2b).
+    Không có false negative; tỉ lệ false positive xấp xỉ error_rate khi
+    số phần tử đã thêm không vượt quá capacity.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 1e-6):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class RotatingBloomFilter:
+    """
+    Hai thế hệ Bloom filter xoay vòng để các key tự hết hạn sau khoảng ttl_seconds.
+    Một key được giữ ít nhất ttl_seconds / 2 và nhiều nhất ttl_seconds
+    (hoặc đến khi thế hệ hiện tại đầy).
+    """
+
+    def __init__(
+        self, ttl_seconds: float, capacity: int = 100_000, error_rate: float = 1e-6
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = BloomFilter(capacity, error_rate)
+        self.rotated_at = time.monotonic()
+
+    def _rotate_if_needed(self) -> None:
+        now = time.monotonic()
+        if now - self.rotated_at >= self.ttl_seconds / 2 or self.current.is_full():
+            self.previous = self.current
+            self.current = BloomFilter(self.capacity, self.error_rate)
+            self.rotated_at = now
+
+    def add(self, key: str) -> None:
+        self._rotate_if_needed()
+        self.current.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        self._rotate_if_needed()
+        return key in self.current or key in self.previous
@@ -0,0 +1,204 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from app.utils.history_codec import HistoryCodec
+from app.utils.history_pruner import HistoryPruner
+from app.utils.script_context import extract_script_versions
+from pydantic_ai.messages import ModelMessage
+
+
+@dataclass
+class MemoryTurn:
+    """Một ChatHistory (một lượt hỏi đáp) với content đã được decode"""
+
+    messages: list[ModelMessage]
+    used_scripts: str | None
+    size: int  # số byte của content đã giải nén, dùng để giới hạn dung lượng cache
+    # Script (id -> version) được gửi đầy đủ trong messages của turn
+    script_versions: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_chat_history(
+        cls, chat_history, codec: HistoryCodec, pruner: HistoryPruner | None = None
+    ) -> "MemoryTurn":
+        messages = codec.decode_messages(chat_history.content)
+        if pruner is not None:
+            # Chat history lưu trước khi có pruning vẫn chứa thinking/tool return dài
+            messages = pruner.prune(messages)
+        return cls(
+            messages=messages,
+            used_scripts=chat_history.used_scripts,
+            size=codec.decoded_size(chat_history.content),
+            script_versions=extract_script_versions(messages),
+        )
+
+
+@dataclass
+class ConversationMemory:
+    """
+    Short-term memory của một guest, giống kết quả đọc từ chat_histories:
+    - recent_turns: các turn sau turn có summary gần nhất (cũ -> mới), tối đa
+      window_size turn tính cả turn có summary
+    - summary, summary_turns: summary gần nhất và các turn tính đến turn đó
+    Các ModelMessage được dùng chung giữa các lượt, không được sửa.
+    """
+
+    recent_turns: list[MemoryTurn]
+    summary: str | None
+    summary_turns: list[MemoryTurn]
+    history_count: int
+    window_size: int
+
+    @property
+    def size(self) -> int:
+        return sum(turn.size for turn in self.recent_turns + self.summary_turns)
+
+    @classmethod
+    def from_chat_histories(
+        cls,
+        chat_histories: list,
+        overlap_chat_histories: list,
+        window_size: int,
+        codec: HistoryCodec,
+        pruner: HistoryPruner | None = None,
+    ) -> "ConversationMemory":
+        """
+        chat_histories: các ChatHistory mới nhất đến turn có summary (mới -> cũ),
+        overlap_chat_histories: các ChatHistory tính đến turn có summary (mới -> cũ)
+        """
+        chat_histories = list(chat_histories)
+        history_count = (chat_histories[0].history_count or 0) if chat_histories else 0
+        summary = None
+        if chat_histories and chat_histories[-1].summary:
+            summary = chat_histories.pop().summary
+        return cls(
+            recent_turns=[
+                MemoryTurn.from_chat_history(history, codec, pruner)
+                for history in reversed(chat_histories)
+            ],
+            summary=summary,
+            summary_turns=(
+                [
+                    MemoryTurn.from_chat_history(history, codec, pruner)
+                    for history in reversed(overlap_chat_histories)
+                ]
+                if summary
+                else []
+            ),
+            history_count=history_count,
+            window_size=window_size,
+        )
+
+    @property
+    def turns(self) -> list[MemoryTurn]:
+        """Các turn được replay (cũ -> mới)"""
+        return self.summary_turns + self.recent_turns
+
+    def message_history(self) -> list[ModelMessage]:
+        messages = []
+        for turn in self.turns:
+            messages.extend(turn.messages)
+        return messages
+
+    def used_script_ids(self, limit: int) -> set[str]:
+        """Script đã dùng trong limit turn gần nhất"""
+        script_ids = set()
+        for turn in self.recent_turns[-limit:]:
+            if turn.used_scripts:
+                script_ids.update(turn.used_scripts.split(","))
+        return script_ids
+
+    def append(self, turn: MemoryTurn):
+        """Thêm một turn không có summary, trượt cửa sổ như khi đọc lại từ DB"""
+        self.recent_turns.append(turn)
+        self.history_count += 1
+        if self.summary is not None and len(self.recent_turns) >= self.window_size:
+            # Turn có summary đã ra khỏi cửa sổ window_size turn mới nhất
+            self.summary = None
+            self.summary_turns = []
+        self.recent_turns = self.recent_turns[-self.window_size :]
+
+
+class ConversationMemoryCache:
+    """
+    Cache ConversationMemory theo guest, giới hạn tổng số byte content và loại
+    bỏ guest ít dùng nhất (LRU). Turn mới được append khi lưu (write-through),
+    summary mới thì xóa entry để đọc lại từ DB.
+
+    Một lần đọc từ DB chỉ được put nếu trong lúc đọc không có turn nào được
+    lưu cho guest đó (begin_load/put), để cache không bị thiếu turn.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, ConversationMemory] = OrderedDict()
+        self._loads: dict[str, object] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, guest_id: str) -> ConversationMemory | None:
+        memory = self._entries.get(guest_id)
+        if memory is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(guest_id)
+        self.hits += 1
+        return memory
+
+    def begin_load(self, guest_id: str) -> object:
+        token = object()
+        self._loads[guest_id] = token
+        return token
+
+    def put(self, guest_id: str, memory: ConversationMemory, token: object) -> bool:
+        if self._loads.get(guest_id) is not token:
+            return False
+        del self._loads[guest_id]
+        self._remove(guest_id)
+        self._entries[guest_id] = memory
+        self._bytes += memory.size
+        self._evict()
+        return guest_id in self._entries
+
+    def append(self, guest_id: str, turn: MemoryTurn, history_count: int):
+        """Turn vừa được lưu (không có summary) với history_count của nó"""
+        self._loads.pop(guest_id, None)
+        memory = self._entries.get(guest_id)
+        if memory is None:
+            return
+        if history_count != memory.history_count + 1:
+            # Có turn được lưu mà cache không biết, đọc lại từ DB
+            self.invalidate(guest_id)
+            return
+        self._bytes -= memory.size
+        memory.append(turn)
+        self._bytes += memory.size
+        self._entries.move_to_end(guest_id)
+        self._evict()
+
+    def invalidate(self, guest_id: str):
+        self._loads.pop(guest_id, None)
+        self._remove(guest_id)
+
+    def _remove(self, guest_id: str):
+        memory = self._entries.pop(guest_id, None)
+        if memory is not None:
+            self._bytes -= memory.size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, memory = self._entries.popitem(last=False)
+            self._bytes -= memory.size
+            self.evictions += 1
+
+    def get_metrics(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
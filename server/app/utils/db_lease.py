@@ -0,0 +1,123 @@
+import asyncio
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+# Giới hạn trên (giây) của các bucket trong histogram thời gian giữ connection
+CHECKOUT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30)
+
+
+class ConnectionLeaseError(RuntimeError):
+    """Một task vẫn giữ connection của pool khi gọi ra ngoài (HTTP/LLM)"""
+
+
+class Histogram:
+    """Histogram tích lũy với các bucket cố định"""
+
+    def __init__(self, buckets=CHECKOUT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self) -> dict:
+        labels = [f"le_{bucket}" for bucket in self.buckets] + ["le_inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+
+def _current_task() -> asyncio.Task | None:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+class LeaseTracker:
+    """
+    Theo dõi connection được check out khỏi pool của engine:
+    - Histogram thời gian từ checkout đến checkin, log các lần giữ quá lâu
+    - Số connection mỗi asyncio task đang giữ, để ensure_released() phát hiện
+      connection bị giữ qua một lời gọi HTTP/LLM (chỉ raise khi debug=True)
+    """
+
+    def __init__(self, debug: bool = False, slow_lease_seconds: float = 5):
+        self.debug = debug
+        self.slow_lease_seconds = slow_lease_seconds
+        self.checkout_histogram = Histogram()
+        self.slow_leases = 0
+        self._held: dict[asyncio.Task, int] = {}
+        self._pool = None
+
+    def install(self, engine):
+        """Gắn listener vào pool của một AsyncEngine"""
+        sync_engine = getattr(engine, "sync_engine", engine)
+        self._pool = sync_engine.pool
+        event.listen(sync_engine, "checkout", self._on_checkout)
+        event.listen(sync_engine, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        task = _current_task()
+        connection_record.info["lease_started_at"] = time.perf_counter()
+        connection_record.info["lease_task"] = task
+        if task is not None:
+            self._held[task] = self._held.get(task, 0) + 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        started_at = connection_record.info.pop("lease_started_at", None)
+        task = connection_record.info.pop("lease_task", None)
+        if task is not None and task in self._held:
+            self._held[task] -= 1
+            if self._held[task] <= 0:
+                del self._held[task]
+        if started_at is None:
+            return
+        duration = time.perf_counter() - started_at
+        self.checkout_histogram.observe(duration)
+        if duration >= self.slow_lease_seconds:
+            self.slow_leases += 1
+            task_name = task.get_name() if task is not None else "-"
+            print(f"Slow DB connection lease: {duration:.2f}s (task {task_name})")
+
+    def held_by_current_task(self) -> int:
+        task = _current_task()
+        return self._held.get(task, 0) if task is not None else 0
+
+    def ensure_released(self, operation: str):
+        """
+        Gọi ngay trước một lời gọi ra ngoài (LLM, HTTP, Qdrant...).
+        Ở chế độ debug, raise ConnectionLeaseError nếu task hiện tại vẫn giữ
+        connection, vì connection sẽ bị giữ suốt thời gian chờ.
+        """
+        if not self.debug:
+            return
+        held = self.held_by_current_task()
+        if held:
+            raise ConnectionLeaseError(
+                f"{held} DB connection(s) held across {operation}; "
+                "close or commit the session before awaiting external calls"
+            )
+
+    def get_metrics(self) -> dict:
+        metrics = {
+            "checkout_seconds": self.checkout_histogram.to_dict(),
+            "slow_leases": self.slow_leases,
+            "tasks_holding_connections": len(self._held),
+        }
+        if self._pool is not None and hasattr(self._pool, "checkedout"):
+            metrics["checked_out"] = self._pool.checkedout()
+            metrics["pool_size"] = self._pool.size()
+            metrics["overflow"] = self._pool.overflow()
+        return metrics
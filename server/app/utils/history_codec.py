@@ -0,0 +1,159 @@
+"""
+Định dạng lưu ChatHistory.content / qa_content.
+
+- Legacy (version 0): JSON của pydantic-ai (content) và JSON string (qa_content)
+- Version 1: header + zstd(msgpack), nén với dictionary đã train từ các
+  chat history có sẵn (dict id 0: không dùng dictionary)
+
+Hàm decode đọc được cả hai định dạng.
+"""
+
+import json
+import struct
+from datetime import date, datetime, time
+
+import msgpack
+import zstandard
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter
+
+# 0xc1 không bao giờ đứng đầu một chuỗi JSON/UTF-8 hợp lệ
+FORMAT_MAGIC = b"\xc1H"
+FORMAT_VERSION = 1
+# magic, version, dict id
+HEADER = struct.Struct("<2sBI")
+COMPRESSION_LEVEL = 6
+DICTIONARY_SIZE = 112_640  # 110 KB, kích thước mặc định của zstd --train
+MIN_DICTIONARY_SAMPLES = 100
+
+
+class UnknownDictionaryError(LookupError):
+    """Dữ liệu được nén với một dictionary chưa được nạp vào codec"""
+
+    def __init__(self, dict_id: int):
+        super().__init__(f"Compression dictionary {dict_id} is not loaded")
+        self.dict_id = dict_id
+
+
+def is_compact(data: bytes) -> bool:
+    return data[:2] == FORMAT_MAGIC
+
+
+def dictionary_id(data: bytes) -> int | None:
+    """Dict id trong header, None nếu là định dạng legacy"""
+    if not data or not is_compact(data):
+        return None
+    _, _, dict_id = HEADER.unpack_from(data)
+    return dict_id
+
+
+def _pack_default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f"Cannot pack {type(value).__name__}")
+
+
+def model_messages_payload(messages: list[ModelMessage]) -> bytes:
+    """msgpack của các ModelMessage"""
+    return msgpack.packb(
+        ModelMessagesTypeAdapter.dump_python(messages), default=_pack_default
+    )
+
+
+def messages_payload(messages_json: bytes) -> bytes:
+    """msgpack của các ModelMessage (từ JSON của pydantic-ai)"""
+    return model_messages_payload(ModelMessagesTypeAdapter.validate_json(messages_json))
+
+
+def text_payload(text: str) -> bytes:
+    return msgpack.packb(text)
+
+
+def train_dictionary(samples: list[bytes]) -> zstandard.ZstdCompressionDict | None:
+    """Train dictionary từ các payload msgpack, None nếu chưa đủ mẫu"""
+    if len(samples) < MIN_DICTIONARY_SAMPLES:
+        return None
+    return zstandard.train_dictionary(DICTIONARY_SIZE, samples)
+
+
+class HistoryCodec:
+    """
+    Nén/giải nén chat history. Dictionary mới nhất được add với active=True
+    dùng để nén; các dictionary cũ vẫn được giữ để đọc dữ liệu đã nén trước đó.
+    """
+
+    def __init__(self, level: int = COMPRESSION_LEVEL):
+        self.level = level
+        self.active_dictionary_id = 0
+        self._compressors = {0: zstandard.ZstdCompressor(level=level)}
+        self._decompressors = {0: zstandard.ZstdDecompressor()}
+
+    def add_dictionary(self, dict_id: int, data: bytes, active: bool = True):
+        if dict_id not in self._decompressors:
+            dictionary = zstandard.ZstdCompressionDict(data)
+            self._compressors[dict_id] = zstandard.ZstdCompressor(
+                level=self.level, dict_data=dictionary
+            )
+            self._decompressors[dict_id] = zstandard.ZstdDecompressor(
+                dict_data=dictionary
+            )
+        if active:
+            self.active_dictionary_id = dict_id
+
+    def has_dictionary(self, dict_id: int) -> bool:
+        return dict_id in self._decompressors
+
+    @property
+    def header(self) -> bytes:
+        """Header của dữ liệu được nén với dictionary hiện tại"""
+        return HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, self.active_dictionary_id)
+
+    def compress(self, payload: bytes) -> bytes:
+        compressor = self._compressors[self.active_dictionary_id]
+        return self.header + compressor.compress(payload)
+
+    def decompress(self, data: bytes) -> bytes:
+        _, version, dict_id = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported chat history format version {version}")
+        decompressor = self._decompressors.get(dict_id)
+        if decompressor is None:
+            raise UnknownDictionaryError(dict_id)
+        return decompressor.decompress(data[HEADER.size :])
+
+    def encode_messages(self, messages_json: bytes) -> bytes:
+        return self.compress(messages_payload(messages_json))
+
+    def encode_model_messages(self, messages: list[ModelMessage]) -> bytes:
+        return self.compress(model_messages_payload(messages))
+
+    def decode_messages(self, data: bytes) -> list[ModelMessage]:
+        if not is_compact(data):
+            return ModelMessagesTypeAdapter.validate_json(data)
+        return ModelMessagesTypeAdapter.validate_python(
+            msgpack.unpackb(self.decompress(data))
+        )
+
+    def encode_text(self, text: str) -> bytes:
+        return self.compress(text_payload(text))
+
+    def decode_text(self, data: bytes) -> str:
+        if not is_compact(data):
+            return json.loads(data)
+        return msgpack.unpackb(self.decompress(data))
+
+    def messages_payload_of(self, data: bytes) -> bytes:
+        """Payload msgpack của content ở bất kỳ định dạng nào (để train/nén lại)"""
+        if not is_compact(data):
+            return messages_payload(data)
+        return self.decompress(data)
+
+    def text_payload_of(self, data: bytes) -> bytes:
+        if not is_compact(data):
+            return text_payload(json.loads(data))
+        return self.decompress(data)
+
+    def decoded_size(self, data: bytes) -> int:
+        """Số byte sau khi giải nén (payload msgpack), hoặc của JSON legacy"""
+        if not is_compact(data):
+            return len(data)
+        return zstandard.frame_content_size(data[HEADER.size :])
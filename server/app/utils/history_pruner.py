@@ -0,0 +1,106 @@
+"""
+Rút gọn message history của agent trước khi lưu và khi replay: bỏ ThinkingPart,
+cắt bớt kết quả tool quá dài (vd. kết quả query sheet). ToolCallPart/ToolReturnPart
+luôn được giữ theo cặp (cùng tool_call_id) để history vẫn hợp lệ với model API.
+"""
+
+import json
+from dataclasses import dataclass, replace
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    ThinkingPart,
+    ToolCallPart,
+    ToolReturnPart,
+)
+
+# Ước lượng thô (không cần tokenizer), đủ để so sánh và đặt ngưỡng
+CHARS_PER_TOKEN = 4
+TRUNCATED_NOTE = (
+    "\n[Truncated {lines} more lines ({chars} characters) of this tool result."
+    " Call the tool again if they are needed.]"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def part_text(part) -> str:
+    if isinstance(part, ToolCallPart):
+        return part.tool_name + part.args_as_json_str()
+    content = getattr(part, "content", "")
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False, default=str)
+
+
+def estimate_messages_tokens(messages: list[ModelMessage]) -> int:
+    """Số token ước lượng của các part trong messages"""
+    return sum(
+        estimate_tokens(part_text(part))
+        for message in messages
+        for part in message.parts
+    )
+
+
+@dataclass(frozen=True)
+class HistoryPruner:
+    """
+    drop_thinking: bỏ ThinkingPart (Gemini include_thoughts)
+    max_tool_return_tokens: kết quả tool dài hơn được cắt theo dòng, 0 để giữ nguyên
+    """
+
+    drop_thinking: bool = True
+    max_tool_return_tokens: int = 500
+
+    def prune(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        """Trả về list message mới, không sửa các message đầu vào"""
+        pruned = []
+        for message in messages:
+            if isinstance(message, ModelResponse):
+                message = self._prune_response(message)
+            elif isinstance(message, ModelRequest):
+                message = self._prune_request(message)
+            if message is not None:
+                pruned.append(message)
+        return pruned
+
+    def _prune_response(self, message: ModelResponse) -> ModelResponse | None:
+        if not self.drop_thinking or not any(
+            isinstance(part, ThinkingPart) for part in message.parts
+        ):
+            return message
+        parts = [part for part in message.parts if not isinstance(part, ThinkingPart)]
+        # Response chỉ có thinking: bỏ cả message (model API không nhận parts rỗng)
+        return replace(message, parts=parts) if parts else None
+
+    def _prune_request(self, message: ModelRequest) -> ModelRequest:
+        if not self.max_tool_return_tokens:
+            return message
+        parts = [
+            (
+                self._truncate_tool_return(part)
+                if isinstance(part, ToolReturnPart)
+                else part
+            )
+            for part in message.parts
+        ]
+        if all(new is old for new, old in zip(parts, message.parts)):
+            return message
+        return replace(message, parts=parts)
+
+    def _truncate_tool_return(self, part: ToolReturnPart) -> ToolReturnPart:
+        text = part_text(part)
+        max_chars = self.max_tool_return_tokens * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return part
+        # Cắt ở cuối dòng (một dòng kết quả query sheet) nếu có
+        end = text.rfind("\n", 0, max_chars)
+        if end <= 0:
+            end = max_chars
+        rest = text[end:].lstrip("\n")
+        note = TRUNCATED_NOTE.format(lines=rest.count("\n") + 1, chars=len(rest))
+        return replace(part, content=text[:end] + note)
@@ -6,6 +6,7 @@ from app.dtos import WsMessageDto
 from app.models import Guest
 from app.services.connection_manager import manager
 from app.utils.agent_utils import MessagePart
+from app.utils.messenger_format import markdown_to_messenger
 
 
 async def send_message_to_ws(guest: Guest):
@@ -37,92 +38,22 @@ def get_attachment_type_name(attachment):
         return "Mẫu"
 
 
-def markdown_to_messenger(text):
-    """
-    Chuyển đổi định dạng Markdown sang định dạng Messenger.
-    """
-    # Xử lý headings trước để tránh conflict với bold
-    # ### Heading 3 -> <heading>Heading 3</heading>
-    # ## Heading 2 -> <heading>Heading 2</heading>
-    # # Heading 1 -> <heading>Heading 1</heading>
-    text_after_headings = re.sub(
-        r"^#{1,6}\s+(.*?)$", r"<heading>\1</heading>", text, flags=re.MULTILINE
-    )
-
-    # Thay thế **bold** thành <bold>bold</bold>
-    text_after_bold = re.sub(r"\*\*(.*?)\*\*", r"<bold>\1</bold>", text_after_headings)
-
-    # Thay thế các dấu danh sách (giữ nguyên whitespace trước *)
-    # Chỉ replace * hoặc - ở đầu dòng, không động đến whitespace trước
-    text_after_lists = re.sub(
-        r"^(\s*)[\*\-]\s+(\S.*?)$", r"\1• \2", text_after_bold, flags=re.MULTILINE
-    )
-
-    # Sau khi đã xử lý xong các định dạng khác, chuyển đổi về định dạng Messenger
-    # <heading>text</heading> -> *text* (và merge với bold bên trong nếu có)
-    def replace_heading(match):
-        content = match.group(1)
-        # Nếu content đã có <bold>, tạo ***bold text***
-        if "<bold>" in content and "</bold>" in content:
-            # Convert <bold>text</bold> thành *text* rồi wrap thêm *
-            inner_bold = re.sub(r"<bold>(.*?)</bold>", r"*\1*", content)
-            return f"*{inner_bold}*"
-        return f"*{content}*"
-
-    text_final_heading = re.sub(
-        r"<heading>(.*?)</heading>", replace_heading, text_after_lists
-    )
-
-    # <bold>text</bold> -> *text*
-    text_final_bold = re.sub(r"<bold>(.*?)</bold>", r"*\1*", text_final_heading)
-
-    # Xử lý các định dạng khác
-    final_text = re.sub(r"~~(.*?)~~", r"~\1~", text_final_bold)  # Gạch ngang
-
-    return final_text
-
-    return final_text
-
-
-def messenger_to_markdown(text: str) -> str:
-    """
-    Chuyển đổi định dạng từ Messenger sang Markdown.
-    - Bold: *text* -> **text** (tránh chuyển đổi phép nhân như 5 * 10)
-    - Italic: _text_ -> *text*
-    - List bullet: • -> *
-    """
-
-    def bold_replacer(match):
-        """
-        Hàm thay thế để chuyển đổi bold text một cách thông minh.
-        Tránh chuyển đổi các biểu thức số học sử dụng dấu * cho phép nhân.
-        """
-        content = match.group(1)
-
-        # Nếu nội dung có chữ cái, chắc chắn là text formatting -> chuyển đổi
-        if any(c.isalpha() for c in content):
-            return f"**{content}**"
-
-        # Nếu chỉ có số, ký tự đặc biệt -> có thể là phép nhân -> giữ nguyên
-        return match.group(0)
-
-    # Chuyển đổi *text* thành **text** (bold)
-    # Regex avoids matching * text * (with spaces) to prevent converting multiplication.
-    # It looks for an asterisk, then a non-space/non-asterisk character,
-    # then optionally more non-asterisk characters ending in a non-space/non-asterisk,
-    # and finally a closing asterisk.
-    # Using negative lookarounds to avoid converting **text**
-    bold_pattern = r"(?<!\*)\*([^\s*](?:[^*]*[^\s*])?)\*(?!\*)"
-    text = re.sub(bold_pattern, bold_replacer, text)
-
-    # Chuyển đổi _text_ thành *text* (italic)
-    # Using lookarounds to avoid converting __text__
-    text = re.sub(r"(?<!_)_([^_]+)_(?!_)", r"*\1*", text)
-
-    # Chuyển đổi bullet points • thành *
-    text = re.sub(r"^(\s*)•\s+", r"\1* ", text, flags=re.MULTILINE)
-
-    return text
+def build_message_response(part: MessagePart) -> dict:
+    """Chuyển một MessagePart thành message payload của Send API"""
+    if part.type == "text":
+        return {"text": markdown_to_messenger(part.payload)}
+    if part.type == "link":
+        return {"text": part.payload}
+    return {
+        "attachments": [
+            {
+                "type": part.type,
+                "payload": {
+                    "url": part.payload,
+                },
+            }
+        ]
+    }
 
 
 def parse_and_format_message(message, char_limit=2000) -> List[MessagePart]:
@@ -149,6 +80,8 @@ def parse_and_format_message(message, char_limit=2000) -> List[MessagePart]:
 
     # Luôn kiểm tra xem có separator lines không
     sections = _split_by_markdown_separators_first(message)
+    single_section = None
+    all_media_matches = None
 
     # Nếu không có separator lines (chỉ có 1 section), và message ngắn, xử lý nhanh
     if len(sections) == 1:
@@ -173,29 +106,84 @@ def parse_and_format_message(message, char_limit=2000) -> List[MessagePart]:
         if not section.strip():
             continue
 
-        # Tìm media trong section này
-        section_parts = _process_section_for_media_and_text(section, char_limit)
+        # Tìm media trong section này (dùng lại kết quả ở trên nếu là cùng section)
+        section_parts = _process_section_for_media_and_text(
+            section,
+            char_limit,
+            all_media_matches if section == single_section else None,
+        )
         result.extend(section_parts)
 
     return result
 
 
+MEDIA_EXTENSIONS = {
+    "image": "jpg|jpeg|png|gif|bmp|svg|webp",
+    "video": "mp4|mov|avi|mkv|flv|webm",
+    "audio": "mp3|wav|flac|aac|ogg|m4a|wma",
+    "file": "pdf|doc|docx|xls|xlsx|ppt|pptx|txt|csv|zip|rar|7z",
+}
+
+
+def _build_media_pattern(extensions):
+    # Group 1: markdown media ![alt](url), group 2 (3): markdown link [text](url),
+    # group 4: bare URL
+    url = rf"https?://\S+?\.(?:{extensions})"
+    return re.compile(
+        rf"(!\[.*?\]\({url}(?:\?[^\)]*)?)\)"
+        rf"|(\[.*?\]\(({url}(?:\?[^\)]*)?)\))"
+        rf"|({url}(?:\?[^\s]*)?)"
+    )
+
+
+# Compile một lần khi import thay vì mỗi lần xử lý section. Giữ một pattern cho
+# mỗi loại thay vì gộp thành một regex named group: match của các loại chồng lên
+# nhau (URL lazy \S+? kéo qua URL sau) và _filter_matches chọn trong số đó. Regex
+# gộp quét không chồng lấn nên tìm thêm được match khác, output thay đổi, vd.
+# "https://x.co/p.jpg)https://x.co/s.mp3": audio bị loại vì match audio bắt đầu
+# từ URL ảnh, regex gộp lại tách được s.mp3
+MEDIA_PATTERNS = {
+    media_type: _build_media_pattern(extensions)
+    for media_type, extensions in MEDIA_EXTENSIONS.items()
+}
+# Mọi media match đều chứa "https?://" rồi ít nhất một ký tự không phải khoảng
+# trắng trước ".<đuôi>": quét một lượt các URL để biết loại media nào có mặt,
+# bỏ qua pattern của các loại còn lại (thường là tất cả)
+URL_RUN_PATTERN = re.compile(r"https?://(\S+)")
+MEDIA_EXTENSION_PATTERN = re.compile(
+    r"\.(?:"
+    + "|".join(
+        f"(?P<{media_type}>{extensions})"
+        for media_type, extensions in MEDIA_EXTENSIONS.items()
+    )
+    + ")"
+)
+MARKDOWN_URL_PATTERN = re.compile(r"\((https?://[^)]+)\)")
+BARE_URL_PATTERN = re.compile(r"https?://[^\s)]+")
+
+
+def _find_media_types(message):
+    """Các loại media có thể xuất hiện trong message (theo đuôi của các URL)"""
+    media_types = set()
+    for url_match in URL_RUN_PATTERN.finditer(message):
+        for extension_match in MEDIA_EXTENSION_PATTERN.finditer(
+            message, url_match.start(1) + 1, url_match.end()
+        ):
+            media_types.add(extension_match.lastgroup)
+    return media_types
+
+
 def _find_all_media_matches(message):
     """Tìm tất cả media matches trong message - chỉ tách image, video, audio, file"""
-    media_patterns = {
-        # Image patterns: markdown media syntax ![alt](url), markdown links [text](url), và bare URLs
-        "image": r"(!\[.*?\]\(https?://\S+?\.(?:jpg|jpeg|png|gif|bmp|svg|webp)(?:\?[^\)]*)?)\)|(\[.*?\]\((https?://\S+?\.(?:jpg|jpeg|png|gif|bmp|svg|webp)(?:\?[^\)]*)?)\))|(https?://\S+?\.(?:jpg|jpeg|png|gif|bmp|svg|webp)(?:\?[^\s]*)?)",
-        # Video patterns
-        "video": r"(!\[.*?\]\(https?://\S+?\.(?:mp4|mov|avi|mkv|flv|webm)(?:\?[^\)]*)?)\)|(\[.*?\]\((https?://\S+?\.(?:mp4|mov|avi|mkv|flv|webm)(?:\?[^\)]*)?)\))|(https?://\S+?\.(?:mp4|mov|avi|mkv|flv|webm)(?:\?[^\s]*)?)",
-        # Audio patterns
-        "audio": r"(!\[.*?\]\(https?://\S+?\.(?:mp3|wav|flac|aac|ogg|m4a|wma)(?:\?[^\)]*)?)\)|(\[.*?\]\((https?://\S+?\.(?:mp3|wav|flac|aac|ogg|m4a|wma)(?:\?[^\)]*)?)\))|(https?://\S+?\.(?:mp3|wav|flac|aac|ogg|m4a|wma)(?:\?[^\s]*)?)",
-        # File patterns
-        "file": r"(!\[.*?\]\(https?://\S+?\.(?:pdf|doc|docx|xls|xlsx|ppt|pptx|txt|csv|zip|rar|7z)(?:\?[^\)]*)?)\)|(\[.*?\]\((https?://\S+?\.(?:pdf|doc|docx|xls|xlsx|ppt|pptx|txt|csv|zip|rar|7z)(?:\?[^\)]*)?)\))|(https?://\S+?\.(?:pdf|doc|docx|xls|xlsx|ppt|pptx|txt|csv|zip|rar|7z)(?:\?[^\s]*)?)",
-    }
+    media_types = _find_media_types(message)
+    if not media_types:
+        return []
 
     all_matches = []
-    for media_type, pattern in media_patterns.items():
-        for match in re.finditer(pattern, message):
+    for media_type, pattern in MEDIA_PATTERNS.items():
+        if media_type not in media_types:
+            continue
+        for match in pattern.finditer(message):
             url = _extract_url_from_match(match)
             if url:
                 all_matches.append(
@@ -218,13 +206,13 @@ def _extract_url_from_match(match):
     # Group 1: markdown media ![alt](url) - lấy URL từ trong match
     if match.group(1):
         # Tìm URL trong markdown media
-        media_match = re.search(r"\((https?://[^)]+)\)", match.group(1))
+        media_match = MARKDOWN_URL_PATTERN.search(match.group(1))
         if media_match:
             url = media_match.group(1)
     # Group 2: markdown link [text](url) - lấy URL từ trong match
     elif match.group(2):
         # Tìm URL trong markdown link
-        link_match = re.search(r"\((https?://[^)]+)\)", match.group(2))
+        link_match = MARKDOWN_URL_PATTERN.search(match.group(2))
         if link_match:
             url = link_match.group(1)
     # Group 3: bare URL
@@ -233,7 +221,7 @@ def _extract_url_from_match(match):
 
     if not url:
         # Fallback: cố gắng tìm URL trong toàn bộ match
-        url_match = re.search(r"https?://[^\s)]+", match.group(0))
+        url_match = BARE_URL_PATTERN.search(match.group(0))
         if url_match:
             url = url_match.group(0)
 
@@ -244,11 +232,14 @@ def _extract_url_from_match(match):
     return url
 
 
+MARKDOWN_LINK_PATTERN = re.compile(r"(?<!\!)\[.*?\]\(([^)]+)\)")
+
+
 def _clean_markdown_urls(text):
     """Làm sạch text - chuyển markdown links thành URL thuần túy và xử lý markdown list formatting"""
     # Chuyển markdown links [text](url) thành chỉ url
     # Pattern để match [text](url) nhưng không match ![alt](url) (media)
-    text = re.sub(r"(?<!\!)\[.*?\]\(([^)]+)\)", r"\1", text)
+    text = MARKDOWN_LINK_PATTERN.sub(r"\1", text)
 
     # Xử lý markdown list formatting
     lines = text.split("\n")
@@ -269,34 +260,18 @@ def _filter_matches(all_matches):
     if not all_matches:
         return []
 
-    # Sắp xếp theo vị trí
+    # Sắp xếp theo vị trí (sort ổn định: cùng vị trí thì giữ thứ tự loại media)
     all_matches.sort(key=lambda x: x["start"])
 
+    # Quét một lượt: các match đã nhận có start <= match hiện tại, nên match
+    # overlap (kể cả chạm biên) khi start của nó <= end lớn nhất đã nhận
     filtered_matches = []
-    seen_positions = set()
-
+    max_end = -1
     for match in all_matches:
-        # Sử dụng position để tránh duplicate
-        position_key = f"{match['start']}-{match['end']}"
-
-        if position_key in seen_positions:
+        if match["start"] <= max_end:
             continue
-
-        # Kiểm tra overlap với existing matches
-        should_add = True
-        for existing_match in filtered_matches:
-            # Kiểm tra overlap
-            if (
-                match["start"] <= existing_match["end"]
-                and match["end"] >= existing_match["start"]
-            ):
-                # Có overlap, skip match này
-                should_add = False
-                break
-
-        if should_add:
-            filtered_matches.append(match)
-            seen_positions.add(position_key)
+        filtered_matches.append(match)
+        max_end = max(max_end, match["end"])
 
     return filtered_matches
 
@@ -310,6 +285,12 @@ def _create_media_part(match):
     return MessagePart(type=media_type, payload=payload)
 
 
+EMPTY_PARENS_PATTERN = re.compile(r"\(\s*\)")
+EMPTY_BRACKETS_PATTERN = re.compile(r"\[\s*\]")
+EXTRA_NEWLINES_PATTERN = re.compile(r"\n{3,}")
+SPACES_PATTERN = re.compile(r"[ \t]+")
+
+
 def _clean_remaining_text(text, extracted_matches):
     """Làm sạch text còn lại sau khi loại bỏ media - thay thế markdown links chứa media bằng URL"""
     # Sắp xếp matches theo vị trí từ cuối về đầu để tránh thay đổi index
@@ -347,14 +328,14 @@ def _clean_remaining_text(text, extracted_matches):
     text = _clean_markdown_urls(text)
 
     # Loại bỏ dấu ngoặc rỗng do việc remove URL
-    text = re.sub(r"\(\s*\)", "", text)
-    text = re.sub(r"\[\s*\]", "", text)
+    text = EMPTY_PARENS_PATTERN.sub("", text)
+    text = EMPTY_BRACKETS_PATTERN.sub("", text)
     text = text.replace("()", "")
 
     # Chuẩn hóa whitespace
     # Giảm nhiều newlines thành tối đa 2
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    text = re.sub(r"[ \t]+", " ", text)  # Chuẩn hóa spaces và tabs
+    text = EXTRA_NEWLINES_PATTERN.sub("\n\n", text)
+    text = SPACES_PATTERN.sub(" ", text)  # Chuẩn hóa spaces và tabs
 
     # Loại bỏ spaces ở cuối dòng
     lines = text.split("\n")
@@ -364,6 +345,33 @@ def _clean_remaining_text(text, extracted_matches):
     return text
 
 
+SENTENCE_ENDING_PATTERN = re.compile(r"[.!?:;]")
+# Các ngoại lệ không chia (từ viết tắt, số thập phân, vv)
+SENTENCE_EXCEPTIONS = (
+    "TS.",
+    "GS.",
+    "PGS.",
+    "ThS.",
+    "BS.",
+    "BSCK.",
+    "KS.",
+    "CN.",
+    "Dr.",
+    "Mr.",
+    "Mrs.",
+    "TP.",
+    "T.P",
+    "Q.",
+    "P.",
+    "Tr.",
+    "St.",
+    "Tp.",
+    "tp.",
+    "Khu p.",
+    "khu p.",
+)
+
+
 def _split_into_sentences(text):
     """
     Chia văn bản thành các câu, sử dụng các dấu kết thúc câu chính
@@ -375,72 +383,30 @@ def _split_into_sentences(text):
     Returns:
         Danh sách các câu
     """
-    # Danh sách các dấu kết thúc câu
-    sentence_endings = [".", "!", "?", ":", ";"]
-
-    # Các ngoại lệ không chia (từ viết tắt, số thập phân, vv)
-    exceptions = [
-        "TS.",
-        "GS.",
-        "PGS.",
-        "ThS.",
-        "BS.",
-        "BSCK.",
-        "KS.",
-        "CN.",
-        "Dr.",
-        "Mr.",
-        "Mrs.",
-        "TP.",
-        "T.P",
-        "Q.",
-        "P.",
-        "Tr.",
-        "St.",
-        "Tp.",
-        "tp.",
-        "Khu p.",
-        "khu p.",
-    ]
-
     sentences = []
-    current = ""
-    i = 0
-
-    while i < len(text):
-        current += text[i]
-
-        # Kiểm tra xem ký tự hiện tại có phải là dấu kết thúc câu không
-        if text[i] in sentence_endings:
-            # Kiểm tra xem đây có phải là một ngoại lệ không
-            is_exception = False
-            for ex in exceptions:
-                if current.endswith(ex) and (i + 1 >= len(text) or text[i + 1] == " "):
-                    is_exception = True
-                    break
+    start = 0
+    length = len(text)
+
+    # Chỉ dừng ở các dấu kết thúc câu, cắt câu bằng index thay vì cộng từng ký tự
+    for match in SENTENCE_ENDING_PATTERN.finditer(text):
+        end = match.end()
+        next_char = text[end] if end < length else ""
+
+        # Chỉ kết thúc câu khi sau dấu câu là khoảng trắng, xuống dòng hoặc hết chuỗi
+        # (nên số thập phân như 1.5 không bao giờ bị chia)
+        if next_char not in ("", " ", "\n"):
+            continue
+
+        # Từ viết tắt chỉ là ngoại lệ khi theo sau bởi khoảng trắng hoặc hết chuỗi
+        if next_char != "\n" and text.endswith(SENTENCE_EXCEPTIONS, start, end):
+            continue
 
-            # Kiểm tra xem đây có phải là số thập phân không
-            if (
-                i > 0
-                and i < len(text) - 1
-                and text[i] == "."
-                and text[i - 1].isdigit()
-                and text[i + 1].isdigit()
-            ):
-                is_exception = True
-
-            # Nếu không phải ngoại lệ và sau dấu câu là khoảng trắng hoặc hết chuỗi, kết thúc câu
-            if not is_exception and (
-                i + 1 >= len(text) or text[i + 1] == " " or text[i + 1] == "\n"
-            ):
-                sentences.append(current)
-                current = ""
-
-        i += 1
+        sentences.append(text[start:end])
+        start = end
 
     # Thêm phần còn lại (nếu có)
-    if current:
-        sentences.append(current)
+    if start < length:
+        sentences.append(text[start:])
 
     return sentences
 
@@ -466,26 +432,30 @@ def split_text_into_chunks_messagepart(text, char_limit=2000) -> List[MessagePar
     return parse_and_format_message(text, char_limit)
 
 
-def _split_by_markdown_separators_first(text):
-    """Chia text theo markdown separators trước tiên - chỉ chia theo horizontal rules, không chia theo headers"""
-    markdown_separators = [
-        r"^---+\s*$",  # Horizontal rule: ---
-        r"^\*\*\*+\s*$",  # Horizontal rule: ***
-        r"^___+\s*$",  # Horizontal rule: ___
-        r"^===+\s*$",  # Alternative separator: ===
-        # Bỏ header pattern vì headers là nội dung, không phải separators
-    ]
+MARKDOWN_SEPARATOR_PATTERN = re.compile(
+    "|".join(
+        f"({pattern})"
+        for pattern in [
+            r"^---+\s*$",  # Horizontal rule: ---
+            r"^\*\*\*+\s*$",  # Horizontal rule: ***
+            r"^___+\s*$",  # Horizontal rule: ___
+            r"^===+\s*$",  # Alternative separator: ===
+            # Bỏ header pattern vì headers là nội dung, không phải separators
+        ]
+    ),
+    re.MULTILINE,
+)
 
-    # Combine all separator patterns
-    separator_pattern = "|".join(f"({pattern})" for pattern in markdown_separators)
 
+def _split_by_markdown_separators_first(text):
+    """Chia text theo markdown separators trước tiên - chỉ chia theo horizontal rules, không chia theo headers"""
     lines = text.split("\n")
     sections = []
     current_section = []
 
     for line in lines:
         # Check if line matches any separator (chỉ horizontal rules)
-        if re.match(separator_pattern, line.strip(), re.MULTILINE):
+        if MARKDOWN_SEPARATOR_PATTERN.match(line.strip()):
             # Add current section if it has content
             if current_section:
                 sections.append("\n".join(current_section))
@@ -501,10 +471,11 @@ def _split_by_markdown_separators_first(text):
     return sections
 
 
-def _process_section_for_media_and_text(section, char_limit):
+def _process_section_for_media_and_text(section, char_limit, all_matches=None):
     """Xử lý một section - tách media và clean text"""
     # Tìm media trong section này
-    all_matches = _find_all_media_matches(section)
+    if all_matches is None:
+        all_matches = _find_all_media_matches(section)
 
     # Nếu không có media, chỉ xử lý text
     if not all_matches:
@@ -701,6 +672,12 @@ def _split_paragraph_by_lines(paragraph, char_limit):
     return result
 
 
+OPEN_LINK_END_PATTERN = re.compile(r"\[.*?\]\(\s*$")
+URL_START_PATTERN = re.compile(r"^\s*https?://")
+OPEN_URL_END_PATTERN = re.compile(r"\[.*?\]\(https?://[^\s\)]*$")
+URL_REST_PATTERN = re.compile(r"^[^\s\(]*\)")
+
+
 def _has_incomplete_markdown_link(current_chunk, new_line):
     """
     Kiểm tra markdown link bị chia cắt
@@ -709,13 +686,13 @@ def _has_incomplete_markdown_link(current_chunk, new_line):
         return False
 
     # Pattern 1: [text]( ở cuối chunk, URL ở dòng mới
-    if re.search(r"\[.*?\]\(\s*$", current_chunk.strip()):
-        if re.match(r"^\s*https?://", new_line.strip()):
+    if OPEN_LINK_END_PATTERN.search(current_chunk.strip()):
+        if URL_START_PATTERN.match(new_line.strip()):
             return True
 
     # Pattern 2: URL bị chia giữa 2 dòng
-    if re.search(r"\[.*?\]\(https?://[^\s\)]*$", current_chunk.strip()):
-        if re.match(r"^[^\s\(]*\)", new_line.strip()):
+    if OPEN_URL_END_PATTERN.search(current_chunk.strip()):
+        if URL_REST_PATTERN.match(new_line.strip()):
             return True
 
     # Pattern 3: Link chưa đóng hoàn toàn
@@ -850,3 +827,96 @@ def _process_short_message_with_media(message, all_media_matches, char_limit):
     result.extend(media_parts)
 
     return result
+
+
+def _may_become_separator(partial_line: str) -> bool:
+    """Dòng đang viết dở (đã strip) còn có thể trở thành dòng separator không"""
+    return len(set(partial_line)) == 1 and partial_line[0] in "-*_="
+
+
+class StreamingMessageFormatter:
+    """
+    Phiên bản tăng dần của parse_and_format_message cho output đang được stream.
+
+    feed() nhận từng đoạn text mới và trả về các MessagePart của những section
+    (ngăn cách bởi dòng ---, ***, ___, ===) đã hoàn chỉnh, flush() trả về phần
+    còn lại. Nối tất cả kết quả lại luôn bằng parse_and_format_message(output):
+    section chỉ được trả về khi chắc chắn output có nhiều hơn một section, nếu
+    không flush() xử lý toàn bộ output như bản không stream.
+    """
+
+    def __init__(self, char_limit: int = 2000):
+        self.char_limit = char_limit
+        self._text = ""
+        self._scan_pos = 0  # Đầu dòng chưa được kiểm tra
+        self._section_start = 0
+        self._completed: List[str] = []  # Section đã đóng nhưng chưa trả về
+        self._completed_count = 0
+        self._streaming = False  # Đã chắc chắn output có nhiều section
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def feed(self, delta: str) -> List[MessagePart]:
+        if not delta:
+            return []
+        if not self._text:
+            # Tương đương message.strip() ở đầu output
+            delta = delta.lstrip()
+        self._text += delta
+        self._scan_lines()
+        return self._release()
+
+    def flush(self) -> List[MessagePart]:
+        # Tương đương message.strip() ở cuối output
+        self._text = self._text.rstrip()
+        if not self._streaming:
+            return parse_and_format_message(self._text, self.char_limit)
+
+        self._scan_pos = min(self._scan_pos, len(self._text))
+        self._scan_lines(final=True)
+        if self._section_start < len(self._text):
+            self._completed.append(self._text[self._section_start :])
+        self._section_start = len(self._text)
+        return self._release()
+
+    def _scan_lines(self, final: bool = False):
+        text = self._text
+        while True:
+            line_end = text.find("\n", self._scan_pos)
+            if line_end == -1:
+                if not final or self._scan_pos >= len(text):
+                    break
+                line_end = len(text)
+            line = text[self._scan_pos : line_end]
+            if MARKDOWN_SEPARATOR_PATTERN.match(line.strip()):
+                if self._section_start < self._scan_pos:
+                    # Bỏ ký tự xuống dòng ngay trước dòng separator
+                    self._completed.append(
+                        text[self._section_start : self._scan_pos - 1]
+                    )
+                    self._completed_count += 1
+                self._section_start = line_end + 1
+            self._scan_pos = line_end + 1
+
+        if not self._streaming and self._completed_count:
+            # Có thêm section khi sau separator cuối còn nội dung: một dòng đã hoàn
+            # chỉnh không rỗng, hoặc dòng đang viết dở không thể thành separator
+            partial_line = text[self._scan_pos :].strip()
+            self._streaming = bool(
+                self._completed_count > 1
+                or text[self._section_start : self._scan_pos].strip()
+                or (partial_line and not _may_become_separator(partial_line))
+            )
+
+    def _release(self) -> List[MessagePart]:
+        if not self._streaming:
+            return []
+        result = []
+        for section in self._completed:
+            if not section.strip():
+                continue
+            result.extend(_process_section_for_media_and_text(section, self.char_limit))
+        self._completed = []
+        return result
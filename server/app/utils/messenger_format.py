@@ -0,0 +1,240 @@
+"""
+Chuyển đổi định dạng giữa Markdown (output của agent) và Messenger.
+
+Mỗi hàm quét text một lượt (theo dòng với markdown_to_messenger, theo ký tự
+đánh dấu với messenger_to_markdown) thay vì chạy nhiều re.sub nối tiếp,
+output giữ nguyên như cách xử lý bằng regex trước đây.
+"""
+
+import re
+
+# Ký tự có thể bắt đầu một định dạng, text không có ký tự nào thì giữ nguyên
+MARKDOWN_SYNTAX_CHARS = ("#", "*", "-", "~")
+STAR_PATTERN = re.compile(r"\*")
+UNDERSCORE_PATTERN = re.compile("_")
+BULLET_PATTERN = re.compile("•")
+WHITESPACE_RUN_PATTERN = re.compile(r"\s+")
+
+# Text có sẵn các thẻ trung gian của cách xử lý cũ: dùng lại regex cũ
+LEGACY_TAGS = ("<heading>", "</heading>", "<bold>", "</bold>")
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.*?)$", re.MULTILINE)
+BOLD_PATTERN = re.compile(r"\*\*(.*?)\*\*")
+LIST_PATTERN = re.compile(r"^(\s*)[\*\-]\s+(\S.*?)$", re.MULTILINE)
+HEADING_TAG_PATTERN = re.compile(r"<heading>(.*?)</heading>")
+BOLD_TAG_PATTERN = re.compile(r"<bold>(.*?)</bold>")
+STRIKETHROUGH_PATTERN = re.compile(r"~~(.*?)~~")
+
+
+def _replace_pairs(line: str, delimiter: str, marker: str) -> str:
+    """
+    Thay từng cặp delimiter trong một dòng bằng marker (**a** -> *a*), ghép cặp
+    từ trái sang phải như regex delimiter(.*?)delimiter. Delimiter lẻ cuối
+    cùng được giữ nguyên.
+    """
+    if delimiter not in line:
+        return line
+    parts = line.split(delimiter)
+    if len(parts) % 2:
+        return marker.join(parts)
+    return marker.join(parts[:-1]) + delimiter + parts[-1]
+
+
+def _render_inline(line: str) -> str:
+    """**bold** -> *bold*, ~~gạch ngang~~ -> ~gạch ngang~"""
+    return _replace_pairs(_replace_pairs(line, "**", "*"), "~~", "~")
+
+
+def _find_content_line(lines: list[str], start: int) -> int:
+    """
+    Dòng đầu tiên từ start có ký tự khác khoảng trắng (\\s+ của heading/list
+    được phép vượt qua các dòng trống), len(lines) nếu không có
+    """
+    while start < len(lines) and not lines[start].strip():
+        start += 1
+    return start
+
+
+def _parse_headings(lines: list[str]) -> list[tuple[bool, str]]:
+    """
+    Tách các dòng thành (is_heading, text): heading là dòng bắt đầu bằng 1-6 dấu
+    # và khoảng trắng, nội dung là phần còn lại của dòng (hoặc dòng có chữ tiếp
+    theo nếu phía sau dấu # chỉ có khoảng trắng).
+    """
+    blocks = []
+    i = 0
+    line_count = len(lines)
+    while i < line_count:
+        line = lines[i]
+        if line.startswith("#"):
+            hashes = len(line) - len(line.lstrip("#"))
+            rest = line[hashes:]
+            if hashes <= 6 and (
+                (rest and rest[0].isspace()) or (not rest and i + 1 < line_count)
+            ):
+                content = rest.lstrip()
+                if content:
+                    blocks.append((True, content))
+                    i += 1
+                    continue
+                j = _find_content_line(lines, i + 1)
+                # Không còn chữ nào phía sau: heading rỗng nuốt hết khoảng trắng
+                blocks.append((True, lines[j].lstrip() if j < line_count else ""))
+                i = j + 1
+                continue
+        blocks.append((False, line))
+        i += 1
+    return blocks
+
+
+def markdown_to_messenger(text):
+    """
+    Chuyển đổi định dạng Markdown sang định dạng Messenger.
+    - Heading: # text -> *text*
+    - Bold: **text** -> *text*
+    - List: * item / - item -> • item
+    - Gạch ngang: ~~text~~ -> ~text~
+    """
+    if any(tag in text for tag in LEGACY_TAGS):
+        return _markdown_to_messenger_regex(text)
+    if not any(char in text for char in MARKDOWN_SYNTAX_CHARS):
+        return text
+
+    blocks = _parse_headings(text.split("\n"))
+    block_count = len(blocks)
+    output = []
+    i = 0
+    while i < block_count:
+        is_heading, line = blocks[i]
+        i += 1
+        if is_heading:
+            output.append(f"*{_render_inline(line)}*")
+            continue
+
+        content = line.lstrip()
+        if content[:1] not in ("*", "-"):
+            output.append(_render_inline(line))
+            continue
+        indent = line[: len(line) - len(content)]
+        item = content[1:]
+        item_text = item.lstrip()
+        if item_text and item[0].isspace():
+            output.append(f"{indent}• {_render_inline(item_text)}")
+            continue
+        if item_text or i >= block_count:
+            # -abc, hoặc dấu list ở cuối text
+            output.append(_render_inline(line))
+            continue
+
+        # Dấu list không có nội dung: nội dung là dòng có chữ tiếp theo
+        j = i
+        while j < block_count and not blocks[j][0] and not blocks[j][1].strip():
+            j += 1
+        if j == block_count:
+            output.append(_render_inline(line))
+            continue
+        next_is_heading, next_line = blocks[j]
+        item_text = (
+            f"*{_render_inline(next_line)}*"
+            if next_is_heading
+            else _render_inline(next_line.lstrip())
+        )
+        output.append(f"{indent}• {item_text}")
+        i = j + 1
+
+    return "\n".join(output)
+
+
+def _markdown_to_messenger_regex(text):
+    """Cách chuyển đổi cũ bằng regex, cho text có sẵn thẻ <heading>/<bold>"""
+    # Xử lý headings trước để tránh conflict với bold
+    text_after_headings = HEADING_PATTERN.sub(r"<heading>\1</heading>", text)
+    text_after_bold = BOLD_PATTERN.sub(r"<bold>\1</bold>", text_after_headings)
+    # Chỉ replace * hoặc - ở đầu dòng, giữ nguyên whitespace trước
+    text_after_lists = LIST_PATTERN.sub(r"\1• \2", text_after_bold)
+
+    def replace_heading(match):
+        content = match.group(1)
+        if "<bold>" in content and "</bold>" in content:
+            return "*" + BOLD_TAG_PATTERN.sub(r"*\1*", content) + "*"
+        return f"*{content}*"
+
+    text_final_heading = HEADING_TAG_PATTERN.sub(replace_heading, text_after_lists)
+    text_final_bold = BOLD_TAG_PATTERN.sub(r"*\1*", text_final_heading)
+    return STRIKETHROUGH_PATTERN.sub(r"~\1~", text_final_bold)
+
+
+def messenger_to_markdown(text: str) -> str:
+    """
+    Chuyển đổi định dạng từ Messenger sang Markdown.
+    - Bold: *text* -> **text** (tránh chuyển đổi phép nhân như 5 * 10)
+    - Italic: _text_ -> *text*
+    - List bullet: • -> *
+    """
+    if "*" not in text and "_" not in text and "•" not in text:
+        return text
+    stars = [match.start() for match in STAR_PATTERN.finditer(text)]
+    underscores = [match.start() for match in UNDERSCORE_PATTERN.finditer(text)]
+    bullets = [match.start() for match in BULLET_PATTERN.finditer(text)]
+
+    length = len(text)
+    # (vị trí bắt đầu, vị trí kết thúc, chuỗi thay thế)
+    edits = []
+
+    # *text* -> **text**: dấu * mở phải dính vào chữ phía sau, dấu * đóng dính vào
+    # chữ phía trước, không nằm cạnh dấu * khác (tránh **text**). Chỉ chuyển khi
+    # nội dung có chữ cái, nếu chỉ có số thì có thể là phép nhân
+    i = 0
+    while i < len(stars) - 1:
+        start, end = stars[i], stars[i + 1]
+        if (
+            (start == 0 or text[start - 1] != "*")
+            and not text[start + 1].isspace()
+            and text[start + 1] != "*"
+            and not text[end - 1].isspace()
+            and (end + 1 == length or text[end + 1] != "*")
+        ):
+            if any(c.isalpha() for c in text[start + 1 : end]):
+                edits.append((start, start + 1, "**"))
+                edits.append((end, end + 1, "**"))
+            i += 2
+        else:
+            i += 1
+
+    # _text_ -> *text* (tránh __text__)
+    i = 0
+    while i < len(underscores) - 1:
+        start, end = underscores[i], underscores[i + 1]
+        if (
+            (start == 0 or text[start - 1] != "_")
+            and end > start + 1
+            and (end + 1 == length or text[end + 1] != "_")
+        ):
+            edits.append((start, start + 1, "*"))
+            edits.append((end, end + 1, "*"))
+            i += 2
+        else:
+            i += 1
+
+    # • ở đầu dòng (sau khoảng trắng) và các khoảng trắng phía sau -> "* "
+    previous_end = 0
+    for position in bullets:
+        line_start = text.rfind("\n", 0, position) + 1
+        if line_start < previous_end or (
+            position > line_start and not text[line_start:position].isspace()
+        ):
+            continue
+        whitespace = WHITESPACE_RUN_PATTERN.match(text, position + 1)
+        if not whitespace:
+            continue
+        edits.append((position, whitespace.end(), "* "))
+        previous_end = whitespace.end()
+
+    edits.sort()
+    parts = []
+    last_end = 0
+    for start, end, replacement in edits:
+        parts.append(text[last_end:start])
+        parts.append(replacement)
+        last_end = end
+    parts.append(text[last_end:])
+    return "".join(parts)
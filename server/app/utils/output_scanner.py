@@ -0,0 +1,145 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, List
+
+
+@dataclass(frozen=True)
+class SafetyPolicy:
+    """
+    Một nhóm pattern bị cấm trong output của agent (thẻ XML nội bộ, tên bảng,
+    id của sheet/khách hàng...). patterns là các regex, không được chứa named group.
+    """
+
+    name: str
+    patterns: tuple[str, ...]
+    ignore_case: bool = True
+
+    @classmethod
+    def from_terms(cls, name: str, terms: Iterable[str], ignore_case: bool = True):
+        """Policy cho các chuỗi cố định, chuỗi dài hơn được ưu tiên khi trùng đầu"""
+        unique_terms = sorted({term for term in terms if term}, key=len, reverse=True)
+        if not unique_terms:
+            return cls(name, (), ignore_case)
+        return cls(
+            name,
+            (r"(?:" + "|".join(re.escape(term) for term in unique_terms) + r")",),
+            ignore_case,
+        )
+
+
+@dataclass(frozen=True)
+class ScanMatch:
+    policy: str
+    start: int
+    end: int
+    text: str
+
+
+class OutputScanner:
+    """
+    Quét output một lượt với tất cả policy được compile thành một regex
+    (mỗi policy là một named group), trả về vị trí các đoạn vi phạm.
+    """
+
+    def __init__(self, policies: Iterable[SafetyPolicy], max_match_length: int = 1000):
+        self.policies = [policy for policy in policies if policy.patterns]
+        # Số ký tự cuối được quét lại ở lần feed sau (match dài hơn có thể bị bỏ sót
+        # nếu nó bị cắt giữa hai chunk)
+        self.max_match_length = max_match_length
+        self._group_policies = {}
+        alternatives = []
+        for i, policy in enumerate(self.policies):
+            group = f"p{i}"
+            self._group_policies[group] = policy.name
+            pattern = "|".join(policy.patterns)
+            if policy.ignore_case:
+                alternatives.append(f"(?P<{group}>(?i:{pattern}))")
+            else:
+                alternatives.append(f"(?P<{group}>{pattern})")
+        # Không có policy: pattern không bao giờ match
+        self._pattern = re.compile("|".join(alternatives) or r"(?!)")
+
+    def _iter_matches(self, text: str, pos: int = 0, endpos: int | None = None):
+        if endpos is None:
+            endpos = len(text)
+        for match in self._pattern.finditer(text, pos, endpos):
+            yield ScanMatch(
+                policy=self._group_policies[match.lastgroup],
+                start=match.start(),
+                end=match.end(),
+                text=match.group(0),
+            )
+
+    def scan(self, text: str) -> List[ScanMatch]:
+        if not text:
+            return []
+        return list(self._iter_matches(text))
+
+    def contains(self, text: str) -> bool:
+        return bool(text) and self._pattern.search(text) is not None
+
+    def redact(self, text: str, replacement: str = "", matches=None) -> str:
+        """Thay các đoạn vi phạm bằng replacement thay vì từ chối cả output"""
+        if matches is None:
+            matches = self.scan(text)
+        parts = []
+        last_end = 0
+        for match in sorted(matches, key=lambda m: m.start):
+            if match.start < last_end:
+                continue
+            parts.append(text[last_end : match.start])
+            parts.append(replacement)
+            last_end = match.end
+        parts.append(text[last_end:])
+        return "".join(parts)
+
+    def stream(self) -> "IncrementalScan":
+        return IncrementalScan(self)
+
+
+class IncrementalScan:
+    """
+    Quét output đang được stream: feed() trả về các match mới (vị trí tính trên
+    toàn bộ output). Một match chỉ được chốt khi nằm ngoài max_match_length ký tự
+    cuối (hoặc khi finish()), vì ký tự đến sau có thể làm match dài ra; violated
+    báo vi phạm ngay cả khi match chưa được chốt.
+    """
+
+    def __init__(self, scanner: OutputScanner):
+        self.scanner = scanner
+        self.text = ""
+        self.matches: List[ScanMatch] = []
+        # Match đầu tiên chưa chốt được vị trí kết thúc
+        self.pending_match: ScanMatch | None = None
+        self._scan_pos = 0
+
+    @property
+    def violated(self) -> bool:
+        """Output đã chứa đoạn vi phạm (kể cả match chưa chốt)"""
+        return bool(self.matches) or self.pending_match is not None
+
+    def feed(self, chunk: str) -> List[ScanMatch]:
+        if not chunk:
+            return []
+        self.text += chunk
+        return self._scan(final=False)
+
+    def finish(self) -> List[ScanMatch]:
+        return self._scan(final=True)
+
+    def _scan(self, final: bool) -> List[ScanMatch]:
+        settled_end = len(self.text) - self.scanner.max_match_length
+        new_matches = []
+        self.pending_match = None
+        for match in self.scanner._iter_matches(self.text, self._scan_pos):
+            if match.end > settled_end and not final:
+                self.pending_match = match
+                break
+            new_matches.append(match)
+            self._scan_pos = match.end
+        # Quét lại đoạn cuối ở lần sau để bắt match bị cắt giữa hai chunk
+        self._scan_pos = max(self._scan_pos, settled_end)
+        if self.pending_match is not None:
+            self._scan_pos = min(self._scan_pos, self.pending_match.start)
+        self.matches.extend(new_matches)
+        return new_matches
@@ -0,0 +1,127 @@
+"""
+Ghép các khối của prompt (sheets, summary, history, scripts, instructions) trong
+giới hạn token: mỗi section có budget riêng, khi tổng vượt budget thì cắt các
+section có priority thấp trước.
+"""
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+
+from app.utils.history_pruner import estimate_tokens, part_text
+from pydantic_ai.messages import ModelMessage
+
+
+class TokenEstimator:
+    """
+    Đếm token bằng tokenizer (file tokenizer.json của HuggingFace) nếu được cấu
+    hình, nếu không thì ước lượng theo số ký tự.
+    """
+
+    def __init__(self, tokenizer_path: str | None = None, cache_size: int = 4096):
+        self._tokenizer = None
+        if tokenizer_path:
+            try:
+                from tokenizers import Tokenizer
+
+                self._tokenizer = Tokenizer.from_file(tokenizer_path)
+            except Exception as e:
+                print(f"Error loading tokenizer {tokenizer_path}: {e}")
+        # Sheets/scripts/history lặp lại giữa các lượt, không cần tokenize lại
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    @property
+    def uses_tokenizer(self) -> bool:
+        return self._tokenizer is not None
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is None:
+            return estimate_tokens(text)
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_messages(self, messages: list[ModelMessage]) -> int:
+        return sum(
+            self.count(part_text(part))
+            for message in messages
+            for part in message.parts
+        )
+
+
+@dataclass
+class PromptItem:
+    value: Any
+    tokens: int
+
+
+@dataclass
+class PromptSection:
+    """
+    items: quan trọng nhất trước, bị cắt từ cuối (vd. history mới -> cũ,
+    scripts theo điểm retrieval giảm dần)
+    budget: số token tối đa của section, None nếu không giới hạn
+    priority: khi tổng vượt budget, section có priority thấp bị cắt trước
+    min_items: số item luôn được giữ
+    """
+
+    name: str
+    items: list[PromptItem]
+    budget: int | None = None
+    priority: int = 0
+    min_items: int = 0
+
+
+@dataclass
+class AssembledPrompt:
+    sections: dict[str, list] = field(default_factory=dict)
+    breakdown: dict[str, dict] = field(default_factory=dict)
+    total_tokens: int = 0
+
+    def values(self, name: str) -> list:
+        return self.sections.get(name, [])
+
+
+class PromptAssembler:
+    def __init__(self, total_budget: int):
+        self.total_budget = total_budget
+
+    def assemble(self, sections: list[PromptSection]) -> AssembledPrompt:
+        kept = {section.name: self._fit_budget(section) for section in sections}
+        total = sum(item.tokens for items in kept.values() for item in items)
+
+        # Vượt tổng budget: bỏ dần item cuối của section có priority thấp nhất
+        for section in sorted(sections, key=lambda s: s.priority):
+            items = kept[section.name]
+            while total > self.total_budget and len(items) > section.min_items:
+                total -= items.pop().tokens
+            if total <= self.total_budget:
+                break
+
+        prompt = AssembledPrompt(total_tokens=total)
+        for section in sections:
+            items = kept[section.name]
+            dropped = section.items[len(items) :]
+            prompt.sections[section.name] = [item.value for item in items]
+            prompt.breakdown[section.name] = {
+                "tokens": sum(item.tokens for item in items),
+                "items": len(items),
+                "dropped_items": len(dropped),
+                "dropped_tokens": sum(item.tokens for item in dropped),
+            }
+        return prompt
+
+    @staticmethod
+    def _fit_budget(section: PromptSection) -> list[PromptItem]:
+        items = []
+        tokens = 0
+        for item in section.items:
+            if (
+                section.budget is not None
+                and tokens + item.tokens > section.budget
+                and len(items) >= section.min_items
+            ):
+                break
+            items.append(item)
+            tokens += item.tokens
+        return items
@@ -0,0 +1,110 @@
+"""
+Cache kết quả SQL do agent sinh ra (execute_query_on_sheet_rows). Key là câu SQL
+đã chuẩn hóa cùng data version của từng bảng sheet được query: sheet bị xóa /
+import lại thì version đổi nên entry cũ không còn được dùng (và được xóa khi
+invalidate_table). Giới hạn tổng số byte kết quả, loại bỏ entry ít dùng nhất.
+"""
+
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import sqlparse
+
+# Query phụ thuộc thời điểm chạy thì không cache
+_VOLATILE_SQL = re.compile(
+    r"\b(now|random|clock_timestamp|timeofday|gen_random_uuid|nextval)\s*\(|"
+    r"\b(current_date|current_time|current_timestamp|localtime|localtimestamp)\b",
+    re.IGNORECASE,
+)
+
+
+def canonicalize_sql(query: str) -> str:
+    """Bỏ comment, gộp khoảng trắng và viết hoa keyword"""
+    formatted = sqlparse.format(
+        query, strip_comments=True, keyword_case="upper", strip_whitespace=True
+    )
+    return " ".join(formatted.split()).rstrip(";").strip()
+
+
+def is_cacheable_sql(query: str) -> bool:
+    return not _VOLATILE_SQL.search(query)
+
+
+def referenced_tables(query: str, table_names) -> list[str]:
+    """Các bảng sheet (trong table_names) xuất hiện trong query"""
+    return sorted(table for table in table_names if table in query)
+
+
+@dataclass
+class _Entry:
+    value: Any
+    tables: tuple[str, ...]
+    size: int
+    expires_at: float
+
+
+class QueryResultCache:
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query: str, table_versions: dict[str, int]) -> tuple:
+        return (canonicalize_sql(query), tuple(sorted(table_versions.items())))
+
+    def get(self, key: tuple) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, key: tuple, value: Any, size: int | None = None):
+        """size mặc định là số byte của value (str)"""
+        if size is None:
+            size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        tables = tuple(table for table, _ in key[1])
+        self._entries[key] = _Entry(
+            value, tables, size, time.monotonic() + self.ttl_seconds
+        )
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def invalidate_table(self, table_name: str):
+        for key in [k for k, e in self._entries.items() if table_name in e.tables]:
+            self._remove(key)
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def get_metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,138 @@
+"""
+Định dạng kết quả query (các dòng của sheet) trả về cho model:
+- xml: <row><cot>giá trị</cot>...</row>, lặp tên cột ở mỗi dòng (định dạng cũ)
+- tsv: dòng header chứa tên cột, mỗi dòng sau là các giá trị cách nhau bởi tab
+- json: dòng đầu là mảng tên cột, mỗi dòng sau là mảng giá trị
+Mỗi dòng kết quả nằm trên một dòng text (để cắt theo dòng khi cần) và các ô text
+dài được cắt bằng limit_text_words.
+
+leak_policy: pattern phát hiện output của agent chép lại kết quả query (dòng header
+và dòng có đúng số cột của kết quả). Định dạng xml đã được XML_TAG_POLICY bắt qua
+thẻ <row>.
+"""
+
+import json
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Mapping
+from xml.sax.saxutils import escape
+
+from app.utils.agent_utils import limit_text_words
+from app.utils.output_scanner import SafetyPolicy
+
+DEFAULT_MAX_CELL_CHARS = 500
+
+
+class ResultEncoder(ABC):
+    name = ""
+
+    def __init__(self, max_cell_chars: int | None = DEFAULT_MAX_CELL_CHARS):
+        self.max_cell_chars = max_cell_chars
+
+    def cell(self, value: Any) -> str:
+        text = "" if value is None else str(value)
+        if self.max_cell_chars:
+            text = limit_text_words(text, self.max_cell_chars)
+        return text
+
+    def header(self, columns: list[str]) -> str | None:
+        """Dòng header (tên cột) đứng trước các dòng, None nếu không có"""
+        return None
+
+    @abstractmethod
+    def row(self, row: Mapping[str, Any]) -> str:
+        """Một dòng kết quả, không chứa ký tự xuống dòng"""
+
+    def leak_patterns(self, columns: list[str]) -> tuple[str, ...]:
+        """Pattern của dòng header và các dòng của một kết quả có các cột columns"""
+        return ()
+
+    def leak_policy(self, results_columns: list[list[str]]) -> SafetyPolicy:
+        patterns = []
+        for columns in results_columns:
+            for pattern in self.leak_patterns(columns):
+                if pattern not in patterns:
+                    patterns.append(pattern)
+        return SafetyPolicy("result_row", tuple(patterns))
+
+    def encode(self, rows: list[Mapping[str, Any]]) -> str:
+        if not rows:
+            return ""
+        lines = [self.row(row) for row in rows]
+        header = self.header(list(rows[0].keys()))
+        if header is not None:
+            lines.insert(0, header)
+        return "\n".join(lines)
+
+
+class XmlResultEncoder(ResultEncoder):
+    name = "xml"
+
+    def row(self, row: Mapping[str, Any]) -> str:
+        # Giống ET.tostring của rows_to_xml trước đây nhưng không tạo Element
+        cells = "".join(
+            f"<{key}>{escape(self.cell(value))}</{key}>" for key, value in row.items()
+        )
+        return f"<row>{cells}</row>"
+
+
+class TsvResultEncoder(ResultEncoder):
+    name = "tsv"
+
+    def cell(self, value: Any) -> str:
+        text = super().cell(value)
+        return text.replace("\t", " ").replace("\r", "").replace("\n", "\\n")
+
+    def header(self, columns: list[str]) -> str:
+        return "\t".join(self.cell(column) for column in columns)
+
+    def row(self, row: Mapping[str, Any]) -> str:
+        return "\t".join(self.cell(value) for value in row.values())
+
+    def leak_patterns(self, columns: list[str]) -> tuple[str, ...]:
+        patterns = [rf"(?m:^{re.escape(self.header(columns))}$)"]
+        # Kết quả một cột không có tab: chỉ nhận ra được qua dòng header
+        if len(columns) > 1:
+            patterns.append(rf"(?m:^[^\t\n]*(?:\t[^\t\n]*){{{len(columns) - 1}}}$)")
+        return tuple(patterns)
+
+
+class JsonResultEncoder(ResultEncoder):
+    name = "json"
+
+    def json_value(self, value: Any) -> Any:
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        return self.cell(value)
+
+    def _dumps(self, values: list) -> str:
+        return json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+
+    def header(self, columns: list[str]) -> str:
+        return self._dumps([str(column) for column in columns])
+
+    def row(self, row: Mapping[str, Any]) -> str:
+        return self._dumps([self.json_value(value) for value in row.values()])
+
+    def leak_patterns(self, columns: list[str]) -> tuple[str, ...]:
+        cell = r'(?:"(?:[^"\\\n]|\\.)*"|null|true|false|-?\d[\d.eE+-]*)'
+        return (
+            rf"(?m:^{re.escape(self.header(columns))}$)",
+            rf"(?m:^\[{cell}(?:,{cell}){{{len(columns) - 1}}}\]$)",
+        )
+
+
+RESULT_ENCODERS = {
+    encoder.name: encoder
+    for encoder in (XmlResultEncoder, TsvResultEncoder, JsonResultEncoder)
+}
+
+
+def get_result_encoder(
+    name: str, max_cell_chars: int | None = DEFAULT_MAX_CELL_CHARS
+) -> ResultEncoder:
+    encoder_class = RESULT_ENCODERS.get((name or "").lower())
+    if encoder_class is None:
+        print(f"Error unknown result format {name}, using xml")
+        encoder_class = XmlResultEncoder
+    return encoder_class(max_cell_chars)
@@ -0,0 +1,95 @@
+"""
+Script context gửi cho agent theo kiểu delta: script đã có trong history được
+replay (cùng version) chỉ được gửi dưới dạng tham chiếu <script_ref>, script
+mới hoặc đã sửa được gửi đầy đủ và lưu cùng turn đó để các lượt sau dùng lại.
+
+Script đã gửi được xác định bằng cách đọc chính các message trong history (thẻ
+<script id=".." version="..">), nên khi turn chứa script trượt khỏi cửa sổ
+history (hoặc bị cắt vì budget) thì script sẽ được gửi đầy đủ lại.
+"""
+
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart
+
+SCRIPT_CONTEXT_PREFIX = (
+    "Related scripts in XML format. Important information needs to be reranked"
+    " and filtered to answer the customer."
+)
+SCRIPT_REFERENCES_PREFIX = (
+    "These scripts were already provided earlier in this conversation (same id)"
+    " and are still relevant:"
+)
+SCRIPT_TAG_PATTERN = re.compile(r'<script id="([^"]+)" version="([^"]+)">')
+
+
+def script_version(description: str | None, solution: str | None) -> str:
+    """Version theo nội dung: đổi khi description/solution được sửa"""
+    content = f"{description or ''}\0{solution or ''}"
+    return hashlib.sha1(content.encode()).hexdigest()[:12]
+
+
+def script_reference_xml(script_id: str) -> str:
+    return f'<script_ref id="{script_id}" />'
+
+
+def extract_script_versions(messages: Iterable[ModelMessage]) -> dict[str, str]:
+    """Script (id -> version) được gửi đầy đủ trong các message"""
+    versions = {}
+    for message in messages:
+        if not isinstance(message, ModelResponse):
+            continue
+        for part in message.parts:
+            if isinstance(part, TextPart) and part.content.startswith(
+                SCRIPT_CONTEXT_PREFIX
+            ):
+                versions.update(SCRIPT_TAG_PATTERN.findall(part.content))
+    return versions
+
+
+@dataclass
+class ScriptEntry:
+    """Một script trong context: xml là bản đầy đủ hoặc tham chiếu"""
+
+    script: Any
+    score: float | None
+    version: str
+    xml: str
+    is_reference: bool
+
+
+def build_script_entries(
+    scored_scripts: list[tuple[Any, float | None]],
+    seen_versions: dict[str, str],
+    to_xml,
+) -> list[ScriptEntry]:
+    entries = []
+    for script, score in scored_scripts:
+        version = script_version(script.description, script.solution)
+        if seen_versions.get(script.id) == version:
+            xml, is_reference = script_reference_xml(script.id), True
+        else:
+            xml, is_reference = to_xml(script), False
+        entries.append(ScriptEntry(script, score, version, xml, is_reference))
+    return entries
+
+
+def seen_script_versions(turns) -> dict[str, str]:
+    """Script đã được gửi trong các turn (cũ -> mới), version mới nhất được giữ"""
+    versions = {}
+    for turn in turns:
+        versions.update(turn.script_versions)
+    return versions
+
+
+def missing_references(
+    entries: Iterable[ScriptEntry], seen_versions: dict[str, str]
+) -> bool:
+    """Có tham chiếu nào tới script không còn trong seen_versions"""
+    return any(
+        entry.is_reference and seen_versions.get(entry.script.id) != entry.version
+        for entry in entries
+    )
@@ -0,0 +1,114 @@
+"""
+Index tên của các sheet đã publish (id, table_name, name) để tool của agent map
+sheet_id / tên bảng model sinh ra về đúng sheet mà không cần đọc lại DB hay
+quét fuzzy toàn bộ danh sách ở mỗi lần gọi.
+
+Tên được chuẩn hóa (lowercase, "-", "_", khoảng trắng coi như nhau) nên các biến
+thể model hay sinh ra (uuid với "_", table_name với "-") được map trực tiếp. Các
+tên còn lại được so khớp fuzzy (thefuzz, cùng thang điểm như trước) trên một số
+ít ứng viên lấy từ index n-gram.
+"""
+
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from thefuzz import process
+
+NGRAM_SIZE = 3
+MAX_FUZZY_CANDIDATES = 8
+# Kiểu cột được tạo index PGroonga (tìm kiếm &@~)
+TEXT_COLUMN_TYPES = ("String", "Text")
+
+_SEPARATORS = re.compile(r"[\s\-_]+")
+
+
+def normalize_sheet_key(value: str) -> str:
+    return _SEPARATORS.sub("_", value.strip().lower())
+
+
+def _ngrams(key: str) -> set[str]:
+    padded = f" {key} "
+    if len(padded) <= NGRAM_SIZE:
+        return {padded}
+    return {padded[i : i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+@dataclass(frozen=True)
+class SheetIdentity:
+    id: str
+    table_name: str
+    name: str
+    text_columns: frozenset[str] = frozenset()
+
+
+def _text_columns(column_config) -> frozenset[str]:
+    return frozenset(
+        col["column_name"]
+        for col in column_config or []
+        if col.get("column_type") in TEXT_COLUMN_TYPES
+    )
+
+
+@dataclass(frozen=True)
+class SheetMatch:
+    sheet: SheetIdentity | None
+    # Tên (id/table_name/name) khớp nhất và điểm (0-100), 100 nếu khớp sau chuẩn hóa
+    matched: str | None
+    score: int
+
+
+class SheetIndex:
+    def __init__(self, sheets):
+        self.sheets = [
+            SheetIdentity(
+                sheet.id,
+                sheet.table_name,
+                sheet.name or "",
+                _text_columns(getattr(sheet, "column_config", None)),
+            )
+            for sheet in sheets
+        ]
+        self._keys: dict[str, tuple[SheetIdentity, str]] = {}
+        self._ngram_keys: dict[str, set[str]] = defaultdict(set)
+        for sheet in self.sheets:
+            for value in (sheet.id, sheet.table_name, sheet.name):
+                if not value:
+                    continue
+                key = normalize_sheet_key(value)
+                # id/table_name được thêm trước nên không bị name trùng ghi đè
+                if key in self._keys:
+                    continue
+                self._keys[key] = (sheet, value)
+                for ngram in _ngrams(key):
+                    self._ngram_keys[ngram].add(key)
+
+    def __len__(self) -> int:
+        return len(self.sheets)
+
+    @property
+    def table_names(self) -> set[str]:
+        return {sheet.table_name for sheet in self.sheets}
+
+    def resolve(self, value: str) -> SheetMatch:
+        """Sheet có id/table_name/name khớp nhất với value"""
+        key = normalize_sheet_key(value)
+        if key in self._keys:
+            sheet, matched = self._keys[key]
+            return SheetMatch(sheet, matched, 100)
+        if not self._keys:
+            return SheetMatch(None, None, 0)
+
+        counts = Counter(
+            candidate
+            for ngram in _ngrams(key)
+            for candidate in self._ngram_keys.get(ngram, ())
+        )
+        candidates = [
+            candidate for candidate, _ in counts.most_common(MAX_FUZZY_CANDIDATES)
+        ]
+        best = process.extractOne(key, candidates or list(self._keys))
+        if best is None:
+            return SheetMatch(None, None, 0)
+        sheet, matched = self._keys[best[0]]
+        return SheetMatch(sheet, matched, best[1])
@@ -1,6 +1,80 @@
-from jinja2 import Template
+import hashlib
+from collections import OrderedDict
+
+from jinja2 import Template, TemplateSyntaxError
+from jinja2.sandbox import SandboxedEnvironment
+
+TOOL_TEMPLATE_CACHE_SIZE = 256
+
+# Template do operator nhập (notification content), render trong sandbox
+_template_env = SandboxedEnvironment()
+
+
+def _template_digest(template_str: str) -> str:
+    return hashlib.sha1(template_str.encode()).hexdigest()
+
+
+class ToolTemplateCache:
+    """
+    Cache template đã compile theo key (notification id) và hash của content:
+    content được sửa thì compile lại. Giới hạn max_size template (LRU).
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._templates: OrderedDict[str, tuple[str, Template]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template_str: str, key: str | None = None) -> Template:
+        digest = _template_digest(template_str)
+        key = key or digest
+        entry = self._templates.get(key)
+        if entry is not None and entry[0] == digest:
+            self._templates.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        template = _template_env.from_string(template_str)
+        self._templates[key] = (digest, template)
+        self._templates.move_to_end(key)
+        while len(self._templates) > self.max_size:
+            self._templates.popitem(last=False)
+        return template
+
+    def discard(self, key: str):
+        self._templates.pop(key, None)
+
+    def get_metrics(self) -> dict:
+        return {
+            "entries": len(self._templates),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+tool_template_cache = ToolTemplateCache(TOOL_TEMPLATE_CACHE_SIZE)
+
+
+def validate_tool_template(template_str: str) -> str | None:
+    """Lỗi cú pháp của template, None nếu hợp lệ"""
+    try:
+        _template_env.parse(template_str)
+    except TemplateSyntaxError as e:
+        return f"line {e.lineno}: {e.message}"
+    return None
+
+
+def compile_tool_template(template_str: str, key: str | None = None) -> Template:
+    return tool_template_cache.get(template_str, key)
 
 
 def render_tool_template(template_str: str, **kwargs) -> str:
-    template = Template(template_str)
-    return template.render(**kwargs)
+    return compile_tool_template(template_str).render(**kwargs)
+
+
+def render_notification_template(
+    notification_id: str, template_str: str, params: dict
+) -> str:
+    return compile_tool_template(template_str, notification_id).render(**params)
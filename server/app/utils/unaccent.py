@@ -0,0 +1,39 @@
+"""
+Bỏ dấu tiếng Việt ("tàn nhang" -> "tan nhang"), dùng chung cho hàm SQL
+vi_unaccent (index PGroonga trên các cột text của sheet) và cho từ khóa trong
+query của agent, để hai bên luôn được chuẩn hóa giống nhau.
+"""
+
+_LOWER_ACCENTED = (
+    "àáạảãâầấậẩẫăằắặẳẵ"
+    "èéẹẻẽêềếệểễ"
+    "ìíịỉĩ"
+    "òóọỏõôồốộổỗơờớợởỡ"
+    "ùúụủũưừứựửữ"
+    "ỳýỵỷỹ"
+    "đ"
+)
+_LOWER_PLAIN = "a" * 17 + "e" * 11 + "i" * 5 + "o" * 17 + "u" * 11 + "y" * 5 + "d"
+# Dấu dạng tổ hợp (NFD): huyền, sắc, ngã, hỏi, nặng, mũ, trăng, móc
+_COMBINING_MARKS = "̛̣̀́̃̉̂̆"
+
+ACCENTED_CHARS = _LOWER_ACCENTED + _LOWER_ACCENTED.upper()
+PLAIN_CHARS = _LOWER_PLAIN + _LOWER_PLAIN.upper()
+
+_TRANSLATION = str.maketrans(ACCENTED_CHARS, PLAIN_CHARS, _COMBINING_MARKS)
+
+# translate() của Postgres xóa các ký tự trong from không có ký tự tương ứng
+# trong to (các dấu tổ hợp)
+VI_UNACCENT_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION vi_unaccent(value text) RETURNS text
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+AS $$ SELECT translate(value, '{ACCENTED_CHARS}{_COMBINING_MARKS}', '{PLAIN_CHARS}') $$;
+"""
+
+
+def unaccent(text: str) -> str:
+    return text.translate(_TRANSLATION)
+
+
+def has_accents(text: str) -> bool:
+    return unaccent(text) != text
@@ -0,0 +1,51 @@
+"""
+Một giá trị build từ DB (index sheet, agent + tools...) được dùng lại giữa các
+lượt, build lại khi catalogue version đổi. TTL để nhận thay đổi từ process khác
+(version chỉ tăng trong process hiện tại).
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class VersionedCache(Generic[T]):
+    def __init__(self, get_version: Callable[[], int], ttl_seconds: float):
+        self.get_version = get_version
+        self.ttl_seconds = ttl_seconds
+        self._value: T | None = None
+        self._version: int | None = None
+        self._built_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self, version: int) -> bool:
+        return (
+            self._value is not None
+            and self._version == version
+            and time.monotonic() - self._built_at < self.ttl_seconds
+        )
+
+    def clear(self):
+        self._value = None
+        self._version = None
+
+    async def get(self, build: Callable[[], Awaitable[T]]) -> T:
+        version = self.get_version()
+        if self._is_fresh(version):
+            return self._value
+        # Chỉ một lượt build, các lượt khác chờ và dùng kết quả
+        async with self._lock:
+            version = self.get_version()
+            if self._is_fresh(version):
+                return self._value
+            built_at = time.monotonic()
+            value = await build()
+            # Version đổi trong lúc build: dùng giá trị này cho lượt hiện tại
+            # nhưng không cache, lượt sau build lại
+            if self.get_version() == version:
+                self._value = value
+                self._version = version
+                self._built_at = built_at
+            return value
@@ -0,0 +1,86 @@
+"""
+Benchmark HistoryPruner trên một cuộc hội thoại 50 turn (mỗi turn có thinking,
+tool call và kết quả rows_to_xml). Số token prompt (ước lượng) của history
+được replay ở mỗi turn, có và không rút gọn, được ghi vào extra_info.
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.utils.history_pruner import HistoryPruner, estimate_messages_tokens
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ThinkingPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+TURNS = 50
+WINDOW = 10  # SHORT_TERM_MEMORY_LIMIT: số turn được replay
+ROWS = 60
+
+
+def _turn(i: int):
+    rows_xml = "\n".join(
+        f"<row><ten>Liệu trình {i}-{r}</ten><gia>{r * 50000}</gia>"
+        f"<mo_ta>Chăm sóc da chuyên sâu, thư giãn 60 phút</mo_ta></row>"
+        for r in range(ROWS)
+    )
+    return [
+        ModelRequest(parts=[UserPromptPart(content=f"Cho em hỏi giá liệu trình {i}")]),
+        ModelResponse(
+            parts=[
+                ThinkingPart(content="Khách hỏi giá, cần query sheet bảng giá. " * 40),
+                ToolCallPart(
+                    tool_name="execute_query_on_sheet_rows",
+                    args={"query": f"SELECT * FROM bang_gia WHERE id = {i}"},
+                    tool_call_id=f"call-{i}",
+                ),
+            ]
+        ),
+        ModelRequest(
+            parts=[
+                ToolReturnPart(
+                    tool_name="execute_query_on_sheet_rows",
+                    content=rows_xml,
+                    tool_call_id=f"call-{i}",
+                )
+            ]
+        ),
+        ModelResponse(
+            parts=[
+                ThinkingPart(content="Tổng hợp kết quả cho khách. " * 30),
+                TextPart(content=f"Liệu trình {i} có giá 500.000đ/buổi ạ."),
+            ]
+        ),
+    ]
+
+
+def _prompt_tokens(turns) -> list[int]:
+    """Token của history được replay ở từng turn (WINDOW turn gần nhất)"""
+    tokens = []
+    for i in range(len(turns)):
+        history = [m for turn in turns[max(0, i - WINDOW) : i] for m in turn]
+        tokens.append(estimate_messages_tokens(history))
+    return tokens
+
+
+def test_benchmark_history_pruning(benchmark):
+    pruner = HistoryPruner()
+    turns = [_turn(i) for i in range(TURNS)]
+
+    pruned_turns = benchmark(lambda: [pruner.prune(turn) for turn in turns])
+
+    raw_tokens = _prompt_tokens(turns)
+    pruned_tokens = _prompt_tokens(pruned_turns)
+    benchmark.extra_info["prompt_tokens_per_turn_raw"] = raw_tokens
+    benchmark.extra_info["prompt_tokens_per_turn_pruned"] = pruned_tokens
+    benchmark.extra_info["prompt_tokens_total_raw"] = sum(raw_tokens)
+    benchmark.extra_info["prompt_tokens_total_pruned"] = sum(pruned_tokens)
+    assert sum(pruned_tokens) < sum(raw_tokens) / 2
@@ -0,0 +1,92 @@
+"""
+Benchmark offline retrieval dense: một bước (top-k trên vector jina 1024 chiều,
+cách cũ) so với hai bước Matryoshka (lấy k * QDRANT_MRL_OVERSAMPLING ứng viên
+trên vector cắt còn QDRANT_MRL_DIMENSIONS chiều rồi tính lại điểm bằng vector
+đầy đủ). Brute force bằng numpy, không cần Qdrant; recall@k so với kết quả một
+bước nằm trong extra_info.
+
+Dữ liệu giả lập embedding Matryoshka: phương sai giảm dần theo chỉ số chiều (các
+chiều đầu mang nhiều thông tin nhất), query là chunk cộng nhiễu.
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.configs import env_config
+from app.services.clients.jina import truncate_embedding
+from app.services.clients.qdrant import DENSE_VECTOR_SIZE
+
+POINTS = 50_000
+QUERIES = 50
+TOP_K = 10
+DIMENSIONS = env_config.QDRANT_MRL_DIMENSIONS or 256
+CANDIDATES = TOP_K * env_config.QDRANT_MRL_OVERSAMPLING
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = np.random.default_rng(0)
+    scale = (np.arange(DENSE_VECTOR_SIZE, dtype=np.float32) + 1) ** -0.5
+    full = _normalize(
+        rng.standard_normal((POINTS, DENSE_VECTOR_SIZE), dtype=np.float32) * scale
+    )
+    picked = rng.choice(POINTS, QUERIES, replace=False)
+    noise = rng.standard_normal((QUERIES, DENSE_VECTOR_SIZE), dtype=np.float32)
+    queries = _normalize(full[picked] + 0.5 * noise * scale)
+    small = _normalize(full[:, :DIMENSIONS])
+    return full, small, queries
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _single_stage(full, queries):
+    return _top_k(queries @ full.T, TOP_K)
+
+
+def _two_stage(full, small, queries):
+    candidates = _top_k(_normalize(queries[:, :DIMENSIONS]) @ small.T, CANDIDATES)
+    rescored = np.einsum("qd,qcd->qc", queries, full[candidates])
+    order = np.argsort(-rescored, axis=1)[:, :TOP_K]
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def test_truncate_embedding_matches_numpy(corpus):
+    full, small, _ = corpus
+    truncated = truncate_embedding(full[0].tolist(), DIMENSIONS)
+    assert np.allclose(truncated, small[0], atol=1e-5)
+
+
+def test_single_stage_search(benchmark, corpus):
+    full, _, queries = corpus
+    benchmark.extra_info["points"] = POINTS
+    benchmark.extra_info["queries"] = QUERIES
+    benchmark.extra_info["vector_bytes_per_point"] = DENSE_VECTOR_SIZE * 4
+    benchmark(_single_stage, full, queries)
+
+
+def test_two_stage_matryoshka_search(benchmark, corpus):
+    full, small, queries = corpus
+    expected = _single_stage(full, queries)
+    result = benchmark(_two_stage, full, small, queries)
+    recall = np.mean(
+        [len(set(got) & set(want)) / TOP_K for got, want in zip(result, expected)]
+    )
+    benchmark.extra_info["points"] = POINTS
+    benchmark.extra_info["queries"] = QUERIES
+    benchmark.extra_info["dimensions"] = DIMENSIONS
+    benchmark.extra_info["candidates"] = CANDIDATES
+    benchmark.extra_info["indexed_vector_bytes_per_point"] = DIMENSIONS * 4
+    benchmark.extra_info[f"recall@{TOP_K}"] = float(recall)
+    assert recall >= 0.8
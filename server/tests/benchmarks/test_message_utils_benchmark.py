@@ -0,0 +1,60 @@
+"""
+Benchmark parse_and_format_message trên output của agent từ 1 KB đến 200 KB
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.utils.message_utils import parse_and_format_message
+
+PARAGRAPH = (
+    "**Liệu trình chăm sóc da** tại Khu p. 3, TP. HCM có giá 1.500.000đ! "
+    "Bác sĩ TS. Lan tư vấn miễn phí: đặt lịch trước 2 ngày; mang theo CMND. "
+    "Xem ảnh ![spa](https://cdn.example.com/spa.jpg) hoặc "
+    "[bảng giá](https://example.com/price.pdf) và video https://cdn.example.com/intro.mp4 "
+    "- Link đặt lịch: [Đặt lịch](https://example.com/booking)\n"
+    "*   **Ưu đãi:** giảm 20% cho khách hàng mới.\n"
+)
+TEXT_PARAGRAPH = (
+    "Khách hàng nên uống đủ nước, ngủ đủ giấc và dùng kem chống nắng mỗi ngày. "
+    "Dr. Minh khuyên nên tẩy tế bào chết 2 lần mỗi tuần; không nên lạm dụng. "
+) * 3
+
+
+def _agent_output(size: int, paragraph: str, separator: str = "\n\n") -> str:
+    blocks = []
+    length = 0
+    i = 0
+    while length < size:
+        block = paragraph if i % 10 else "---\n" + paragraph
+        blocks.append(block)
+        length += len(block) + len(separator)
+        i += 1
+    return separator.join(blocks)[:size]
+
+
+SIZES = [1_000, 10_000, 50_000, 200_000]
+
+
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: f"{size // 1000}KB")
+def test_benchmark_mixed_media_output(benchmark, size):
+    message = _agent_output(size, PARAGRAPH)
+    result = benchmark.pedantic(
+        parse_and_format_message, args=(message,), rounds=5, iterations=1
+    )
+    assert any(part.type == "image" for part in result)
+    assert all(len(part.payload) <= 2000 for part in result)
+
+
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: f"{size // 1000}KB")
+def test_benchmark_text_only_output(benchmark, size):
+    # Một đoạn dài không xuống dòng: đi qua nhánh chia theo câu và theo từ
+    message = _agent_output(size, TEXT_PARAGRAPH, separator=" ")
+    result = benchmark.pedantic(
+        parse_and_format_message, args=(message,), rounds=5, iterations=1
+    )
+    assert all(part.type == "text" for part in result)
+    assert all(len(part.payload) <= 2000 for part in result)
@@ -0,0 +1,49 @@
+"""
+Benchmark markdown_to_messenger / messenger_to_markdown, throughput (MB/s) được
+ghi vào extra_info của mỗi benchmark
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.utils.messenger_format import markdown_to_messenger, messenger_to_markdown
+
+MARKDOWN_BLOCK = (
+    "## Liệu trình chăm sóc da\n"
+    "* **Giá:** 500.000đ/buổi, ~~700.000đ~~\n"
+    "- Thời gian: 60 phút\n\n"
+    "Chị có thể đặt lịch qua hotline, bên em mở cửa từ 8h đến 20h ạ.\n"
+)
+MESSENGER_BLOCK = "Cho em hỏi *giá* liệu trình _trị mụn_ bao nhiêu ạ?\n• 5 * 10 buổi\n"
+PLAIN_BLOCK = "Chào chị, bên em có liệu trình chăm sóc da phù hợp với chị ạ. "
+SIZE = 2000  # giới hạn ký tự của một tin nhắn Messenger
+
+
+def _repeat(block: str) -> str:
+    return (block * (SIZE // len(block) + 1))[:SIZE]
+
+
+def _run(benchmark, convert, text):
+    benchmark(convert, text)
+    # Không có stats khi chạy với --benchmark-disable
+    if benchmark.stats:
+        benchmark.extra_info["MB/s"] = round(
+            len(text.encode()) / benchmark.stats.stats.mean / 1e6, 2
+        )
+
+
+@pytest.mark.parametrize(
+    "block", [MARKDOWN_BLOCK, PLAIN_BLOCK], ids=["markdown", "plain"]
+)
+def test_benchmark_markdown_to_messenger(benchmark, block):
+    _run(benchmark, markdown_to_messenger, _repeat(block))
+
+
+@pytest.mark.parametrize(
+    "block", [MESSENGER_BLOCK, PLAIN_BLOCK], ids=["formatted", "plain"]
+)
+def test_benchmark_messenger_to_markdown(benchmark, block):
+    _run(benchmark, messenger_to_markdown, _repeat(block))
@@ -0,0 +1,47 @@
+"""
+Benchmark kiểm tra thẻ XML trong output của agent: 32 lần re.search so với
+output_scanner quét một lượt
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import re
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.utils.agent_utils import DANGEROUS_XML_TAGS, contains_xml_tags
+
+LEGACY_PATTERNS = [rf"<{tag}\s*[^>]*>" for tag in DANGEROUS_XML_TAGS] + [
+    rf"</{tag}\s*>" for tag in DANGEROUS_XML_TAGS
+]
+# Output bình thường có nhiều dấu < (so sánh, HTML) nhưng không có thẻ bị cấm
+PARAGRAPH = (
+    "**Liệu trình chăm sóc da** giá < 1.500.000đ, hiệu quả > 90%. "
+    "Xem <b>bảng giá</b> tại [đây](https://example.com/price.pdf)\n"
+)
+SIZES = [1_000, 10_000, 50_000, 200_000]
+
+
+def _legacy_contains_xml_tags(output: str) -> bool:
+    for pattern in LEGACY_PATTERNS:
+        if re.search(pattern, output, flags=re.IGNORECASE):
+            return True
+    return False
+
+
+def _agent_output(size: int) -> str:
+    return (PARAGRAPH * (size // len(PARAGRAPH) + 1))[:size]
+
+
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: f"{size // 1000}KB")
+def test_benchmark_legacy_patterns(benchmark, size):
+    output = _agent_output(size)
+    assert not benchmark(_legacy_contains_xml_tags, output)
+
+
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: f"{size // 1000}KB")
+def test_benchmark_output_scanner(benchmark, size):
+    output = _agent_output(size)
+    assert not benchmark(contains_xml_tags, output)
@@ -0,0 +1,134 @@
+"""
+Benchmark search dense có filter sheet_id trên collection mặc định (không payload
+index, vector float32 trong RAM) so với collection được ensure_collection cấu
+hình (payload index, lượng tử hóa int8 + rescore, HNSW theo env). extra_info có
+ước lượng RAM của vector jina cho 1 triệu point.
+
+Cần Qdrant server thật: QDRANT_BENCHMARK_URL=http://localhost:6333
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import asyncio
+import os
+import uuid
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.configs import env_config
+from app.services.clients.qdrant import (
+    DENSE_SEARCH_PARAMS,
+    DENSE_VECTOR_SIZE,
+    SHEET_PAYLOAD_INDEXES,
+    ensure_collection,
+)
+
+QDRANT_BENCHMARK_URL = os.getenv("QDRANT_BENCHMARK_URL")
+pytestmark = pytest.mark.skipif(
+    not QDRANT_BENCHMARK_URL, reason="QDRANT_BENCHMARK_URL is not set"
+)
+
+POINTS = 20_000
+SHEETS = 200
+QUERIES = 20
+
+
+def _vector_ram_per_million(quantized: bool, on_disk: bool) -> int:
+    original = 0 if on_disk else DENSE_VECTOR_SIZE * 4
+    return (original + (DENSE_VECTOR_SIZE if quantized else 0)) * 1_000_000
+
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def collections(loop):
+    from qdrant_client import AsyncQdrantClient, models
+
+    client = AsyncQdrantClient(url=QDRANT_BENCHMARK_URL)
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((POINTS, DENSE_VECTOR_SIZE), dtype=np.float32)
+    baseline = f"bench_baseline_{uuid.uuid4().hex[:8]}"
+    tuned = f"bench_tuned_{uuid.uuid4().hex[:8]}"
+
+    async def setup():
+        await client.create_collection(
+            collection_name=baseline,
+            vectors_config={
+                "jina": models.VectorParams(
+                    size=DENSE_VECTOR_SIZE, distance=models.Distance.COSINE
+                )
+            },
+        )
+        await ensure_collection(client, tuned, SHEET_PAYLOAD_INDEXES)
+        for name in (baseline, tuned):
+            for start in range(0, POINTS, 1000):
+                await client.upsert(
+                    collection_name=name,
+                    points=[
+                        models.PointStruct(
+                            id=i,
+                            vector={"jina": vectors[i].tolist()},
+                            payload={"sheet_id": f"sheet_{i % SHEETS}", "row_id": i},
+                        )
+                        for i in range(start, min(start + 1000, POINTS))
+                    ],
+                )
+            while (await client.get_collection(name)).status != "green":
+                await asyncio.sleep(0.5)
+
+    loop.run_until_complete(setup())
+    yield client, baseline, tuned, vectors[:QUERIES]
+    for name in (baseline, tuned):
+        loop.run_until_complete(client.delete_collection(name))
+
+
+def _search(loop, client, collection_name, queries, params):
+    from qdrant_client import models
+
+    async def run():
+        for i, query in enumerate(queries):
+            await client.query_points(
+                collection_name=collection_name,
+                query=query.tolist(),
+                using="jina",
+                query_filter=models.Filter(
+                    must=[
+                        models.FieldCondition(
+                            key="sheet_id",
+                            match=models.MatchValue(value=f"sheet_{i % SHEETS}"),
+                        )
+                    ]
+                ),
+                search_params=params,
+                limit=10,
+            )
+
+    loop.run_until_complete(run())
+
+
+def test_filtered_search_default_collection(benchmark, loop, collections):
+    client, baseline, _, queries = collections
+    benchmark.extra_info["points"] = POINTS
+    benchmark.extra_info["queries"] = QUERIES
+    benchmark.extra_info["vector_ram_per_million_points"] = _vector_ram_per_million(
+        quantized=False, on_disk=False
+    )
+    benchmark(_search, loop, client, baseline, queries, None)
+
+
+def test_filtered_search_tuned_collection(benchmark, loop, collections):
+    client, _, tuned, queries = collections
+    benchmark.extra_info["points"] = POINTS
+    benchmark.extra_info["queries"] = QUERIES
+    benchmark.extra_info["vector_ram_per_million_points"] = _vector_ram_per_million(
+        quantized=env_config.QDRANT_QUANTIZATION,
+        on_disk=env_config.QDRANT_ON_DISK_VECTORS,
+    )
+    benchmark(_search, loop, client, tuned, queries, DENSE_SEARCH_PARAMS)
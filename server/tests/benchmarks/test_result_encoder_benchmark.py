@@ -0,0 +1,82 @@
+"""
+Benchmark định dạng kết quả query sheet: thời gian encode 200 dòng và số token
+(ước lượng) của kết quả cho từng định dạng, so với rows_to_xml cũ (ElementTree).
+Dữ liệu theo bảng sản phẩm của spa (tên, mô tả dài, giá Decimal, ...).
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import xml.etree.ElementTree as ET
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.utils.history_pruner import estimate_tokens
+from app.utils.result_encoder import RESULT_ENCODERS
+
+PRODUCTS = [
+    (
+        "BỘ N3 – HỖ TRỢ LOẠI BỎ NÁM, TÀN NHANG, ĐỒI MỒI",
+        "Bộ sản phẩm hỗ trợ làm đẹp da nám, giúp nghiền nát sắc tố, làm sáng da"
+        " và khỏe da. Liệu trình 4 tuần, dùng sáng và tối sau khi rửa mặt.",
+        2550000,
+        2100000,
+    ),
+    (
+        "BỘ NM1 – DÀNH CHO DA NÁM MỤN",
+        "Giúp loại bỏ nám, tàn nhang, giảm thâm mụn, cân bằng dầu nhờn và làm"
+        " sáng da. Phù hợp da dầu, da hỗn hợp.",
+        2800000,
+        2289000,
+    ),
+    (
+        "M01 – KEM LOẠI BỎ SẮC TỐ",
+        "Giúp loại bỏ thâm, sạm, nám trên bề mặt da, làm sáng da và cải thiện"
+        " làn da vàng sậm màu.",
+        910000,
+        750000,
+    ),
+]
+ROWS = [
+    {
+        "id": i,
+        "product_name": f"{PRODUCTS[i % 3][0]} ({i})",
+        "description": PRODUCTS[i % 3][1],
+        "original_price": Decimal(PRODUCTS[i % 3][2]),
+        "discounted_price": Decimal(PRODUCTS[i % 3][3]),
+        "category": "Trị nám" if i % 2 else "Chăm sóc da",
+        "in_stock": i % 5 != 0,
+    }
+    for i in range(200)
+]
+
+
+def _rows_to_xml_element_tree(rows):
+    """rows_to_xml trước đây"""
+    xml_parts = []
+    for row_data in rows:
+        row_element = ET.Element("row")
+        for key, value in row_data.items():
+            col_element = ET.SubElement(row_element, str(key))
+            col_element.text = str(value)
+        xml_parts.append(ET.tostring(row_element, encoding="unicode"))
+    return "\n".join(xml_parts)
+
+
+def test_encode_element_tree_xml(benchmark):
+    content = benchmark(_rows_to_xml_element_tree, ROWS)
+    benchmark.extra_info["rows"] = len(ROWS)
+    benchmark.extra_info["tokens"] = estimate_tokens(content)
+
+
+@pytest.mark.parametrize("name", sorted(RESULT_ENCODERS))
+def test_encode_result_format(benchmark, name):
+    encoder = RESULT_ENCODERS[name]()
+    content = benchmark(encoder.encode, ROWS)
+    benchmark.extra_info["rows"] = len(ROWS)
+    benchmark.extra_info["tokens"] = estimate_tokens(content)
+    benchmark.extra_info["element_tree_tokens"] = estimate_tokens(
+        _rows_to_xml_element_tree(ROWS)
+    )
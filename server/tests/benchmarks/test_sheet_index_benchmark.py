@@ -0,0 +1,54 @@
+"""
+Benchmark map sheet_id model sinh ra về sheet: quét fuzzy toàn bộ id (cách cũ,
+process.extractOne) so với SheetIndex (khớp sau chuẩn hóa hoặc fuzzy trên các
+ứng viên từ index n-gram). Không tính query DB mà cách cũ chạy ở mỗi lần gọi.
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.utils.sheet_index import SheetIndex
+from thefuzz import process
+
+SHEETS = [
+    SimpleNamespace(
+        id=str(uuid.UUID(int=i * 7919 + 1)),
+        table_name=f"sheet_{i}_bang_gia",
+        name=f"Bảng giá {i}",
+    )
+    for i in range(200)
+]
+# Các biến thể model hay sinh ra: uuid với "_", tên bảng với "-", gõ thiếu ký tự
+QUERIES = (
+    [SHEETS[i].id.replace("-", "_") for i in range(0, 200, 20)]
+    + [SHEETS[i].table_name.replace("_", "-") for i in range(5, 200, 20)]
+    + [SHEETS[i].table_name.replace("_bang", "bang") for i in range(10, 200, 20)]
+)
+
+
+def _resolve_with_scan():
+    sheet_ids = [sheet.id for sheet in SHEETS]
+    for query in QUERIES:
+        query = query.replace("_", "-")
+        if query not in sheet_ids:
+            process.extractOne(query, sheet_ids)
+
+
+def test_resolve_with_full_scan(benchmark):
+    benchmark.extra_info["sheets"] = len(SHEETS)
+    benchmark.extra_info["queries"] = len(QUERIES)
+    benchmark(_resolve_with_scan)
+
+
+def test_resolve_with_sheet_index(benchmark):
+    index = SheetIndex(SHEETS)
+    benchmark.extra_info["sheets"] = len(SHEETS)
+    benchmark.extra_info["queries"] = len(QUERIES)
+    matches = benchmark(lambda: [index.resolve(query) for query in QUERIES])
+    assert all(match.score >= 60 for match in matches)
@@ -0,0 +1,106 @@
+"""
+Benchmark chi phí dựng synthetic agent ở mỗi lượt: build lại agent + notify
+tools mỗi lượt (trước) so với dùng agent đã cache theo catalogue version (sau).
+Model là FunctionModel trả lời ngay, instruction và danh sách notification được
+thay bằng dữ liệu giả nên chỉ đo phần overhead phía server (không tính query DB
+lấy notification mà bản cũ phải chạy ở mỗi lượt).
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+NOTIFICATIONS = 20
+TURNS = 20
+
+
+@pytest.fixture(scope="module")
+def synthetic():
+    try:
+        from app.pydantic_agents import synthetic, synthetic_tools
+    except Exception as e:  # cần tải model fastembed khi import app.pydantic_agents
+        pytest.skip(f"app.pydantic_agents is not importable: {e}")
+    return SimpleNamespace(module=synthetic, tools=synthetic_tools)
+
+
+@pytest.fixture
+def stub_agent(synthetic, monkeypatch):
+    from pydantic_ai.messages import ModelResponse, TextPart
+    from pydantic_ai.models.function import FunctionModel
+
+    notifications = [
+        SimpleNamespace(
+            id=f"notification-{i}",
+            label=f"Thông báo {i}",
+            content="Khách {{ name }} đặt lịch lúc {{ time }}",
+            params=[
+                {"param_name": "name", "param_type": "String"},
+                {"param_name": "time", "param_type": "String"},
+            ],
+        )
+        for i in range(NOTIFICATIONS)
+    ]
+
+    async def get_notify_tools():
+        return [
+            synthetic.tools.create_tool(
+                notification,
+                {
+                    "name": f"notify_{i}",
+                    "description": f"Notify admin {i}",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string"},
+                            "time": {"type": "string"},
+                        },
+                        "required": ["name", "time"],
+                    },
+                },
+            )
+            for i, notification in enumerate(notifications)
+        ]
+
+    async def get_instruction(context):
+        return f"<customer_id>{context.deps.user_id}</customer_id>"
+
+    monkeypatch.setattr(synthetic.module, "get_notify_tools", get_notify_tools)
+    monkeypatch.setattr(synthetic.module, "get_instruction", get_instruction)
+    synthetic.module._synthetic_agent_cache.clear()
+
+    def reply(messages, info):
+        return ModelResponse(parts=[TextPart(content="Dạ em chào anh/chị ạ")])
+
+    return FunctionModel(reply)
+
+
+def _run_turns(synthetic, model, get_agent):
+    async def run():
+        for turn in range(TURNS):
+            agent = await get_agent()
+            deps = synthetic.tools.SyntheticAgentDeps(
+                user_input="Xin chào", user_id=f"guest-{turn}"
+            )
+            result = await agent.run("Xin chào", deps=deps, model=model)
+            assert result.output
+
+    asyncio.run(run())
+
+
+def test_rebuild_agent_per_turn(benchmark, synthetic, stub_agent):
+    benchmark.extra_info["turns"] = TURNS
+    benchmark.extra_info["notify_tools"] = NOTIFICATIONS
+    benchmark(
+        _run_turns, synthetic, stub_agent, synthetic.module.create_synthetic_agent
+    )
+
+
+def test_cached_agent_per_turn(benchmark, synthetic, stub_agent):
+    benchmark.extra_info["turns"] = TURNS
+    benchmark.extra_info["notify_tools"] = NOTIFICATIONS
+    benchmark(_run_turns, synthetic, stub_agent, synthetic.module.get_synthetic_agent)
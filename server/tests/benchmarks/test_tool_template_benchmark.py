@@ -0,0 +1,50 @@
+"""
+Benchmark render nội dung notification: tạo jinja2.Template (parse + compile)
+ở mỗi lần gọi tool so với template đã compile sẵn trong tool_template_cache.
+
+Chạy: pytest tests/benchmarks --benchmark-only
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.utils import string_utils
+from jinja2 import Template
+
+NOTIFICATIONS = 30
+TEMPLATE = """Khách hàng {{ name }} ({{ phone }}) muốn đặt lịch {{ service }}
+vào lúc {{ time }} ngày {{ date }} tại chi nhánh {{ branch }}.
+{% if note %}Ghi chú: {{ note }}{% endif %}"""
+PARAMS = {
+    "name": "Nguyễn Văn An",
+    "phone": "0912345678",
+    "service": "Chăm sóc da chuyên sâu",
+    "time": "09:30",
+    "date": "20/10",
+    "branch": "Quận 1",
+    "note": "Khách quen",
+}
+TEMPLATES = [(f"notification-{i}", f"[{i}] {TEMPLATE}") for i in range(NOTIFICATIONS)]
+
+
+def _render_uncached():
+    for _, template_str in TEMPLATES:
+        Template(template_str).render(**PARAMS)
+
+
+def _render_cached():
+    for notification_id, template_str in TEMPLATES:
+        string_utils.render_notification_template(notification_id, template_str, PARAMS)
+
+
+def test_render_without_cache(benchmark):
+    benchmark.extra_info["templates"] = NOTIFICATIONS
+    benchmark(_render_uncached)
+
+
+def test_render_with_compiled_cache(benchmark):
+    benchmark.extra_info["templates"] = NOTIFICATIONS
+    _render_cached()
+    benchmark(_render_cached)
+    benchmark.extra_info.update(string_utils.tool_template_cache.get_metrics())
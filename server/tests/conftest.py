@@ -30,6 +30,14 @@ class MockQdrant:
 # Insert our mock into sys.modules to intercept all imports
 sys.modules["app.configs.qdrant"] = MockQdrant()
 
+# Model BM25 của fastembed được tải qua mạng khi import các rag service: không tải
+# trong test, test nào cần embed thì patch sparse_embedding_model của service
+import fastembed  # noqa: E402
+
+patch.object(
+    fastembed.SparseTextEmbedding, "__init__", lambda self, *args, **kwargs: None
+).start()
+
 # Now we can safely import the rest
 
 # Create a mock DB session
@@ -0,0 +1,47 @@
+"""
+Test file for agent_utils.collect_capped_rows - giới hạn kết quả SQL của agent
+"""
+
+import asyncio
+
+from app.utils.agent_utils import collect_capped_rows
+
+
+async def _rows(count, consumed):
+    for i in range(count):
+        consumed.append(i)
+        yield {"id": i, "ten": f"Dịch vụ {i}"}
+
+
+def _collect(count, max_rows, max_bytes):
+    consumed = []
+    texts, truncated = asyncio.run(
+        collect_capped_rows(
+            _rows(count, consumed), lambda row: str(row), max_rows, max_bytes
+        )
+    )
+    return texts, truncated, consumed
+
+
+def test_collect_all_rows_within_limits():
+    texts, truncated, _ = _collect(5, max_rows=10, max_bytes=10_000)
+    assert len(texts) == 5
+    assert not truncated
+
+
+def test_row_limit_stops_reading():
+    texts, truncated, consumed = _collect(1000, max_rows=20, max_bytes=10_000)
+    assert len(texts) == 20
+    assert truncated
+    # Không đọc hết cursor
+    assert len(consumed) == 21
+
+
+def test_byte_limit_keeps_first_row():
+    texts, truncated, _ = _collect(100, max_rows=100, max_bytes=100)
+    assert truncated
+    assert sum(len(text.encode()) + 1 for text in texts) <= 100
+
+    texts, truncated, _ = _collect(3, max_rows=10, max_bytes=1)
+    assert len(texts) == 1
+    assert truncated
@@ -0,0 +1,160 @@
+"""
+Test file for conversation_cache.py - cache short-term memory của guest
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from app.models import ChatHistory
+from app.services import chat_history_service
+from app.utils.conversation_cache import (
+    ConversationMemory,
+    ConversationMemoryCache,
+    MemoryTurn,
+)
+from pydantic_ai.messages import (
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    UserPromptPart,
+)
+
+WINDOW = 10
+OVERLAP = 5
+
+
+class FakeChatHistoryRepository:
+    """chat_history_repository trong bộ nhớ, đếm số lần query"""
+
+    def __init__(self):
+        self.histories: list[ChatHistory] = []
+        self.queries = 0
+
+    def add(self, guest_id, turn, summary=""):
+        history = ChatHistory(
+            guest_id=guest_id,
+            content=ModelMessagesTypeAdapter.dump_json(
+                [
+                    ModelRequest(parts=[UserPromptPart(content=f"hỏi {turn}")]),
+                    ModelResponse(parts=[TextPart(content=f"đáp {turn}")]),
+                ]
+            ),
+            summary=summary,
+            used_scripts=f"script-{turn}",
+            history_count=turn,
+            created_at=datetime(2025, 1, 1) + timedelta(minutes=turn),
+        )
+        self.histories.append(history)
+        return history
+
+    def _latest(self, guest_id, before=None):
+        histories = [
+            h
+            for h in self.histories
+            if h.guest_id == guest_id and (before is None or h.created_at <= before)
+        ]
+        return sorted(histories, key=lambda h: h.created_at, reverse=True)
+
+    async def get_chat_histories_until_summary(self, db, guest_id, max_limit=10):
+        self.queries += 1
+        histories = []
+        for history in self._latest(guest_id)[:max_limit]:
+            histories.append(history)
+            if history.summary and history.summary.strip():
+                break
+        return histories
+
+    async def get_latest_chat_histories_from_datetime(
+        self, db, guest_id, datetime, limit=5
+    ):
+        self.queries += 1
+        return self._latest(guest_id, before=datetime)[:limit]
+
+
+def _dump(memory: ConversationMemory):
+    return (
+        ModelMessagesTypeAdapter.dump_json(memory.message_history()),
+        memory.summary,
+        memory.history_count,
+        memory.used_script_ids(WINDOW),
+    )
+
+
+async def _read_from_database(guest_id):
+    # Cache rỗng với max_bytes=0: luôn đọc và decode lại từ repository
+    with patch.object(
+        chat_history_service, "conversation_cache", ConversationMemoryCache(0)
+    ):
+        return await chat_history_service.get_conversation_memory(
+            None, guest_id, WINDOW, OVERLAP
+        )
+
+
+def _memory(turn_sizes, history_count=0):
+    return ConversationMemory(
+        recent_turns=[MemoryTurn([], None, size) for size in turn_sizes],
+        summary=None,
+        summary_turns=[],
+        history_count=history_count,
+        window_size=WINDOW,
+    )
+
+
+@pytest.mark.parametrize(
+    "summary_turns, misses",
+    [({10, 20}, 3), ({3}, 2)],
+    ids=["every-10-turns", "summary-leaves-window"],
+)
+def test_cached_memory_matches_database_across_summaries(summary_turns, misses):
+    """Test memory được append qua 25 lượt giống hệt đọc lại từ DB"""
+    repository = FakeChatHistoryRepository()
+    cache = ConversationMemoryCache(max_bytes=10_000_000)
+
+    async def run():
+        for turn in range(1, 26):
+            memory = await chat_history_service.get_conversation_memory(
+                None, "guest-1", WINDOW, OVERLAP
+            )
+            assert _dump(memory) == _dump(await _read_from_database("guest-1")), turn
+            summary = "tóm tắt" if turn in summary_turns else ""
+            chat_history_service.remember_chat_history(
+                repository.add("guest-1", turn, summary)
+            )
+
+    with patch.object(
+        chat_history_service, "chat_history_repository", repository
+    ), patch.object(chat_history_service, "conversation_cache", cache):
+        asyncio.run(run())
+
+    # Chỉ đọc DB ở lượt đầu và sau mỗi lần summary
+    assert cache.misses == misses
+    assert cache.hits == 25 - misses
+
+
+def test_evicts_least_recently_used_guest_by_bytes():
+    """Test vượt max_bytes thì loại guest ít dùng nhất"""
+    cache = ConversationMemoryCache(max_bytes=250)
+    for guest_id in ("a", "b"):
+        cache.put(guest_id, _memory([100]), cache.begin_load(guest_id))
+    assert cache.get("a") is not None  # "b" thành guest ít dùng nhất
+
+    cache.put("c", _memory([100]), cache.begin_load("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    cache.append("a", MemoryTurn([], None, 100), history_count=1)
+    assert cache.get_metrics()["bytes"] <= 250
+    assert cache.get_metrics()["evictions"] == 2
+
+
+def test_load_is_discarded_when_turn_is_saved_meanwhile():
+    """Test kết quả đọc DB cũ không được put nếu có turn mới được lưu trong lúc đọc"""
+    cache = ConversationMemoryCache(max_bytes=10_000)
+    token = cache.begin_load("guest-1")
+    cache.append("guest-1", MemoryTurn([], None, 10), history_count=1)
+
+    assert not cache.put("guest-1", _memory([10]), token)
+    assert cache.get("guest-1") is None
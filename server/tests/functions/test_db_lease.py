@@ -0,0 +1,60 @@
+"""
+Test file for db_lease.py - theo dõi connection bị giữ qua lời gọi LLM/HTTP
+"""
+
+import asyncio
+
+import pytest
+from app.utils.db_lease import ConnectionLeaseError, Histogram, LeaseTracker
+from sqlalchemy import create_engine, text
+
+
+def test_histogram_buckets():
+    """Test giá trị được đếm vào bucket nhỏ nhất chứa nó"""
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+
+    metrics = histogram.to_dict()
+    assert metrics["buckets"] == {"le_0.1": 2, "le_1": 1, "le_inf": 1}
+    assert metrics["count"] == 4
+    assert metrics["max"] == 3
+
+
+def test_connection_held_across_external_call_raises_in_debug():
+    """Test debug mode raise khi task còn giữ connection lúc gọi ra ngoài"""
+    tracker = LeaseTracker(debug=True)
+    engine = create_engine("sqlite://")
+    tracker.install(engine)
+
+    async def run():
+        connection = engine.connect()
+        connection.execute(text("SELECT 1"))
+        with pytest.raises(ConnectionLeaseError):
+            tracker.ensure_released("synthetic_agent.run")
+        connection.close()
+        # Connection đã trả về pool thì không còn lỗi
+        tracker.ensure_released("synthetic_agent.run")
+
+        # Connection của task khác không tính cho task hiện tại
+        other = await asyncio.create_task(asyncio.to_thread(engine.connect))
+        tracker.ensure_released("synthetic_agent.run")
+        other.close()
+
+    asyncio.run(run())
+    assert tracker.checkout_histogram.count >= 1
+    assert tracker.get_metrics()["tasks_holding_connections"] == 0
+
+
+def test_connection_held_is_ignored_without_debug():
+    """Test chế độ thường chỉ đo, không raise"""
+    tracker = LeaseTracker(debug=False)
+    engine = create_engine("sqlite://")
+    tracker.install(engine)
+
+    async def run():
+        with engine.connect():
+            tracker.ensure_released("synthetic_agent.run")
+            assert tracker.held_by_current_task() == 1
+
+    asyncio.run(run())
@@ -0,0 +1,173 @@
+"""
+Test file for history_codec.py - định dạng nén của ChatHistory.content / qa_content
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from app.services import chat_history_service
+from app.utils.agent_utils import dump_json_bytes
+from app.utils.history_codec import (
+    MIN_DICTIONARY_SAMPLES,
+    HistoryCodec,
+    UnknownDictionaryError,
+    dictionary_id,
+    is_compact,
+    messages_payload,
+    text_payload,
+    train_dictionary,
+)
+from pydantic_ai.messages import (
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+
+def _messages_json(turn: int) -> bytes:
+    return ModelMessagesTypeAdapter.dump_json(
+        [
+            ModelRequest(parts=[UserPromptPart(content=f"Giá liệu trình {turn}?")]),
+            ModelResponse(
+                parts=[
+                    ToolCallPart(
+                        tool_name="query_sheet",
+                        args={"sheet_id": f"sheet-{turn}", "query": "SELECT 1"},
+                        tool_call_id=f"call-{turn}",
+                    )
+                ]
+            ),
+            ModelRequest(
+                parts=[
+                    ToolReturnPart(
+                        tool_name="query_sheet",
+                        content=[{"giá": turn * 100_000, "tên": "Gội đầu dưỡng sinh"}],
+                        tool_call_id=f"call-{turn}",
+                    )
+                ]
+            ),
+            ModelResponse(parts=[TextPart(content=f"Liệu trình {turn} giá ưu đãi")]),
+        ]
+    )
+
+
+def _trained_codec() -> tuple[HistoryCodec, int]:
+    samples = [messages_payload(_messages_json(i)) for i in range(300)]
+    samples += [text_payload(f"<user>câu hỏi {i}</user>\n") for i in range(300)]
+    dictionary = train_dictionary(samples)
+    codec = HistoryCodec()
+    codec.add_dictionary(dictionary.dict_id(), dictionary.as_bytes())
+    return codec, dictionary.dict_id()
+
+
+def test_messages_round_trip():
+    codec = HistoryCodec()
+    messages_json = _messages_json(1)
+    encoded = codec.encode_messages(messages_json)
+
+    assert is_compact(encoded)
+    assert dictionary_id(encoded) == 0
+    assert (
+        ModelMessagesTypeAdapter.dump_json(codec.decode_messages(encoded))
+        == messages_json
+    )
+    assert len(encoded) < len(messages_json)
+
+
+def test_text_round_trip():
+    codec = HistoryCodec()
+    text = '<user>Có "ưu đãi" không?</user>\n<assistant>Có ạ</assistant>\n'
+    assert codec.decode_text(codec.encode_text(text)) == text
+
+
+def test_reads_legacy_format():
+    codec = HistoryCodec()
+    messages_json = _messages_json(2)
+    qa_content = "<user>Chào\nbạn</user>\n"
+
+    assert not is_compact(messages_json)
+    assert dictionary_id(messages_json) is None
+    assert (
+        ModelMessagesTypeAdapter.dump_json(codec.decode_messages(messages_json))
+        == messages_json
+    )
+    assert codec.decode_text(dump_json_bytes(qa_content)) == qa_content
+    assert codec.decoded_size(messages_json) == len(messages_json)
+
+
+def test_dictionary_compression():
+    codec, dict_id = _trained_codec()
+    plain = HistoryCodec()
+    messages_json = _messages_json(1000)
+    encoded = codec.encode_messages(messages_json)
+
+    assert dictionary_id(encoded) == dict_id
+    assert len(encoded) < len(plain.encode_messages(messages_json))
+    assert (
+        ModelMessagesTypeAdapter.dump_json(codec.decode_messages(encoded))
+        == messages_json
+    )
+    assert codec.decoded_size(encoded) == len(messages_payload(messages_json))
+    # Dữ liệu nén trước khi có dictionary vẫn đọc được
+    assert codec.decode_text(plain.encode_text("xin chào")) == "xin chào"
+
+
+def test_unknown_dictionary():
+    codec, dict_id = _trained_codec()
+    encoded = codec.encode_text("xin chào")
+
+    with pytest.raises(UnknownDictionaryError) as error:
+        HistoryCodec().decode_text(encoded)
+    assert error.value.dict_id == dict_id
+
+
+def test_not_enough_samples():
+    samples = [text_payload("a")] * (MIN_DICTIONARY_SAMPLES - 1)
+    assert train_dictionary(samples) is None
+
+
+def test_migration_skips_unreadable_rows(monkeypatch):
+    codec, _ = _trained_codec()
+    good = SimpleNamespace(
+        id="good", content=_messages_json(1), qa_content=dump_json_bytes("xin chào")
+    )
+    broken = SimpleNamespace(id="broken", content=b"{not json", qa_content=None)
+    histories = [broken, good]
+
+    async def get_chat_histories_to_recompress(db, header, limit, exclude_ids=()):
+        pending = [
+            h
+            for h in histories
+            if not h.content.startswith(header) and h.id not in exclude_ids
+        ]
+        return pending[:limit]
+
+    @asynccontextmanager
+    async def session_scope():
+        yield None
+
+    monkeypatch.setattr(chat_history_service, "history_codec", codec)
+    monkeypatch.setattr(chat_history_service, "session_scope", session_scope)
+    monkeypatch.setattr(chat_history_service, "ensure_codec_dictionaries", AsyncMock())
+    monkeypatch.setattr(
+        chat_history_service.chat_history_repository,
+        "get_chat_histories_to_recompress",
+        get_chat_histories_to_recompress,
+    )
+
+    report = asyncio.run(
+        chat_history_service.migrate_chat_histories(batch_size=1, pause=0)
+    )
+
+    assert report["rows"] == 1
+    assert report["failed"] == 1
+    assert broken.content == b"{not json"
+    assert good.content.startswith(codec.header)
+    assert codec.decode_text(good.qa_content) == "xin chào"
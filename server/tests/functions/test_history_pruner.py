@@ -0,0 +1,101 @@
+"""
+Test file for history_pruner.py - rút gọn message history trước khi lưu/replay
+"""
+
+from app.utils.history_pruner import (
+    HistoryPruner,
+    estimate_messages_tokens,
+    estimate_tokens,
+)
+from pydantic_ai.messages import (
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ThinkingPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+ROWS_XML = "\n".join(
+    f"<row><ten>Liệu trình {i}</ten><gia>{i * 100000}</gia></row>" for i in range(200)
+)
+
+
+def _turn(tool_content=ROWS_XML):
+    return [
+        ModelRequest(parts=[UserPromptPart(content="Có những liệu trình nào?")]),
+        ModelResponse(
+            parts=[
+                ThinkingPart(content="Cần query sheet liệu trình"),
+                ToolCallPart(
+                    tool_name="execute_query_on_sheet_rows",
+                    args={"query": "SELECT * FROM sheet"},
+                    tool_call_id="call-1",
+                ),
+            ]
+        ),
+        ModelRequest(
+            parts=[
+                ToolReturnPart(
+                    tool_name="execute_query_on_sheet_rows",
+                    content=tool_content,
+                    tool_call_id="call-1",
+                )
+            ]
+        ),
+        ModelResponse(parts=[ThinkingPart(content="Trả lời khách")]),
+        ModelResponse(parts=[TextPart(content="Bên em có các liệu trình sau ạ")]),
+    ]
+
+
+def test_drops_thinking_parts():
+    pruned = HistoryPruner(max_tool_return_tokens=0).prune(_turn())
+
+    assert len(pruned) == 4
+    for message in pruned:
+        assert not any(isinstance(part, ThinkingPart) for part in message.parts)
+    assert isinstance(pruned[1].parts[0], ToolCallPart)
+
+
+def test_truncates_tool_return_at_row_boundary():
+    messages = _turn()
+    pruned = HistoryPruner(max_tool_return_tokens=100).prune(messages)
+    tool_return = pruned[2].parts[0]
+
+    assert estimate_tokens(tool_return.content) < 150
+    kept, note = tool_return.content.split("\n[Truncated ")
+    assert kept.endswith("</row>")
+    assert ROWS_XML.startswith(kept)
+    kept_rows = len(kept.splitlines())
+    assert note.startswith(f"{200 - kept_rows} more lines")
+    # Không sửa message gốc
+    assert messages[2].parts[0].content == ROWS_XML
+
+
+def test_keeps_tool_call_return_pairs():
+    pruned = HistoryPruner(max_tool_return_tokens=10).prune(_turn([{"a": "b" * 500}]))
+    calls = [
+        part.tool_call_id
+        for message in pruned
+        for part in message.parts
+        if isinstance(part, ToolCallPart)
+    ]
+    returns = [
+        part.tool_call_id
+        for message in pruned
+        for part in message.parts
+        if isinstance(part, ToolReturnPart)
+    ]
+    assert calls == returns == ["call-1"]
+    # History sau khi rút gọn vẫn serialize/validate được
+    dumped = ModelMessagesTypeAdapter.dump_json(pruned)
+    assert ModelMessagesTypeAdapter.validate_json(dumped)
+
+
+def test_small_history_is_unchanged():
+    messages = _turn("ok")
+    pruned = HistoryPruner(drop_thinking=False).prune(messages)
+    assert all(new is old for new, old in zip(pruned, messages))
+    assert estimate_messages_tokens(pruned) == estimate_messages_tokens(messages)
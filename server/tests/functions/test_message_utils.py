@@ -253,6 +253,17 @@ def test_mixed_content():
     print("✓ Test mixed content passed")
 
 
+def test_overlapping_media_matches():
+    """Test match chồng lấn giữa các loại media giữ nguyên output như trước"""
+    result = parse_and_format_message("Ảnh: https://x.co/p.jpg)https://x.co/s.mp3")
+    assert [(part.type, part.payload) for part in result] == [
+        ("text", "Ảnh: )https://x.co/s.mp3"),
+        ("image", "https://x.co/p.jpg"),
+    ]
+
+    print("✓ Test overlapping media matches passed")
+
+
 def run_all_tests():
     """Chạy tất cả tests"""
     print("Bắt đầu chạy tests cho parse_and_format_message...")
@@ -267,6 +278,7 @@ def run_all_tests():
         test_long_text_splitting()
         test_edge_cases()
         test_mixed_content()
+        test_overlapping_media_matches()
 
         print("=" * 50)
         print("🎉 Tất cả tests đều PASSED!")
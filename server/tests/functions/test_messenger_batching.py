@@ -0,0 +1,169 @@
+"""
+Test file for messenger_dispatcher.py batch mode - đếm số HTTP request
+gửi tới một Graph API giả lập
+"""
+
+import asyncio
+import json
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from app.services.integrations.messenger_dispatcher import MessengerDispatcher
+
+PAGE_ID = "page-1"
+
+
+class FakeGraphApi:
+    """Graph API giả lập: /{page_id}/messages và batch request tại /"""
+
+    def __init__(self):
+        self.http_requests = 0
+        self.delivered = []
+        self.batch_sizes = []
+        self.app = web.Application()
+        self.app.router.add_post(f"/{PAGE_ID}/messages", self.handle_message)
+        self.app.router.add_post("/", self.handle_batch)
+
+    async def handle_message(self, request: web.Request) -> web.Response:
+        self.http_requests += 1
+        self.delivered.append(await request.json())
+        return web.json_response({"recipient_id": "ok"})
+
+    async def handle_batch(self, request: web.Request) -> web.Response:
+        self.http_requests += 1
+        form = await request.post()
+        self.batch_sizes.append(len(json.loads(form["batch"])))
+        results = []
+        for item in json.loads(form["batch"]):
+            assert item["relative_url"] == f"{PAGE_ID}/messages"
+            body = {
+                key: json.loads(values[0]) if values[0].startswith("{") else values[0]
+                for key, values in parse_qs(item["body"]).items()
+            }
+            self.delivered.append(body)
+            results.append({"code": 200, "headers": [], "body": "{}"})
+        return web.json_response(results)
+
+
+async def send_typical_reply(dispatcher: MessengerDispatcher, recipient_id, parts):
+    """Lặp lại chuỗi request của messenger_service.handle_chat"""
+    dispatcher.send_action(recipient_id, "mark_seen")
+    dispatcher.send_action(recipient_id, "typing_on")
+    await asyncio.sleep(0.02)  # agent đang chạy
+    dispatcher.send_action(recipient_id, "typing_off")
+    if dispatcher.batch_mode:
+        futures = [dispatcher.send_message(recipient_id, {"text": p}) for p in parts]
+        await asyncio.gather(*futures)
+        return
+    for i, part in enumerate(parts):
+        await dispatcher.send_message(recipient_id, {"text": part})
+        if i < len(parts) - 1:
+            dispatcher.send_action(recipient_id, "typing_on")
+            await asyncio.sleep(0.02)
+            dispatcher.send_action(recipient_id, "typing_off")
+
+
+async def count_requests(batch_mode: bool, recipients=("guest-1",)):
+    fake_api = FakeGraphApi()
+    server = TestServer(fake_api.app)
+    await server.start_server()
+    dispatcher = MessengerDispatcher(
+        batch_mode=batch_mode,
+        api_url=str(server.make_url("")).rstrip("/"),
+        recipient_burst=20,
+    )
+    parts = [f"part {i}" for i in range(5)]
+    try:
+        await asyncio.gather(
+            *[send_typical_reply(dispatcher, r, parts) for r in recipients]
+        )
+        while dispatcher.get_metrics()["queued"]:
+            await asyncio.sleep(0.01)
+    finally:
+        await dispatcher.close()
+        await server.close()
+    return fake_api
+
+
+def test_batch_mode_reduces_requests_for_typical_reply():
+    """Test batch mode giảm ít nhất 3 lần số HTTP request của một câu trả lời 5 phần"""
+    with patch("app.configs.env_config.PAGE_ID", PAGE_ID), patch(
+        "app.configs.env_config.PAGE_ACCESS_TOKEN", "token"
+    ):
+        single = asyncio.run(count_requests(batch_mode=False))
+        batched = asyncio.run(count_requests(batch_mode=True))
+
+    texts = [d["message"]["text"] for d in batched.delivered if "message" in d]
+    assert texts == [f"part {i}" for i in range(5)]
+    assert single.http_requests >= 3 * batched.http_requests, (
+        single.http_requests,
+        batched.http_requests,
+    )
+
+
+def test_batch_mode_merges_sender_actions_of_different_guests():
+    """Test sender action của nhiều guest trong vài ms được gộp vào một batch"""
+
+    async def run():
+        fake_api = FakeGraphApi()
+        server = TestServer(fake_api.app)
+        await server.start_server()
+        dispatcher = MessengerDispatcher(
+            batch_mode=True, api_url=str(server.make_url("")).rstrip("/")
+        )
+        try:
+            futures = [
+                dispatcher.send_action(f"guest-{i}", "mark_seen") for i in range(10)
+            ]
+            results = await asyncio.gather(*futures)
+        finally:
+            await dispatcher.close()
+            await server.close()
+        return fake_api, results
+
+    with patch("app.configs.env_config.PAGE_ID", PAGE_ID), patch(
+        "app.configs.env_config.PAGE_ACCESS_TOKEN", "token"
+    ):
+        fake_api, results = asyncio.run(run())
+
+    assert results == [True] * 10
+    assert fake_api.http_requests == 1
+    assert len(fake_api.delivered) == 10
+
+
+def test_batch_mode_respects_recipient_rate_limit():
+    """Test mỗi request trong batch tốn một token của người nhận"""
+
+    async def run():
+        fake_api = FakeGraphApi()
+        server = TestServer(fake_api.app)
+        await server.start_server()
+        dispatcher = MessengerDispatcher(
+            batch_mode=True,
+            api_url=str(server.make_url("")).rstrip("/"),
+            recipient_rate=20,
+            recipient_burst=2,
+        )
+        try:
+            futures = [
+                dispatcher.send_message("guest-1", {"text": f"part {i}"})
+                for i in range(5)
+            ]
+            results = await asyncio.gather(*futures)
+        finally:
+            await dispatcher.close()
+            await server.close()
+        return fake_api, results
+
+    with patch("app.configs.env_config.PAGE_ID", PAGE_ID), patch(
+        "app.configs.env_config.PAGE_ACCESS_TOKEN", "token"
+    ):
+        fake_api, results = asyncio.run(run())
+
+    assert results == [True] * 5
+    assert fake_api.batch_sizes[0] == 2
+    assert max(fake_api.batch_sizes) <= 2
+    texts = [d["message"]["text"] for d in fake_api.delivered]
+    assert texts == [f"part {i}" for i in range(5)]
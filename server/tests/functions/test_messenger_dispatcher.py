@@ -0,0 +1,159 @@
+"""
+Test file for messenger_dispatcher.py - outbound Send API queue
+"""
+
+import asyncio
+
+from app.services.integrations.messenger_dispatcher import (
+    MessengerDispatcher,
+    parse_usage_headers,
+)
+
+
+class FakeDispatcher(MessengerDispatcher):
+    """Dispatcher ghi lại payload thay vì gọi Graph API"""
+
+    def __init__(self, responses=None, **kwargs):
+        super().__init__(**kwargs)
+        self.sent = []
+        self.responses = list(responses or [])
+
+    async def post(self, payload):
+        self.sent.append(payload)
+        await asyncio.sleep(0)
+        if self.responses:
+            return self.responses.pop(0)
+        return 200, {}, {}
+
+
+def _describe(payload):
+    if "sender_action" in payload:
+        return (payload["recipient"]["id"], payload["sender_action"])
+    return (payload["recipient"]["id"], payload["message"]["text"])
+
+
+def test_replies_keep_order_per_recipient():
+    """Test các phần trả lời của cùng một người nhận được gửi đúng thứ tự"""
+
+    async def run():
+        dispatcher = FakeDispatcher(concurrency=4, recipient_burst=10)
+        futures = [
+            dispatcher.send_message("guest-1", {"text": f"part {i}"}) for i in range(5)
+        ]
+        results = await asyncio.gather(*futures)
+        await dispatcher.close()
+        return dispatcher, results
+
+    dispatcher, results = asyncio.run(run())
+    assert results == [True] * 5
+    assert [_describe(p)[1] for p in dispatcher.sent] == [f"part {i}" for i in range(5)]
+
+
+def test_replies_preempt_sender_actions():
+    """Test tin trả lời được gửi trước typing/mark_seen của người khác"""
+
+    async def run():
+        dispatcher = FakeDispatcher(concurrency=1)
+        # Worker đầu tiên chỉ chạy khi event loop được nhường
+        dispatcher.send_action("guest-1", "mark_seen")
+        dispatcher.send_action("guest-2", "typing_on")
+        reply = dispatcher.send_message("guest-3", {"text": "hello"})
+        await reply
+        await asyncio.sleep(0.01)
+        await dispatcher.close()
+        return dispatcher
+
+    dispatcher = asyncio.run(run())
+    assert _describe(dispatcher.sent[0]) == ("guest-3", "hello")
+    assert len(dispatcher.sent) == 3
+
+
+def test_typing_actions_are_coalesced():
+    """Test typing action chưa gửi được gộp hoặc bỏ khi có tin trả lời"""
+
+    async def run():
+        dispatcher = FakeDispatcher(concurrency=1)
+        dispatcher.send_action("guest-1", "mark_seen")
+        typing_on = dispatcher.send_action("guest-1", "typing_on")
+        typing_off = dispatcher.send_action("guest-1", "typing_off")
+        reply = dispatcher.send_message("guest-1", {"text": "hello"})
+        await reply
+        await asyncio.sleep(0.01)
+        await dispatcher.close()
+        return dispatcher, typing_on, typing_off
+
+    dispatcher, typing_on, typing_off = asyncio.run(run())
+    assert typing_on is typing_off
+    assert [_describe(p) for p in dispatcher.sent] == [
+        ("guest-1", "mark_seen"),
+        ("guest-1", "hello"),
+    ]
+    metrics = dispatcher.get_metrics()
+    assert metrics["coalesced"] == 1
+    assert metrics["dropped"] == 1
+
+
+def test_reply_is_sent_after_dropping_parked_typing_action():
+    """Test bỏ typing action đang đợi token của người nhận không làm kẹt lane"""
+
+    async def run():
+        dispatcher = FakeDispatcher(concurrency=1, recipient_rate=20, recipient_burst=1)
+        await dispatcher.send_action("guest-1", "mark_seen")
+        typing_on = dispatcher.send_action("guest-1", "typing_on")
+        # Worker lấy typing_on ra và hẹn giờ đưa lại vào hàng đợi
+        await asyncio.sleep(0.01)
+        reply = dispatcher.send_message("guest-1", {"text": "hello"})
+        sent = await asyncio.wait_for(reply, timeout=1)
+        await dispatcher.close()
+        return dispatcher, typing_on, sent
+
+    dispatcher, typing_on, sent = asyncio.run(run())
+    assert sent is True
+    assert typing_on.result() is True
+    assert [_describe(p)[1] for p in dispatcher.sent] == ["mark_seen", "hello"]
+    assert dispatcher.get_metrics()["queued"] == 0
+
+
+def test_retry_honours_retry_after():
+    """Test request bị 429 được retry trong dispatcher theo Retry-After"""
+
+    async def run():
+        dispatcher = FakeDispatcher(
+            responses=[(429, {"Retry-After": "0.05"}, {"error": {"code": 613}})],
+        )
+        result = await dispatcher.send_message("guest-1", {"text": "hello"})
+        await dispatcher.close()
+        return dispatcher, result
+
+    dispatcher, result = asyncio.run(run())
+    assert result is True
+    assert len(dispatcher.sent) == 2
+    metrics = dispatcher.get_metrics()
+    assert metrics["retried"] == 1
+    assert metrics["throttled"] == 1
+    assert metrics["sent"] == 1
+
+
+def test_client_error_is_not_retried():
+    """Test lỗi 400 không phải rate limit thì không retry"""
+
+    async def run():
+        dispatcher = FakeDispatcher(responses=[(400, {}, {"error": {"code": 100}})])
+        result = await dispatcher.send_message("guest-1", {"text": "hello"})
+        await dispatcher.close()
+        return dispatcher, result
+
+    dispatcher, result = asyncio.run(run())
+    assert result is False
+    assert len(dispatcher.sent) == 1
+
+
+def test_parse_usage_headers():
+    """Test đọc usage header của Graph API"""
+    headers = {
+        "X-App-Usage": '{"call_count": 42, "total_time": 10, "total_cputime": 5}',
+        "X-Business-Use-Case-Usage": '{"123": [{"type": "messenger", "call_count": 95,'
+        ' "total_time": 3, "total_cputime": 1, "estimated_time_to_regain_access": 2}]}',
+    }
+    assert parse_usage_headers(headers) == (95.0, 120.0)
+    assert parse_usage_headers({}) == (0.0, 0.0)
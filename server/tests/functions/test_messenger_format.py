@@ -0,0 +1,80 @@
+"""
+Test file for messenger_format.py - so sánh với cách chuyển đổi bằng regex cũ
+trên markdown ngẫu nhiên
+"""
+
+import random
+import re
+
+import pytest
+from app.utils.messenger_format import markdown_to_messenger, messenger_to_markdown
+
+TOKENS = [
+    "#", "##", "#######", " ", "  ", "\t", "\r", "\xa0", "\n", "\n\n",
+    "*", "**", "***", "-", "~", "~~", "_", "__", "•",
+    "a", "Đẹp", "b c", "5", "1.5", "<", ">", "<bold>", "</bold>",
+    "<heading>", "</heading>",
+]  # fmt: skip
+
+
+def legacy_markdown_to_messenger(text):
+    text = re.sub(
+        r"^#{1,6}\s+(.*?)$", r"<heading>\1</heading>", text, flags=re.MULTILINE
+    )
+    text = re.sub(r"\*\*(.*?)\*\*", r"<bold>\1</bold>", text)
+    text = re.sub(r"^(\s*)[\*\-]\s+(\S.*?)$", r"\1• \2", text, flags=re.MULTILINE)
+
+    def replace_heading(match):
+        content = match.group(1)
+        if "<bold>" in content and "</bold>" in content:
+            return "*" + re.sub(r"<bold>(.*?)</bold>", r"*\1*", content) + "*"
+        return f"*{content}*"
+
+    text = re.sub(r"<heading>(.*?)</heading>", replace_heading, text)
+    text = re.sub(r"<bold>(.*?)</bold>", r"*\1*", text)
+    return re.sub(r"~~(.*?)~~", r"~\1~", text)
+
+
+def legacy_messenger_to_markdown(text):
+    def bold_replacer(match):
+        if any(c.isalpha() for c in match.group(1)):
+            return f"**{match.group(1)}**"
+        return match.group(0)
+
+    text = re.sub(r"(?<!\*)\*([^\s*](?:[^*]*[^\s*])?)\*(?!\*)", bold_replacer, text)
+    text = re.sub(r"(?<!_)_([^_]+)_(?!_)", r"*\1*", text)
+    return re.sub(r"^(\s*)•\s+", r"\1* ", text, flags=re.MULTILINE)
+
+
+def _random_texts(seed, count=20000):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(TOKENS) for _ in range(rng.randint(0, 20)))
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_markdown_to_messenger_matches_legacy(seed):
+    """Test output giống hệt cách chuyển đổi bằng regex cũ"""
+    for text in _random_texts(seed):
+        assert markdown_to_messenger(text) == legacy_markdown_to_messenger(text), text
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_messenger_to_markdown_matches_legacy(seed):
+    """Test output giống hệt cách chuyển đổi bằng regex cũ"""
+    for text in _random_texts(seed):
+        assert messenger_to_markdown(text) == legacy_messenger_to_markdown(text), text
+
+
+def test_markdown_to_messenger_formats():
+    """Test heading, bold, list và gạch ngang"""
+    text = "## Liệu trình **A**\n* **Giá:** 500.000đ\n  - ~~700.000đ~~\n-\n\nGhi chú"
+    assert markdown_to_messenger(text) == (
+        "*Liệu trình *A**\n• *Giá:* 500.000đ\n  • ~700.000đ~\n• Ghi chú"
+    )
+
+
+def test_messenger_to_markdown_keeps_multiplication():
+    """Test *chữ* thành bold nhưng 5*10*2 giữ nguyên"""
+    text = "Giá *combo* là 5*10*2 _nghìn_\n• buổi 1"
+    assert messenger_to_markdown(text) == "Giá **combo** là 5*10*2 *nghìn*\n* buổi 1"
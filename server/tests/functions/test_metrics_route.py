@@ -0,0 +1,29 @@
+"""
+Test file for route_metrics.py - snapshot các metrics trong process
+"""
+
+from app.routes.v1.route_metrics import router
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+
+def test_metrics_route_exposes_all_collectors():
+    app = FastAPI()
+    app.include_router(router)
+
+    response = TestClient(app).get("/v1/metrics")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {
+        "messenger_dispatcher",
+        "outbox",
+        "db_leases",
+        "conversation_cache",
+        "agent_query_cache",
+        "tool_template_cache",
+        "agent",
+        "chat_history_migration",
+    }
+    assert "queued" in body["messenger_dispatcher"]
+    assert "fallback_errors" in body["agent"]
@@ -0,0 +1,103 @@
+"""
+Test file for notification_service - catalogue version tăng sau khi notification
+thay đổi để synthetic agent build lại notify tools
+"""
+
+import asyncio
+
+import pytest
+from app.services import notification_service
+from fastapi import HTTPException
+
+
+class FakeSession:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    async def commit(self):
+        if self.fail:
+            raise RuntimeError("commit failed")
+
+
+def test_delete_bumps_catalogue_version(monkeypatch):
+    async def delete_notification(db, notification_id):
+        pass
+
+    monkeypatch.setattr(
+        notification_service.notification_repository,
+        "delete_notification",
+        delete_notification,
+    )
+    version = notification_service.get_catalogue_version()
+    asyncio.run(notification_service.delete_notification(FakeSession(), "n1"))
+    assert notification_service.get_catalogue_version() == version + 1
+
+
+def test_failed_delete_keeps_catalogue_version(monkeypatch):
+    async def delete_notification(db, notification_id):
+        pass
+
+    monkeypatch.setattr(
+        notification_service.notification_repository,
+        "delete_notification",
+        delete_notification,
+    )
+    version = notification_service.get_catalogue_version()
+    with pytest.raises(HTTPException):
+        asyncio.run(
+            notification_service.delete_notification(FakeSession(fail=True), "n1")
+        )
+    assert notification_service.get_catalogue_version() == version
+
+
+def test_invalid_content_template_is_rejected_on_save(monkeypatch):
+    async def insert_notification(db, notification):
+        raise AssertionError("invalid notification must not be inserted")
+
+    monkeypatch.setattr(
+        notification_service.notification_repository,
+        "insert_notification",
+        insert_notification,
+    )
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(
+            notification_service.insert_notification(
+                FakeSession(), {"label": "Đặt lịch", "content": "Khách {{ name }"}
+            )
+        )
+    assert error.value.status_code == 400
+
+
+def test_insert_bumps_catalogue_version_after_commit(monkeypatch):
+    async def insert_notification(db, notification):
+        notification.id = "n2"
+
+    monkeypatch.setattr(
+        notification_service.notification_repository,
+        "insert_notification",
+        insert_notification,
+    )
+    version = notification_service.get_catalogue_version()
+    versions_at_commit = []
+
+    class RecordingSession(FakeSession):
+        async def commit(self):
+            versions_at_commit.append(notification_service.get_catalogue_version())
+            await super().commit()
+
+    asyncio.run(
+        notification_service.insert_notification(
+            RecordingSession(), {"label": "Đặt lịch", "content": "Khách {{ name }}"}
+        )
+    )
+    # Version chưa đổi lúc commit, agent build trong lúc đó không bị cache nhầm
+    assert versions_at_commit == [version]
+    assert notification_service.get_catalogue_version() == version + 1
+
+    with pytest.raises(HTTPException):
+        asyncio.run(
+            notification_service.insert_notification(
+                FakeSession(fail=True), {"label": "Đặt lịch", "content": "Xin chào"}
+            )
+        )
+    assert notification_service.get_catalogue_version() == version + 1
@@ -0,0 +1,149 @@
+"""
+Test file for outbox_service.py - gửi reply của agent từ outbox
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
+
+from app.configs.constants import OUTBOX_STATUS
+from app.models import OutboxMessage
+from app.services.integrations import outbox_service
+from app.services.integrations.messenger_dispatcher import MessengerDispatcher
+
+
+class FakeDispatcher(MessengerDispatcher):
+    """Dispatcher ghi lại payload, trả về lỗi 400 cho text nằm trong fail_texts"""
+
+    def __init__(self, fail_texts=(), **kwargs):
+        super().__init__(recipient_burst=20, **kwargs)
+        self.sent = []
+        self.fail_texts = set(fail_texts)
+
+    async def post(self, payload):
+        await asyncio.sleep(0)
+        text = payload.get("message", {}).get("text")
+        if text in self.fail_texts:
+            return 400, {}, {"error": {"code": 100}}
+        self.sent.append(payload)
+        return 200, {}, {}
+
+
+class FakeOutboxRepository:
+    """outbox_repository trong bộ nhớ"""
+
+    def __init__(self, messages):
+        self.messages = {message.id: message for message in messages}
+
+    async def claim_messages(self, db, recipient_id, now):
+        claimed = []
+        for message in sorted(
+            self.messages.values(), key=lambda m: (m.created_at, m.sequence)
+        ):
+            if message.recipient_id != recipient_id or message.status not in (
+                OUTBOX_STATUS.PENDING.value,
+                OUTBOX_STATUS.SENDING.value,
+            ):
+                continue
+            if (
+                message.status != OUTBOX_STATUS.PENDING.value
+                or message.available_at > now
+            ):
+                break
+            message.status = OUTBOX_STATUS.SENDING.value
+            claimed.append(message)
+        return claimed
+
+    async def mark_delivered(self, db, message_id, delivered_at):
+        message = self.messages[message_id]
+        message.status = OUTBOX_STATUS.DELIVERED.value
+        message.attempts += 1
+        message.delivered_at = delivered_at
+
+    async def mark_undelivered(self, db, message_id, status, available_at, error):
+        message = self.messages[message_id]
+        message.status = status
+        message.attempts += 1
+        message.available_at = available_at
+
+    async def release_messages(self, db, message_ids):
+        for message_id in message_ids:
+            self.messages[message_id].status = OUTBOX_STATUS.PENDING.value
+
+
+def _outbox_messages(texts, recipient_id="guest-1"):
+    now = datetime.now()
+    return [
+        OutboxMessage(
+            id=f"{recipient_id}-{i}",
+            guest_id=recipient_id,
+            recipient_id=recipient_id,
+            sequence=i,
+            payload={"text": text},
+            delay_before=0.01 if i else 0,
+            status=OUTBOX_STATUS.PENDING.value,
+            attempts=0,
+            available_at=now,
+            created_at=now + timedelta(microseconds=i),
+        )
+        for i, text in enumerate(texts)
+    ]
+
+
+def _deliver(repository, dispatcher, recipient_id="guest-1"):
+    async def run():
+        try:
+            await outbox_service.deliver_recipient(recipient_id)
+        finally:
+            await dispatcher.close()
+
+    with patch.object(outbox_service, "outbox_repository", repository), patch.object(
+        outbox_service, "dispatcher", dispatcher
+    ), patch.object(
+        outbox_service, "with_session", new=lambda func: func(None)
+    ), patch.object(
+        outbox_service, "_notify_inbox", AsyncMock()
+    ):
+        asyncio.run(run())
+
+
+def test_delivers_parts_in_order_with_typing():
+    """Test các part được gửi đúng thứ tự, có typing giữa các part"""
+    repository = FakeOutboxRepository(_outbox_messages(["a", "b", "c"]))
+    dispatcher = FakeDispatcher()
+    _deliver(repository, dispatcher)
+
+    texts = [p["message"]["text"] for p in dispatcher.sent if "message" in p]
+    assert texts == ["a", "b", "c"]
+    assert any(p.get("sender_action") == "typing_on" for p in dispatcher.sent)
+    assert all(
+        m.status == OUTBOX_STATUS.DELIVERED.value for m in repository.messages.values()
+    )
+
+
+def test_failed_part_blocks_later_parts_until_retry():
+    """Test part lỗi được hẹn retry, các part sau chờ để không bị lệch thứ tự"""
+    repository = FakeOutboxRepository(_outbox_messages(["a", "b", "c"]))
+    dispatcher = FakeDispatcher(fail_texts={"b"})
+    _deliver(repository, dispatcher)
+
+    first, second, third = (repository.messages[f"guest-1-{i}"] for i in range(3))
+    assert first.status == OUTBOX_STATUS.DELIVERED.value
+    assert second.status == OUTBOX_STATUS.PENDING.value
+    assert second.attempts == 1
+    assert second.available_at > datetime.now()
+    assert third.status == OUTBOX_STATUS.PENDING.value
+    assert third.attempts == 0
+
+
+def test_part_fails_after_max_attempts():
+    """Test part lỗi quá MAX_DELIVERY_ATTEMPTS bị đánh dấu failed, part sau vẫn gửi"""
+    messages = _outbox_messages(["a", "b"])
+    messages[0].attempts = outbox_service.MAX_DELIVERY_ATTEMPTS - 1
+    repository = FakeOutboxRepository(messages)
+    dispatcher = FakeDispatcher(fail_texts={"a"})
+    _deliver(repository, dispatcher)
+
+    assert repository.messages["guest-1-0"].status == OUTBOX_STATUS.FAILED.value
+    # Lần claim tiếp theo trong cùng task gửi part còn lại
+    assert repository.messages["guest-1-1"].status == OUTBOX_STATUS.DELIVERED.value
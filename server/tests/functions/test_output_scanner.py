@@ -0,0 +1,85 @@
+"""
+Test file for output_scanner.py - quét output của agent một lượt
+"""
+
+import re
+
+import pytest
+from app.utils.agent_utils import DANGEROUS_XML_TAGS, contains_xml_tags
+from app.utils.output_scanner import OutputScanner, SafetyPolicy
+
+# 32 pattern của contains_xml_tags trước đây
+LEGACY_PATTERNS = [rf"<{tag}\s*[^>]*>" for tag in DANGEROUS_XML_TAGS] + [
+    rf"</{tag}\s*>" for tag in DANGEROUS_XML_TAGS
+]
+
+SCANNER = OutputScanner(
+    [
+        SafetyPolicy("xml_tag", (r"</?(?:sheet|row)[^>]*>",)),
+        SafetyPolicy.from_terms("table_name", ["sheet_abc", "sheet_abc_2"]),
+        SafetyPolicy("customer_id", (r"KH-\d{4}",), ignore_case=False),
+    ],
+    max_match_length=20,
+)
+
+
+def _legacy_contains(output):
+    return any(re.search(p, output, flags=re.IGNORECASE) for p in LEGACY_PATTERNS)
+
+
+@pytest.mark.parametrize(
+    "output",
+    [
+        "Chào chị, bên em có liệu trình A ạ",
+        "<sheet name='x'>",
+        "</ROWS >",
+        "<Data>",
+        "<database>",
+        "</sheetx>",
+        "a < b và c > d",
+        "<b>in đậm</b>",
+        "<sample_data\n>",
+        "",
+    ],
+)
+def test_contains_xml_tags_matches_legacy_patterns(output):
+    """Test contains_xml_tags cho kết quả giống 32 pattern cũ"""
+    assert contains_xml_tags(output) == _legacy_contains(output)
+
+
+def test_scan_returns_positions_and_redacts():
+    """Test trả về vị trí từng đoạn vi phạm theo policy và redact được"""
+    text = "Bảng sheet_abc_2 <row>khách KH-1234, kh-5678</row>"
+    matches = SCANNER.scan(text)
+
+    assert [(m.policy, m.text) for m in matches] == [
+        ("table_name", "sheet_abc_2"),
+        ("xml_tag", "<row>"),
+        ("customer_id", "KH-1234"),
+        ("xml_tag", "</row>"),
+    ]
+    assert all(text[m.start : m.end] == m.text for m in matches)
+    assert SCANNER.redact(text, "[***]") == "Bảng [***] [***]khách [***], kh-5678[***]"
+
+
+@pytest.mark.parametrize("step", [1, 2, 5, 13])
+def test_incremental_scan_matches_full_scan(step):
+    """Test feed từng chunk cho cùng kết quả với quét cả output, kể cả match bị cắt"""
+    text = "Xem sheet_abc_2 nhé <sheet id=1>KH-1234</sheet> và sheet_abc " * 3
+    scan = SCANNER.stream()
+    for i in range(0, len(text), step):
+        scan.feed(text[i : i + step])
+        # Match đã chốt không thay đổi khi có thêm output
+        assert scan.matches == SCANNER.scan(text)[: len(scan.matches)]
+    scan.finish()
+
+    assert scan.matches == SCANNER.scan(text)
+
+
+def test_incremental_scan_flags_match_at_end_of_chunk():
+    """Test match ở cuối chunk được báo ngay qua violated dù chưa chốt vị trí"""
+    scan = SCANNER.stream()
+    assert scan.feed("Dữ liệu: <sheet") == []
+    assert not scan.violated
+    scan.feed(">")
+    assert scan.violated
@@ -0,0 +1,66 @@
+"""
+Test file for prompt_assembler.py - ghép prompt của agent trong giới hạn token
+"""
+
+from app.utils.prompt_assembler import (
+    PromptAssembler,
+    PromptItem,
+    PromptSection,
+    TokenEstimator,
+)
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+
+def _items(prefix, tokens):
+    return [PromptItem(f"{prefix}{i}", t) for i, t in enumerate(tokens)]
+
+
+def test_section_budget_keeps_leading_items():
+    prompt = PromptAssembler(total_budget=1000).assemble(
+        [PromptSection("history", _items("turn", [40, 40, 40]), budget=100)]
+    )
+    assert prompt.values("history") == ["turn0", "turn1"]
+    assert prompt.breakdown["history"] == {
+        "tokens": 80,
+        "items": 2,
+        "dropped_items": 1,
+        "dropped_tokens": 40,
+    }
+
+
+def test_total_budget_trims_lowest_priority_first():
+    sections = [
+        PromptSection("instructions", _items("i", [50]), priority=5, min_items=1),
+        PromptSection("scripts", _items("script", [30, 20, 10]), priority=1),
+        PromptSection("history", _items("turn", [40, 30, 20]), priority=0),
+    ]
+    prompt = PromptAssembler(total_budget=100).assemble(sections)
+
+    # History (priority thấp nhất) bị cắt hết trước khi đụng đến scripts
+    assert prompt.values("history") == []
+    assert prompt.values("scripts") == ["script0", "script1"]
+    assert prompt.values("instructions") == ["i0"]
+    assert prompt.total_tokens == 100
+
+
+def test_min_items_are_never_dropped():
+    sections = [
+        PromptSection("summary", _items("s", [500]), budget=100, min_items=1),
+        PromptSection("history", _items("turn", [10]), priority=1),
+    ]
+    prompt = PromptAssembler(total_budget=50).assemble(sections)
+    assert prompt.values("summary") == ["s0"]
+    assert prompt.values("history") == []
+    assert prompt.total_tokens == 500
+
+
+def test_token_estimator_without_tokenizer():
+    estimator = TokenEstimator(tokenizer_path="/không/tồn/tại/tokenizer.json")
+    messages = [
+        ModelRequest(parts=[UserPromptPart(content="a" * 40)]),
+        ModelResponse(parts=[TextPart(content="b" * 8)]),
+    ]
+    assert not estimator.uses_tokenizer
+    assert estimator.count("") == 0
+    assert estimator.count("x" * 9) == 3
+    assert estimator.count_messages(messages) == 12
@@ -0,0 +1,87 @@
+"""
+Test file for qdrant.py - ensure_collection với vector Matryoshka (client giả lập)
+"""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from app.configs import env_config
+from app.services.clients import qdrant
+from qdrant_client.models import HnswConfigDiff, VectorParams
+
+
+def _client(vectors: dict) -> MagicMock:
+    client = MagicMock()
+    client.collection_exists = AsyncMock(return_value=True)
+    client.get_collection = AsyncMock(
+        return_value=SimpleNamespace(
+            config=SimpleNamespace(
+                params=SimpleNamespace(vectors=vectors),
+                hnsw_config=SimpleNamespace(
+                    m=env_config.QDRANT_HNSW_M,
+                    ef_construct=env_config.QDRANT_HNSW_EF_CONSTRUCT,
+                ),
+                quantization_config=qdrant.get_quantization_config(),
+            ),
+            payload_schema=dict(qdrant.SHEET_PAYLOAD_INDEXES),
+        )
+    )
+    client.update_collection = AsyncMock()
+    return client
+
+
+def _jina(m: int | None) -> VectorParams:
+    return VectorParams(
+        size=qdrant.DENSE_VECTOR_SIZE,
+        distance="Cosine",
+        on_disk=env_config.QDRANT_ON_DISK_VECTORS,
+        hnsw_config=HnswConfigDiff(m=m) if m is not None else None,
+    )
+
+
+def _ensure(client: MagicMock, name: str):
+    asyncio.run(qdrant.ensure_collection(client, name, qdrant.SHEET_PAYLOAD_INDEXES))
+
+
+def test_mrl_collection_keeps_jina_without_graph():
+    vectors = {"jina": _jina(0), qdrant.MRL_VECTOR_NAME: _jina(None)}
+    client = _client(vectors)
+
+    _ensure(client, "mrl")
+
+    client.update_collection.assert_not_awaited()
+    assert "mrl" in qdrant._mrl_collections
+
+
+def test_jina_graph_is_restored_when_mrl_vector_is_missing():
+    """Test QDRANT_MRL_DIMENSIONS đổi: build lại graph HNSW của jina, không full scan"""
+    client = _client({"jina": _jina(0), "jina_64": _jina(None)})
+    qdrant._mrl_collections.add("changed")
+
+    _ensure(client, "changed")
+
+    jina_diff = client.update_collection.await_args.kwargs["vectors_config"]["jina"]
+    assert jina_diff.hnsw_config.m == env_config.QDRANT_HNSW_M
+    assert jina_diff.hnsw_config.ef_construct == env_config.QDRANT_HNSW_EF_CONSTRUCT
+    assert "changed" not in qdrant._mrl_collections
+
+
+def test_restored_jina_graph_is_not_used_as_mrl_again():
+    jina = _jina(env_config.QDRANT_HNSW_M)
+    jina.hnsw_config.ef_construct = env_config.QDRANT_HNSW_EF_CONSTRUCT
+    client = _client({"jina": jina, qdrant.MRL_VECTOR_NAME: _jina(None)})
+
+    _ensure(client, "restored")
+
+    client.update_collection.assert_not_awaited()
+    assert "restored" not in qdrant._mrl_collections
+
+
+def test_legacy_collection_is_unchanged():
+    client = _client({"jina": _jina(None)})
+
+    _ensure(client, "legacy")
+
+    client.update_collection.assert_not_awaited()
+    assert "legacy" not in qdrant._mrl_collections
@@ -0,0 +1,118 @@
+"""
+Test file for fallback của execute_query_on_sheet_rows - nới điều kiện PGroonga
+và metrics số request LLM mỗi lượt
+"""
+
+import asyncio
+import contextvars
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from app.pydantic_agents import synthetic_tools
+from app.utils.agent_metrics import AgentMetrics, agent_metrics
+from app.utils.agent_utils import pgroonga_keywords, relax_pgroonga_query
+from app.utils.sheet_index import SheetIndex
+
+QUERY = (
+    'SELECT "ten", "gia" FROM "bang_gia" '
+    'WHERE ("ten" &@~ \'"tàn nhang" "nám"\') AND ("mo_ta" &@~ \'"trị mụn"\')'
+)
+
+
+def test_relax_pgroonga_query_uses_or():
+    relaxed = relax_pgroonga_query(QUERY)
+    assert '&@~ \'"tàn nhang" OR "nám"\'' in relaxed
+    # Một cụm từ duy nhất được tách thành các từ
+    assert '&@~ \'"trị" OR "mụn"\'' in relaxed
+    assert relaxed.startswith('SELECT "ten", "gia" FROM "bang_gia"')
+
+
+def test_relax_pgroonga_query_unchanged():
+    or_query = 'SELECT * FROM t WHERE (c &@~ \'"a" OR "b"\')'
+    assert relax_pgroonga_query(or_query) is None
+    assert relax_pgroonga_query("SELECT * FROM t WHERE (c &@~ '\"nám\"')") is None
+    assert relax_pgroonga_query('SELECT * FROM "t" WHERE "gia" > 100') is None
+
+
+def test_pgroonga_keywords():
+    assert pgroonga_keywords(QUERY) == ["tàn nhang", "nám", "trị mụn"]
+    assert pgroonga_keywords("SELECT * FROM t WHERE c &@~ '\"Mai''s\" OR -đắt'") == [
+        "Mai's"
+    ]
+
+
+def test_agent_metrics():
+    metrics = AgentMetrics()
+    for requests in (1, 2, 2, 3):
+        metrics.observe_turn(requests)
+    metrics.observe_fallback("or_mode", True)
+    metrics.observe_fallback("hybrid", False)
+
+    result = metrics.get_metrics()
+    assert result["llm_requests_per_turn"] == 2
+    assert result["requests_per_turn_histogram"] == {1: 1, 2: 2, 3: 1}
+    assert result["fallback_hits"] == {"or_mode": 1}
+    assert result["fallback_runs"] == {"or_mode": 1, "hybrid": 1}
+
+
+SHEET_INDEX = SheetIndex(
+    [SimpleNamespace(id="sheet-1", table_name="bang_gia", name="Bảng giá")]
+)
+
+
+def _execute(query, run_sheet_query):
+    with patch.object(
+        synthetic_tools, "with_session", AsyncMock(return_value=SHEET_INDEX)
+    ), patch.object(
+        synthetic_tools, "run_sheet_query", AsyncMock(side_effect=run_sheet_query)
+    ), patch.object(
+        synthetic_tools.sheet_rag_service,
+        "search_rows_by_sheet_id",
+        AsyncMock(side_effect=ConnectionError("qdrant unavailable")),
+    ):
+        return asyncio.run(synthetic_tools.execute_query_on_sheet_rows(query))
+
+
+def test_fallback_error_keeps_other_steps():
+    query = 'SELECT "ten" FROM "bang_gia" WHERE ("ten" &@~ \'"kem" "nám"\')'
+    results = iter([([], [], False), (["ten"], ["Kem nám"], False)])
+    errors = agent_metrics.fallback_errors["hybrid"]
+
+    content = _execute(query, lambda sql: next(results))
+
+    assert "Kem nám" in content
+    assert "hybrid search" not in content
+    assert agent_metrics.fallback_errors["hybrid"] == errors + 1
+
+
+def test_fallback_errors_fall_through_to_no_data():
+    query = 'SELECT "ten" FROM "bang_gia" WHERE ("ten" &@~ \'"mụn" "thâm"\')'
+    calls = []
+
+    def run_sheet_query(sql):
+        calls.append(sql)
+        if len(calls) > 1:
+            raise TimeoutError("canceling statement due to statement timeout")
+        return [], [], False
+
+    # Query gốc hợp lệ nhưng không có dòng nào: không ModelRetry dù fallback lỗi
+    content = _execute(query, run_sheet_query)
+
+    assert content.startswith("No data found.")
+    assert len(calls) == 2
+
+
+def test_output_scanner_covers_result_columns_of_the_turn():
+    """Test scanner của lượt phát hiện header của kết quả query vừa trả cho model"""
+
+    def turn():
+        synthetic_tools.query_result_columns.set([])
+        synthetic_tools.record_result_columns(["service_name", "price"])
+        return synthetic_tools.get_output_scanner()
+
+    header = synthetic_tools.result_encoder.header(["service_name", "price"])
+    scanner = contextvars.copy_context().run(turn)
+    assert scanner.contains(f"Dữ liệu:\n{header}") == (header is not None)
+    assert scanner.contains("<row>")
+    # Ngoài lượt agent (chưa có kết quả query) chỉ dùng scanner thẻ XML
+    assert synthetic_tools.get_output_scanner() is synthetic_tools.output_scanner
@@ -0,0 +1,63 @@
+"""
+Test file for query_result_cache.py - cache kết quả SQL của agent
+"""
+
+from app.services import sheet_service
+from app.utils.query_result_cache import (
+    QueryResultCache,
+    canonicalize_sql,
+    is_cacheable_sql,
+    referenced_tables,
+)
+
+TABLE = "3f2b6c1e_8a4d_4e0b_9c5f_1d2e3f4a5b6c"
+
+
+def test_canonicalize_sql():
+    first = f'select "gia"  from "{TABLE}"\n where ("ten" &@~ \'"Gội đầu"\');'
+    second = f'SELECT "gia" FROM "{TABLE}" -- giá\nWHERE ("ten" &@~ \'"Gội đầu"\')'
+    assert canonicalize_sql(first) == canonicalize_sql(second)
+    assert "Gội đầu" in canonicalize_sql(first)
+
+
+def test_volatile_and_referenced_tables():
+    assert is_cacheable_sql(f'SELECT * FROM "{TABLE}"')
+    assert not is_cacheable_sql(f'SELECT * FROM "{TABLE}" WHERE "ngay" > NOW()')
+    assert not is_cacheable_sql("SELECT current_date")
+    assert referenced_tables(f'SELECT * FROM "{TABLE}"', [TABLE, "other"]) == [TABLE]
+
+
+def test_cache_hit_and_table_version():
+    cache = QueryResultCache(max_bytes=1000, ttl_seconds=60)
+    query = f'SELECT * FROM "{TABLE}"'
+    key = cache.make_key(query, {TABLE: 0})
+
+    assert cache.get(key) is None
+    cache.put(key, "<row><gia>500000</gia></row>")
+    assert cache.get(cache.make_key(query.lower(), {TABLE: 0})) is not None
+    assert cache.get(cache.make_key(query, {TABLE: 1})) is None
+    assert cache.get_metrics()["hit_ratio"] == 1 / 3
+
+    cache.invalidate_table(TABLE)
+    assert cache.get(key) is None
+    assert cache.get_metrics()["bytes"] == 0
+
+
+def test_cache_is_bounded_by_bytes():
+    cache = QueryResultCache(max_bytes=100, ttl_seconds=60)
+    for i in range(5):
+        cache.put(cache.make_key(f"SELECT {i}", {TABLE: 0}), "x" * 40)
+    metrics = cache.get_metrics()
+    assert metrics["entries"] == 2
+    assert metrics["bytes"] <= 100
+    assert metrics["evictions"] == 3
+    assert cache.get(cache.make_key("SELECT 4", {TABLE: 0})) == "x" * 40
+
+    cache.put(cache.make_key("SELECT 5", {TABLE: 0}), "x" * 200)
+    assert cache.get(cache.make_key("SELECT 5", {TABLE: 0})) is None
+
+
+def test_invalidate_table_bumps_version():
+    versions = sheet_service.get_table_versions([TABLE])
+    sheet_service.invalidate_table(TABLE)
+    assert sheet_service.get_table_versions([TABLE])[TABLE] == versions[TABLE] + 1
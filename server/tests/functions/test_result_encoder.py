@@ -0,0 +1,102 @@
+"""
+Test file for result_encoder.py - định dạng kết quả query sheet cho model
+"""
+
+import json
+import xml.etree.ElementTree as ET
+from decimal import Decimal
+
+import pytest
+from app.utils.output_scanner import OutputScanner
+from app.utils.result_encoder import ResultEncoder, get_result_encoder
+
+ROWS = [
+    {"ten": "Gội đầu <dưỡng sinh>", "gia": Decimal("150000"), "ghi_chu": None},
+    {"ten": "Massage\tđá nóng", "gia": Decimal("450000"), "ghi_chu": "Dòng 1\nDòng 2"},
+]
+
+
+def test_xml_matches_element_tree_output():
+    rows = [{"ten": "Gội đầu <dưỡng sinh> & tẩy tế bào", "gia": Decimal("150000")}]
+    element = ET.Element("row")
+    for key, value in rows[0].items():
+        ET.SubElement(element, key).text = str(value)
+    assert get_result_encoder("xml").encode(rows) == ET.tostring(
+        element, encoding="unicode"
+    )
+
+
+def test_tsv_has_single_header_and_one_line_per_row():
+    lines = get_result_encoder("tsv").encode(ROWS).split("\n")
+    assert lines[0] == "ten\tgia\tghi_chu"
+    assert len(lines) == 3
+    assert lines[2] == "Massage đá nóng\t450000\tDòng 1\\nDòng 2"
+    assert lines[1].endswith("\t150000\t")
+
+
+def test_json_arrays():
+    lines = get_result_encoder("json").encode(ROWS).split("\n")
+    assert json.loads(lines[0]) == ["ten", "gia", "ghi_chu"]
+    assert json.loads(lines[1]) == ["Gội đầu <dưỡng sinh>", "150000", None]
+
+
+def test_long_cells_are_truncated_in_every_format():
+    rows = [{"mo_ta": "a" * 50}]
+    for name in ("xml", "tsv", "json"):
+        content = get_result_encoder(name, max_cell_chars=10).encode(rows)
+        assert "a" * 10 + "..." in content
+        assert "a" * 11 not in content
+
+
+def test_unknown_format_falls_back_to_xml():
+    assert get_result_encoder("yaml").name == "xml"
+
+
+def test_encoder_must_implement_row():
+    class HeaderOnlyEncoder(ResultEncoder):
+        name = "header_only"
+
+    with pytest.raises(TypeError):
+        HeaderOnlyEncoder()
+
+
+@pytest.mark.parametrize("name", ["tsv", "json"])
+@pytest.mark.parametrize(
+    "rows",
+    [
+        [{"service_name": "Trị mụn"}],
+        [{"service_name": "Trị mụn", "price": 500000}],
+        [{"ten": "Gội đầu", "gia": 150000, "ghi_chu": None}],
+    ],
+)
+def test_leak_policy_detects_encoded_result(name, rows):
+    """Test output chép lại header hoặc dòng kết quả (1, 2, 3 cột) bị phát hiện"""
+    encoder = get_result_encoder(name)
+    scanner = OutputScanner([encoder.leak_policy([list(rows[0].keys())])])
+    header, row = encoder.encode(rows).split("\n")
+
+    assert scanner.contains(f"Dữ liệu của bên em:\n{header}\n{row}")
+    assert scanner.contains(f"Dữ liệu của bên em:\n{header}")
+    if len(rows[0]) > 1:
+        assert scanner.contains(f"Dữ liệu của bên em:\n{row}\nạ")
+
+
+@pytest.mark.parametrize("name", ["tsv", "json"])
+@pytest.mark.parametrize(
+    "output",
+    [
+        "Các gói: [1,2,3] ạ",
+        '["Gội đầu", "Massage"]',
+        "Giá trị mụn là 500.000đ\tạ",
+        "service_name của bên em là Trị mụn ạ",
+    ],
+)
+def test_leak_policy_allows_normal_replies(name, output):
+    """Test câu trả lời bình thường không bị nhận nhầm là kết quả query"""
+    encoder = get_result_encoder(name)
+    scanner = OutputScanner([encoder.leak_policy([["service_name", "price", "note"]])])
+    assert not scanner.contains(output)
+
+
+def test_xml_leak_is_left_to_xml_tag_policy():
+    assert get_result_encoder("xml").leak_policy([["ten", "gia"]]).patterns == ()
@@ -0,0 +1,83 @@
+"""
+Test file for script_context.py - chỉ gửi lại script chưa có trong history
+"""
+
+from types import SimpleNamespace
+
+from app.services import script_service
+from app.utils.conversation_cache import MemoryTurn
+from app.utils.script_context import (
+    SCRIPT_CONTEXT_PREFIX,
+    build_script_entries,
+    extract_script_versions,
+    missing_references,
+    script_version,
+    seen_script_versions,
+)
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+
+def _script(script_id, solution="Giá 500.000đ"):
+    return SimpleNamespace(
+        id=script_id,
+        description="Giá bao nhiêu?\nCó ưu đãi không?",
+        solution=solution,
+    )
+
+
+def _carrier_turn(*scripts):
+    """Turn đã lưu script context (như invoke_agent lưu cùng chat history)"""
+    scripts_xml = script_service.wrap_scripts_xml(
+        [script_service.agent_script_to_xml(script) for script in scripts]
+    )
+    messages = [
+        ModelResponse(
+            parts=[TextPart(content=f"{SCRIPT_CONTEXT_PREFIX}\n{scripts_xml}")]
+        ),
+        ModelRequest(parts=[UserPromptPart(content="Giá bao nhiêu?")]),
+        ModelResponse(parts=[TextPart(content="Giá 500.000đ ạ")]),
+    ]
+    return MemoryTurn(messages, None, 0, extract_script_versions(messages))
+
+
+def test_extracts_versions_from_stored_context():
+    a, b = _script("a"), _script("b")
+    turn = _carrier_turn(a, b)
+    assert turn.script_versions == {
+        "a": script_version(a.description, a.solution),
+        "b": script_version(b.description, b.solution),
+    }
+    # Output của agent có thẻ script không được tính
+    reply = [ModelResponse(parts=[TextPart(content='<script id="x" version="1">')])]
+    assert extract_script_versions(reply) == {}
+
+
+def test_only_new_or_changed_scripts_are_sent_in_full():
+    seen = seen_script_versions([_carrier_turn(_script("a"), _script("b"))])
+    entries = build_script_entries(
+        [
+            (_script("a"), 0.9),
+            (_script("b", "Giá mới 450.000đ"), 0.8),
+            (_script("c"), None),
+        ],
+        seen,
+        script_service.agent_script_to_xml,
+    )
+    assert [entry.is_reference for entry in entries] == [True, False, False]
+    assert entries[0].xml == '<script_ref id="a" />'
+    assert entries[1].xml.startswith('<script id="b" version=')
+    assert not missing_references(entries, seen)
+
+
+def test_references_break_when_window_slides():
+    seen = seen_script_versions([_carrier_turn(_script("a"))])
+    entries = build_script_entries(
+        [(_script("a"), 0.9)], seen, script_service.agent_script_to_xml
+    )
+    assert entries[0].is_reference
+    # Turn chứa script đã ra khỏi history: tham chiếu không còn hợp lệ
+    assert missing_references(entries, seen_script_versions([]))
+    resent = build_script_entries(
+        [(_script("a"), 0.9)], {}, script_service.agent_script_to_xml
+    )
+    assert not resent[0].is_reference
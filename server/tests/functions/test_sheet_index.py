@@ -0,0 +1,67 @@
+"""
+Test file for sheet_index.py - map sheet_id / tên bảng model sinh ra về sheet
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from app.services import sheet_service
+from app.utils.sheet_index import SheetIndex
+
+
+def _sheet(sheet_id, table_name, name):
+    return SimpleNamespace(id=sheet_id, table_name=table_name, name=name)
+
+
+SHEETS = [
+    _sheet(
+        "3f2b6c1e-8a4d-4e0b-9c5f-1d2e3f4a5b6c", "bang_gia_dich_vu", "Bảng giá dịch vụ"
+    ),
+    _sheet("9a8b7c6d-5e4f-4a3b-8c2d-1e0f9a8b7c6d", "chi_nhanh", "Chi nhánh"),
+    _sheet("0f1e2d3c-4b5a-4968-8776-655443322110", "khuyen_mai", "Khuyến mãi"),
+]
+
+
+def test_resolve_separator_variants():
+    index = SheetIndex(SHEETS)
+
+    for value in (
+        "3f2b6c1e_8a4d_4e0b_9c5f_1d2e3f4a5b6c",
+        "3F2B6C1E-8A4D-4E0B-9C5F-1D2E3F4A5B6C",
+        "bang-gia-dich-vu",
+        "Bảng giá dịch vụ",
+    ):
+        match = index.resolve(value)
+        assert match.sheet.id == SHEETS[0].id
+        assert match.score == 100
+
+
+def test_resolve_fuzzy():
+    index = SheetIndex(SHEETS)
+
+    match = index.resolve("bang_gia_dichvu")
+    assert match.sheet.table_name == "bang_gia_dich_vu"
+    assert 60 <= match.score < 100
+    assert index.resolve("lich_hen").score < 60
+    assert SheetIndex([]).resolve("chi_nhanh").sheet is None
+
+
+def test_published_sheet_index_is_rebuilt_after_mutation(monkeypatch):
+    loads = []
+
+    async def get_all_sheets_by_status(db, status):
+        loads.append(status)
+        return SHEETS
+
+    monkeypatch.setattr(
+        sheet_service.sheet_repository,
+        "get_all_sheets_by_status",
+        get_all_sheets_by_status,
+    )
+    sheet_service.invalidate_catalogue()
+
+    first = asyncio.run(sheet_service.get_published_sheet_index(None))
+    assert asyncio.run(sheet_service.get_published_sheet_index(None)) is first
+    sheet_service.invalidate_catalogue()
+    assert asyncio.run(sheet_service.get_published_sheet_index(None)) is not first
+    assert loads == ["published", "published"]
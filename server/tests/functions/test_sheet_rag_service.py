@@ -0,0 +1,141 @@
+"""
+Test file for sheet_rag_service.py - group-by row_id trên Qdrant (client giả lập)
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+from app.services.integrations import sheet_rag_service
+
+SPARSE_EMBEDDING = SimpleNamespace(
+    indices=np.array([3, 7]), values=np.array([0.5, 0.25])
+)
+
+
+def _client(**methods) -> MagicMock:
+    client = MagicMock()
+    for name, value in methods.items():
+        setattr(client, name, AsyncMock(**value))
+    return client
+
+
+def _patch_embeddings():
+    sparse_model = MagicMock()
+    sparse_model.query_embed.return_value = iter([SPARSE_EMBEDDING])
+    return (
+        patch.object(sheet_rag_service, "sparse_embedding_model", sparse_model),
+        patch.object(
+            sheet_rag_service.jina,
+            "get_embeddings",
+            AsyncMock(return_value=[[0.1] * 1024]),
+        ),
+    )
+
+
+def test_query_sheet_row_ids_groups_by_row():
+    groups = [SimpleNamespace(id=row_id, hits=[]) for row_id in (12, 3, 7)]
+    client = _client(
+        query_points_groups={"return_value": SimpleNamespace(groups=groups)}
+    )
+    sparse_patch, jina_patch = _patch_embeddings()
+
+    with sparse_patch, jina_patch, patch.object(
+        sheet_rag_service, "create_qdrant_client", return_value=client
+    ):
+        row_ids = asyncio.run(
+            sheet_rag_service.query_sheet_row_ids("gội đầu", "sheet-1", 3)
+        )
+
+    assert row_ids == [12, 3, 7]
+    kwargs = client.query_points_groups.await_args.kwargs
+    assert kwargs["group_by"] == "row_id"
+    assert kwargs["group_size"] == 1
+    assert kwargs["with_payload"] is False
+    assert kwargs["limit"] == 3
+    assert kwargs["query_filter"].must[0].match.value == "sheet-1"
+    # Prefetch lấy đủ chunk để group-by ra `limit` dòng khác nhau
+    assert all(
+        prefetch.limit == 3 * sheet_rag_service.PREFETCH_CHUNKS_PER_ROW
+        for prefetch in kwargs["prefetch"]
+    )
+
+
+def test_search_rows_by_sheet_id_keeps_group_order():
+    sheet = SimpleNamespace(id="sheet-1", name="Bảng giá", table_name="bang_gia")
+    get_rows = AsyncMock(return_value=[{"id": 3}, {"id": 7}, {"id": 12}])
+
+    @asynccontextmanager
+    async def async_session():
+        yield None
+
+    with patch.object(
+        sheet_rag_service,
+        "query_sheet_row_ids",
+        AsyncMock(return_value=[12, 3, 7]),
+    ), patch.object(sheet_rag_service, "async_session", async_session), patch.object(
+        sheet_rag_service.sheet_repository,
+        "get_sheet_by_id",
+        AsyncMock(return_value=sheet),
+    ), patch.object(
+        sheet_rag_service.sheet_repository, "get_rows_with_ids", get_rows
+    ):
+        found, rows = asyncio.run(
+            sheet_rag_service.search_rows_by_sheet_id("sheet-1", "gội đầu", 3)
+        )
+
+    assert found is sheet
+    assert [row["id"] for row in rows] == [12, 3, 7]
+    assert get_rows.await_args.args[1:] == ("bang_gia", [12, 3, 7])
+
+
+def test_search_rows_by_sheet_id_missing_sheet():
+    @asynccontextmanager
+    async def async_session():
+        yield None
+
+    with patch.object(
+        sheet_rag_service, "query_sheet_row_ids", AsyncMock(return_value=[1])
+    ), patch.object(sheet_rag_service, "async_session", async_session), patch.object(
+        sheet_rag_service.sheet_repository,
+        "get_sheet_by_id",
+        AsyncMock(return_value=None),
+    ):
+        result = asyncio.run(
+            sheet_rag_service.search_rows_by_sheet_id("sheet-x", "gội đầu")
+        )
+
+    assert result == (None, [])
+
+
+def test_backfill_row_ids_pages_until_done():
+    def point(point_id, chunk_id):
+        return SimpleNamespace(id=point_id, payload={"id": chunk_id})
+
+    client = _client(
+        scroll={
+            "side_effect": [
+                ([point("a", "12_0"), point("b", "12_1")], "b"),
+                ([point("c", "7_0")], None),
+            ]
+        },
+        batch_update_points={},
+    )
+
+    with patch.object(sheet_rag_service, "create_qdrant_client", return_value=client):
+        asyncio.run(sheet_rag_service.backfill_row_ids())
+
+    assert client.scroll.await_count == 2
+    assert client.scroll.await_args_list[1].kwargs["offset"] == "b"
+    operations = [
+        operation.set_payload
+        for call in client.batch_update_points.await_args_list
+        for operation in call.kwargs["update_operations"]
+    ]
+    assert [(op.points, op.payload) for op in operations] == [
+        (["a"], {"row_id": 12}),
+        (["b"], {"row_id": 12}),
+        (["c"], {"row_id": 7}),
+    ]
@@ -0,0 +1,58 @@
+"""
+Test file for stream_agent_output - stream trả lời của agent theo từng section
+"""
+
+import asyncio
+
+from app.pydantic_agents import stream_agent_output
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelRequest, ToolReturnPart
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+
+FINAL_ANSWER = "Liệu trình trị mụn giá 500.000đ ạ\n---\nChị muốn đặt lịch không ạ?"
+
+
+def _has_tool_return(messages) -> bool:
+    return any(
+        isinstance(part, ToolReturnPart)
+        for message in messages
+        if isinstance(message, ModelRequest)
+        for part in message.parts
+    )
+
+
+async def stream_reply(messages, info):
+    if not _has_tool_return(messages):
+        # Gemini hay trả text cùng lúc với tool call
+        yield "Dạ để em kiểm tra giá ạ"
+        yield {0: DeltaToolCall(name="get_price", json_args='{"service": "trị mụn"}')}
+        return
+    for i in range(0, len(FINAL_ANSWER), 7):
+        yield FINAL_ANSWER[i : i + 7]
+
+
+def test_text_with_tool_call_is_not_the_final_answer():
+    """Test response có text kèm tool call: tool được chạy và model được gọi lại"""
+    agent = Agent(FunctionModel(stream_function=stream_reply))
+    tool_calls = []
+
+    @agent.tool_plain
+    def get_price(service: str) -> str:
+        tool_calls.append(service)
+        return "500.000đ"
+
+    sent = []
+
+    async def on_parts(parts):
+        sent.extend(part.payload for part in parts)
+
+    output, _, remaining, usage = asyncio.run(
+        stream_agent_output(agent, "Trị mụn giá bao nhiêu?", on_parts)
+    )
+
+    assert tool_calls == ["trị mụn"]
+    assert usage.requests == 2
+    assert output == FINAL_ANSWER
+    # Section đầu được gửi trong lúc stream, text đi kèm tool call thì không
+    assert sent == ["Liệu trình trị mụn giá 500.000đ ạ"]
+    assert [part.payload for part in remaining] == ["Chị muốn đặt lịch không ạ?"]
@@ -0,0 +1,54 @@
+"""
+Test file for message_utils.StreamingMessageFormatter - định dạng output đang stream
+"""
+
+import pytest
+from app.utils.message_utils import StreamingMessageFormatter, parse_and_format_message
+
+MESSAGE = """Chào chị, bên em có 2 liệu trình phù hợp ạ:
+
+---
+**Liệu trình A**: 500.000đ/buổi
+![A](https://cdn.example.com/a.jpg)
+---
+**Liệu trình B**: 700.000đ/buổi, xem [bảng giá](https://example.com/gia.pdf)
+***
+Chị muốn đặt lịch ngày nào ạ?"""
+
+
+def _stream(formatter, text, step):
+    emitted = []
+    for i in range(0, len(text), step):
+        emitted.append(formatter.feed(text[i : i + step]))
+    return emitted
+
+
+@pytest.mark.parametrize("step", [1, 7, 50, len(MESSAGE)])
+def test_stream_matches_parse_and_format_message(step):
+    """Test ghép kết quả stream giống hệt parse_and_format_message"""
+    formatter = StreamingMessageFormatter()
+    emitted = _stream(formatter, MESSAGE, step)
+    parts = [part for chunk in emitted for part in chunk] + formatter.flush()
+    assert parts == parse_and_format_message(MESSAGE)
+
+
+def test_first_section_is_emitted_before_generation_ends():
+    """Test section đầu được trả về ngay khi section thứ hai bắt đầu"""
+    formatter = StreamingMessageFormatter()
+    assert formatter.feed("Chào chị ạ\n") == []
+    assert formatter.feed("---\n") == []
+    # Dòng "--" còn có thể là separator, chưa chắc có section thứ hai
+    assert formatter.feed("--") == []
+    # Dòng đang viết dở không thể là separator: chắc chắn có section thứ hai
+    parts = formatter.feed("-\nLiệu trình A")
+    assert [part.payload for part in parts] == ["Chào chị ạ"]
+    assert formatter.feed(" giá 500.000đ") == []
+    assert [part.payload for part in formatter.flush()] == ["Liệu trình A giá 500.000đ"]
+
+
+def test_single_section_waits_for_flush():
+    """Test output không có separator được xử lý như bản không stream"""
+    formatter = StreamingMessageFormatter()
+    text = "Xem ảnh ![spa](https://cdn.example.com/spa.jpg) nhé\n---\n"
+    assert _stream(formatter, text, 5) == [[]] * len(range(0, len(text), 5))
+    assert formatter.flush() == parse_and_format_message(text)
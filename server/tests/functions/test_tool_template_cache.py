@@ -0,0 +1,48 @@
+"""
+Test file for string_utils - cache template Jinja đã compile của notification
+"""
+
+import pytest
+from app.utils.string_utils import (
+    ToolTemplateCache,
+    render_tool_template,
+    validate_tool_template,
+)
+from jinja2.exceptions import SecurityError
+
+
+def test_cache_reuses_template_until_content_changes():
+    cache = ToolTemplateCache(max_size=10)
+    template = cache.get("Khách {{ name }}", "n1")
+
+    assert cache.get("Khách {{ name }}", "n1") is template
+    updated = cache.get("Khách {{ name }} lúc {{ time }}", "n1")
+    assert updated is not template
+    assert updated.render(name="An", time="9h") == "Khách An lúc 9h"
+    assert cache.get_metrics()["entries"] == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ToolTemplateCache(max_size=2)
+    first = cache.get("{{ a }}", "n1")
+    cache.get("{{ b }}", "n2")
+    cache.get("{{ a }}", "n1")
+    cache.get("{{ c }}", "n3")
+
+    assert cache.get("{{ a }}", "n1") is first
+    assert cache.get_metrics()["entries"] == 2
+    cache.get("{{ b }}", "n2")
+    assert cache.misses == 4
+
+
+def test_validate_tool_template():
+    assert validate_tool_template("Khách {{ name }}") is None
+    assert validate_tool_template("Khách {{ name }") is not None
+    assert validate_tool_template("{% if x %}chưa đóng") is not None
+
+
+def test_render_is_sandboxed():
+    assert render_tool_template("Khách {{ name }}", name="An") == "Khách An"
+    with pytest.raises(SecurityError):
+        render_tool_template("{{ name.__class__.__mro__ }}", name="An")
@@ -0,0 +1,71 @@
+"""
+Test file for unaccent.py - tìm kiếm không dấu trên các cột text của sheet
+"""
+
+import unicodedata
+from types import SimpleNamespace
+
+from app.services.sheet_service import unaccent_index_sql
+from app.utils.agent_utils import relax_pgroonga_query, rewrite_unaccent_predicates
+from app.utils.sheet_index import SheetIndex
+from app.utils.unaccent import ACCENTED_CHARS, PLAIN_CHARS, has_accents, unaccent
+
+
+def test_unaccent_vietnamese():
+    assert unaccent("Tàn nhang, ĐIỀU TRỊ MỤN ở Đà Nẵng") == (
+        "Tan nhang, DIEU TRI MUN o Da Nang"
+    )
+    # Dấu dạng tổ hợp (NFD) cũng được bỏ
+    assert unaccent(unicodedata.normalize("NFD", "Khuyến mãi")) == "Khuyen mai"
+    assert unaccent("giá 100.000đ") == "gia 100.000d"
+    assert not has_accents("tan nhang")
+    assert has_accents("tàn nhang")
+    # Bảng map của hàm SQL vi_unaccent khớp 1-1
+    assert len(ACCENTED_CHARS) == len(PLAIN_CHARS)
+    assert PLAIN_CHARS.isascii()
+
+
+def test_rewrite_unaccent_predicates():
+    query = (
+        'SELECT "ten" FROM "bang_gia" tb '
+        'WHERE (tb."mo_ta" &@~ \'"tàn nhang"\') AND ("ma" &@~ \'Đ01\') '
+        "OR ten &@~ 'Nám'"
+    )
+    rewritten = rewrite_unaccent_predicates(query, {"mo_ta", "ten"})
+    assert rewritten == (
+        'SELECT "ten" FROM "bang_gia" tb '
+        'WHERE (vi_unaccent(tb."mo_ta") &@~ \'"tan nhang"\') AND ("ma" &@~ \'Đ01\') '
+        "OR vi_unaccent(ten) &@~ 'Nam'"
+    )
+    # Không rewrite lại lần nữa, fallback OR vẫn nhận ra điều kiện
+    assert rewrite_unaccent_predicates(rewritten, {"mo_ta", "ten"}) == rewritten
+    query = "SELECT * FROM t WHERE ten &@~ 'tàn nhang'"
+    relaxed = relax_pgroonga_query(rewrite_unaccent_predicates(query, {"ten"}))
+    assert 'vi_unaccent(ten) &@~ \'"tan" OR "nhang"\'' in relaxed
+
+
+def test_sheet_index_text_columns():
+    sheet = SimpleNamespace(
+        id="9a8b7c6d-5e4f-4a3b-8c2d-1e0f9a8b7c6d",
+        table_name="chi_nhanh",
+        name="Chi nhánh",
+        column_config=[
+            {"column_name": "id", "column_type": "Integer"},
+            {"column_name": "ten", "column_type": "String"},
+            {"column_name": "dia_chi", "column_type": "Text"},
+        ],
+    )
+    match = SheetIndex([sheet]).resolve("chi_nhanh")
+    assert match.sheet.text_columns == {"ten", "dia_chi"}
+
+
+def test_unaccent_index_sql_name_length():
+    table_name = "9a8b7c6d_5e4f_4a3b_8c2d_1e0f9a8b7c6d"
+    long_a = unaccent_index_sql(table_name, "ghi_chu_cua_khach_hang_ve_dich_vu_1")
+    long_b = unaccent_index_sql(table_name, "ghi_chu_cua_khach_hang_ve_dich_vu_2")
+    name_a = long_a.split('"')[1]
+    assert len(name_a) <= 63
+    assert name_a != long_b.split('"')[1]
+    assert 'USING pgroonga (vi_unaccent("ghi_chu_cua_khach_hang_ve_dich_vu_1"))' in (
+        long_a
+    )
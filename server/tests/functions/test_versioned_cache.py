@@ -0,0 +1,51 @@
+"""
+Test file for versioned_cache.py - giá trị build lại khi catalogue version đổi
+"""
+
+import asyncio
+
+from app.utils.versioned_cache import VersionedCache
+
+
+def test_concurrent_gets_build_once():
+    version = [0]
+    builds = []
+    cache = VersionedCache(lambda: version[0], ttl_seconds=60)
+
+    async def build():
+        builds.append(version[0])
+        await asyncio.sleep(0.01)
+        return object()
+
+    async def run():
+        return await asyncio.gather(*(cache.get(build) for _ in range(5)))
+
+    values = asyncio.run(run())
+    assert len(builds) == 1
+    assert all(value is values[0] for value in values)
+
+    version[0] += 1
+    assert asyncio.run(cache.get(build)) is not values[0]
+    assert builds == [0, 1]
+
+
+def test_value_built_during_version_change_is_not_cached():
+    version = [0]
+    cache = VersionedCache(lambda: version[0], ttl_seconds=60)
+
+    async def build():
+        version[0] += 1
+        return object()
+
+    first = asyncio.run(cache.get(build))
+    assert asyncio.run(cache.get(build)) is not first
+
+
+def test_expired_value_is_rebuilt():
+    cache = VersionedCache(lambda: 0, ttl_seconds=0)
+
+    async def build():
+        return object()
+
+    first = asyncio.run(cache.get(build))
+    assert asyncio.run(cache.get(build)) is not first
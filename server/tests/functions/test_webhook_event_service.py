@@ -0,0 +1,152 @@
+"""
+Test file for webhook_event_service.py - webhook signature and deduplication
+"""
+
+import asyncio
+import hashlib
+import hmac
+from unittest.mock import AsyncMock, patch
+
+from app.services import webhook_event_service
+from app.utils.bloom_filter import BloomFilter, RotatingBloomFilter
+
+
+def _message_event(mid: str) -> dict:
+    return {
+        "sender": {"id": "sender-1"},
+        "recipient": {"id": "page-1"},
+        "timestamp": 1640995200000,
+        "message": {"mid": mid, "text": "Xin chào"},
+    }
+
+
+def test_bloom_filter_has_no_false_negative():
+    """Test mọi key đã thêm đều được tìm thấy"""
+    bloom = BloomFilter(capacity=1000, error_rate=1e-4)
+    keys = [f"m_{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other_{i}" in bloom for i in range(10000))
+    assert false_positives < 10
+
+
+def test_rotating_bloom_filter_expires_keys():
+    """Test key hết hạn sau hai lần xoay vòng"""
+    bloom = RotatingBloomFilter(ttl_seconds=0, capacity=100)
+    bloom.add("m_1")
+    # Mỗi lần kiểm tra với ttl=0 đều xoay vòng một thế hệ
+    assert "m_1" in bloom
+    assert "m_1" not in bloom
+
+
+def test_get_event_key():
+    """Test key của message là mid, của delivery/read là watermark"""
+    assert webhook_event_service.get_event_key(_message_event("m_abc")) == (
+        "m_abc",
+        None,
+    )
+    read_event = {"sender": {"id": "sender-1"}, "read": {"watermark": 1458668856253}}
+    assert webhook_event_service.get_event_key(read_event) == (
+        "read:sender-1:1458668856253",
+        1458668856253,
+    )
+    assert webhook_event_service.get_event_key({"sender": {"id": "x"}}) == (
+        None,
+        None,
+    )
+
+
+def test_verify_signature():
+    """Test xác thực X-Hub-Signature-256"""
+    payload = b'{"object": "page", "entry": []}'
+    with patch.object(webhook_event_service.env_config, "APP_SECRET", "secret"):
+        signature = hmac.new(b"secret", payload, hashlib.sha256).hexdigest()
+        assert webhook_event_service.verify_signature(payload, f"sha256={signature}")
+        assert not webhook_event_service.verify_signature(payload, "sha256=deadbeef")
+        assert not webhook_event_service.verify_signature(payload, None)
+
+    with patch.object(webhook_event_service.env_config, "APP_SECRET", None):
+        assert webhook_event_service.verify_signature(payload, None)
+
+
+def test_claim_event_rejects_redelivered_message():
+    """Test message gửi lại bị từ chối bằng SELECT, không INSERT lần thứ hai"""
+    insert_mock = AsyncMock(return_value=True)
+    exists_mock = AsyncMock(return_value=True)
+    with patch.object(
+        webhook_event_service,
+        "_seen_events",
+        RotatingBloomFilter(ttl_seconds=3600, capacity=100),
+    ), patch.object(
+        webhook_event_service.webhook_event_repository,
+        "insert_event_if_absent",
+        insert_mock,
+    ), patch.object(
+        webhook_event_service.webhook_event_repository, "event_exists", exists_mock
+    ), patch.object(
+        webhook_event_service, "with_session", new=lambda func: func(None)
+    ), patch.object(
+        webhook_event_service, "_schedule_cleanup"
+    ):
+        event = _message_event("m_redelivered")
+        assert asyncio.run(webhook_event_service.claim_event(event)) is True
+        assert asyncio.run(webhook_event_service.claim_event(event)) is False
+        assert insert_mock.await_count == 1
+        assert exists_mock.await_count == 1
+
+
+def test_claim_event_confirms_bloom_filter_hit():
+    """Test Bloom filter báo nhầm: event chưa có trong DB vẫn được xử lý"""
+    seen_events = RotatingBloomFilter(ttl_seconds=3600, capacity=100)
+    seen_events.add("m_false_positive")
+    insert_mock = AsyncMock(return_value=True)
+    with patch.object(webhook_event_service, "_seen_events", seen_events), patch.object(
+        webhook_event_service.webhook_event_repository,
+        "insert_event_if_absent",
+        insert_mock,
+    ), patch.object(
+        webhook_event_service.webhook_event_repository,
+        "event_exists",
+        AsyncMock(return_value=False),
+    ), patch.object(
+        webhook_event_service, "with_session", new=lambda func: func(None)
+    ), patch.object(
+        webhook_event_service, "_schedule_cleanup"
+    ):
+        event = _message_event("m_false_positive")
+        assert asyncio.run(webhook_event_service.claim_event(event)) is True
+        assert insert_mock.await_count == 1
+
+
+def test_release_event_deletes_claim():
+    """Test event xử lý lỗi được bỏ claim để lần gửi lại được xử lý"""
+    delete_mock = AsyncMock(return_value=1)
+    with patch.object(
+        webhook_event_service.webhook_event_repository, "delete_event", delete_mock
+    ), patch.object(webhook_event_service, "with_session", new=lambda func: func(None)):
+        asyncio.run(webhook_event_service.release_event(_message_event("m_failed")))
+
+    assert delete_mock.await_args.args[1] == "m_failed"
+
+
+def test_claim_event_rejects_event_seen_by_database():
+    """Test event đã có trong DB (worker khác, sau restart) bị từ chối"""
+    with patch.object(
+        webhook_event_service,
+        "_seen_events",
+        RotatingBloomFilter(ttl_seconds=3600, capacity=100),
+    ), patch.object(
+        webhook_event_service.webhook_event_repository,
+        "insert_event_if_absent",
+        AsyncMock(return_value=False),
+    ), patch.object(
+        webhook_event_service, "with_session", new=lambda func: func(None)
+    ), patch.object(
+        webhook_event_service, "_schedule_cleanup"
+    ):
+        assert (
+            asyncio.run(webhook_event_service.claim_event(_message_event("m_old")))
+            is False
+        )